@@ -1,4 +1,5 @@
 import subprocess
+from datetime import datetime
 from time import sleep
 
 import pytest
@@ -7,6 +8,8 @@ from flask import Flask
 
 from odinapi.api import create_app
 from odinapi.odin_config import TestConfig
+from odinapi.utils import data_version as data_version_module
+from odinapi.utils.data_version import DataVersion
 
 WAIT_FOR_SERVICE_TIME = 60 * 5
 PAUSE_TIME = 5
@@ -51,3 +54,23 @@ def app_context():
     app = create_app(config)
     with app.app_context():
         yield
+
+
+@pytest.fixture(autouse=True)
+def process_caches(mocker):
+    """Start every test without the process wide data version and imports"""
+    mocker.patch.object(data_version_module, "_cache", None)
+    mocker.patch.object(data_version_module, "_version_cache", None)
+    mocker.patch.object(data_version_module, "_import_index", None)
+
+
+@pytest.fixture
+def data_version(mocker):
+    """Fixed data versions for the ETags of views with conditional GET"""
+    version = DataVersion(datetime(2020, 1, 2), datetime(2020, 1, 1))
+    mocker.patch("odinapi.utils.conditional.get_data_version", return_value=version)
+    mocker.patch(
+        "odinapi.utils.conditional.get_latest_import", return_value=version.imported
+    )
+    mocker.patch("odinapi.utils.conditional.get_table_version", return_value=1)
+    return version
@@ -1,5 +1,6 @@
 """A complex datamodel implementation"""
 
+import logging
 from pathlib import Path
 
 import yaml
@@ -12,6 +13,9 @@ from odinapi.custom_json import CustomJSONProvider
 from .odin_config import Config, ProdConfig, TestConfig
 from .blueprints import register_blueprints
 from .pg_database import db
+from .views.calibration_cache import get_median_fit_cache
+from .views.read_apriori import get_apriori_store
+from .views.scan_index import get_scan_index
 
 
 def load_swagger_specs():
@@ -71,8 +75,35 @@ def create_app(config: Config = ProdConfig()):
 
     db.init_app(app)
     register_blueprints(app)
+    if app.config.get("PRELOAD_CACHES"):
+        preload_caches(app)
     return app
 
 
+def preload_caches(app: Flask):
+    """Warm the process wide caches
+
+    With gunicorn preload_app this runs before the workers are forked, so
+    that they share the cached data. The database connections are closed
+    afterwards, they must not be shared by the workers.
+    """
+    loaders = {
+        "median fits": lambda: get_median_fit_cache().load(),
+        "scan index": lambda: get_scan_index().load(),
+        "apriori data": lambda: get_apriori_store().preload(),
+    }
+    with app.app_context():
+        try:
+            for name, load in loaders.items():
+                try:
+                    load()
+                except Exception:
+                    logging.getLogger("odinapi").exception("could not preload %s", name)
+                    db.session.rollback()
+        finally:
+            db.session.remove()
+            db.engine.dispose()
+
+
 def run():
     return create_app(TestConfig())
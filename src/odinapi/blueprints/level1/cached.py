@@ -1,5 +1,6 @@
 from flask import Blueprint
 
+from odinapi.utils.conditional import register_conditional_get
 from odinapi.views.views_cached import (
     DateBackendInfoCached,
     DateInfoCached,
@@ -30,3 +31,7 @@ cached.add_url_rule(
     "<int:freqmode>/<int:scanno>/",
     view_func=FreqmodeInfoCached.as_view("scaninfo"),
 )
+
+register_conditional_get(
+    cached, ["periodinfo", "freqmodeinfo", "backendinfo", "scansinfo", "scaninfo"]
+)
@@ -1,5 +1,6 @@
 from flask import Blueprint
 
+from odinapi.utils.conditional import register_conditional_get
 from odinapi.views.data_info import FileInfo
 
 
@@ -7,3 +8,5 @@ fileinfo = Blueprint("fileinfo", __name__)
 fileinfo.add_url_rule(
     "/rest_api/<version>/file_info/", view_func=FileInfo.as_view("file_info")
 )
+
+register_conditional_get(fileinfo, ["file_info"])
@@ -1,12 +1,17 @@
 from flask import Blueprint
 
+from odinapi.utils.conditional import make_request_etag, register_conditional_get
 from odinapi.views.views import (
     CollocationsView,
     FreqmodeInfoNoBackend,
     ScanAPRNoBackend,
     ScanInfoNoBackend,
+    ScanPTZListNoBackend,
     ScanPTZNoBackend,
+    ScanSpecListNoBackend,
     ScanSpecNoBackend,
+    make_apriori_etag,
+    make_ptz_etag,
 )
 from odinapi.views.views_cached import (
     FreqmodeInfoCachedNoBackend,
@@ -24,10 +29,18 @@ no_backend.add_url_rule(
     "/rest_api/<version>/level1/<int:freqmode>/<int:scanno>/L1b/",
     view_func=ScanSpecNoBackend.as_view("l1bv5"),
 )
+no_backend.add_url_rule(
+    "/rest_api/<version>/level1/<int:freqmode>/L1b/",
+    view_func=ScanSpecListNoBackend.as_view("l1blistv5"),
+)
 no_backend.add_url_rule(
     "/rest_api/<version>/level1/<int:freqmode>/<int:scanno>/ptz/",
     view_func=ScanPTZNoBackend.as_view("ptznobackend"),
 )
+no_backend.add_url_rule(
+    "/rest_api/<version>/level1/<int:freqmode>/ptz/",
+    view_func=ScanPTZListNoBackend.as_view("ptzlistv5"),
+)
 no_backend.add_url_rule(
     "/rest_api/<version>/level1/<int:freqmode>/<int:scanno>/apriori/<species>/",
     view_func=ScanAPRNoBackend.as_view("apriorinobackend"),
@@ -58,3 +71,19 @@ no_backend.add_url_rule(
     "/rest_api/<version>/freqmode_raw/<date>/<int:freqmode>/<int:scanno>/",
     view_func=ScanInfoNoBackend.as_view("scaninforawnobackend"),
 )
+
+register_conditional_get(
+    no_backend,
+    dict(
+        scanlogv5=make_request_etag,
+        l1bv5=make_request_etag,
+        l1blistv5=make_request_etag,
+        scanslist=make_request_etag,
+        scansinfonobackend=make_request_etag,
+        scaninfonobackend=make_request_etag,
+        scansinforawnobackend=make_request_etag,
+        scaninforawnobackend=make_request_etag,
+        ptznobackend=make_ptz_etag,
+        apriorinobackend=make_apriori_etag,
+    ),
+)
@@ -1,5 +1,6 @@
 from flask import Blueprint
 
+from ...utils.conditional import register_conditional_get
 from ...views.views import DateBackendInfo, DateInfo, FreqmodeInfo
 
 
@@ -20,3 +21,5 @@ raw.add_url_rule(
     "/rest_api/<version>/freqmode_raw/<date>/<backend>/<int:freqmode>/<int:scanno>/",
     view_func=FreqmodeInfo.as_view("scanraw"),
 )
+
+register_conditional_get(raw, ["freqmoderaw", "backendraw", "scansraw", "scanraw"])
@@ -1,6 +1,13 @@
 from flask import Blueprint
 
-from ...views.views import ScanAPR, ScanPTZ, ScanSpec
+from ...utils.conditional import make_request_etag, register_conditional_get
+from ...views.views import (
+    ScanAPR,
+    ScanPTZ,
+    ScanSpec,
+    make_apriori_etag,
+    make_ptz_etag,
+)
 from ...views.views_cached import L1LogCached_v4
 
 scan = Blueprint("level1_scan", __name__)
@@ -21,3 +28,13 @@ scan.add_url_rule(
     "<int:freqmode>/<int:scanno>/",
     view_func=ScanAPR.as_view("apriori"),
 )
+
+register_conditional_get(
+    scan,
+    dict(
+        scanlog=make_request_etag,
+        scan=make_request_etag,
+        ptz=make_ptz_etag,
+        apriori=make_apriori_etag,
+    ),
+)
@@ -1,5 +1,6 @@
 from flask import Blueprint
 
+from ..utils.conditional import make_collocations_etag, register_conditional_get
 from ..views.views import (
     VdsDateInfo,
     VdsExtData,
@@ -33,3 +34,15 @@ vds_views.add_url_rule(
     "/<date>/<file>/<file_index>/",
     view_func=VdsExtData.as_view("vdsextdata"),
 )
+
+register_conditional_get(
+    vds_views,
+    [
+        "vdsinfo",
+        "vdsfreqmodeinfo",
+        "vdsScaninfo",
+        "vdsinstrumentinfo",
+        "vdsdateinfo",
+    ],
+    make_collocations_etag,
+)
@@ -0,0 +1,575 @@
+"""Keep scans_cache and measurements_cache up to date with level0 imports
+
+New rows in level0_files_imported are turned into stw ranges, the scans in
+these ranges get new scan logs in scans_cache, and the number of scans per
+day is counted again in measurements_cache for the days that changed, and
+per month in measurements_monthly for their months. The time of the last
+handled import is kept in the materialise_state table, so that every run
+starts where the previous one stopped. Imports are only handled once they
+are a few minutes old, so that an import that is still being committed is
+not passed by.
+
+    python -m odinapi.materialise [--interval SECONDS] [--local | --live]
+"""
+
+import argparse
+import logging
+import time
+from datetime import date, datetime, timedelta
+from logging import config
+from pathlib import Path
+from typing import Any, Iterable
+
+from sqlalchemy import text
+from yaml import safe_load
+
+from .api import create_app
+from .odin_config import LiveConfig, LocalConfig, ProdConfig
+from .pg_database import db, squeeze_query
+from .utils.concurrency import map_in_app_context
+from .utils.data_version import MATERIALISE_STATE_NAME
+from .utils.level0_files import (
+    LEVEL0_FILE_STW_SPAN,
+    REFERENCE_STW_MARGIN,
+    SCAN_STW_SPAN,
+    level0_file_stw,
+)
+from .utils.time_util import mjd2datetime
+from .views.level1b_scanlogdata_exporter import ScanInfoExporter
+
+logger = logging.getLogger("odinapi.materialise")
+
+STATE_NAME = MATERIALISE_STATE_NAME
+
+# scan log keys and the scans_cache columns they are stored in
+SCAN_LOG_COLUMNS = {
+    "ScanID": "scanid",
+    "AltEnd": "altend",
+    "AltStart": "altstart",
+    "LatEnd": "latend",
+    "LatStart": "latstart",
+    "LonEnd": "lonend",
+    "LonStart": "lonstart",
+    "MJDEnd": "mjdend",
+    "MJDStart": "mjdstart",
+    "NumSpec": "numspec",
+    "SunZD": "sunzd",
+    "DateTime": "datetime",
+    "Quality": "quality",
+}
+
+Scan = tuple[str, int, int]  # backend, freqmode, scanid
+
+# tables that are not derived from the level0 imports, but served with ETags
+VERSIONED_TABLES = ("collocations",)
+
+
+def ensure_schema() -> None:
+    """Create the materialiser state and the monthly rollup if missing
+
+    An empty rollup is filled from measurements_cache.
+    """
+    db.session.execute(
+        text(
+            squeeze_query(
+                """\
+            create table if not exists materialise_state (
+                name text primary key,
+                imported timestamp not null
+            )"""
+            )
+        )
+    )
+    db.session.execute(
+        text(
+            squeeze_query(
+                """\
+            create table if not exists measurements_monthly (
+                year integer not null,
+                month integer not null,
+                freqmode integer not null,
+                nscans bigint not null,
+                primary key (year, month, freqmode)
+            )"""
+            )
+        )
+    )
+    db.session.execute(
+        text(
+            squeeze_query(
+                """\
+            insert into measurements_monthly (year, month, freqmode, nscans)
+            select extract(year from date), extract(month from date), freqmode,
+                sum(nscans)
+            from measurements_cache
+            where not exists (select 1 from measurements_monthly)
+            group by 1, 2, 3"""
+            )
+        )
+    )
+    ensure_latest_imports()
+    for table in VERSIONED_TABLES:
+        ensure_table_version(table)
+    db.session.commit()
+
+
+def ensure_latest_imports() -> None:
+    """Create the latest import per level0 file type if missing
+
+    level0_files_latest has the latest imported file for each file type,
+    the extension of the file name, e.g. ac1 for 342009ec.ac1. A trigger on
+    level0_files_imported keeps it up to date whoever does the import, and
+    an empty table is filled from the imports. Nothing is done once the
+    trigger is installed, creating it locks level0_files_imported.
+    """
+    installed = db.session.execute(
+        text(
+            squeeze_query(
+                """\
+            select exists (
+                select 1 from pg_trigger
+                where tgname = 'level0_files_latest_update'
+                and tgrelid = 'level0_files_imported'::regclass
+            )"""
+            )
+        )
+    ).scalar_one()
+    if installed:
+        return
+    db.session.execute(
+        text(
+            squeeze_query(
+                """\
+            create table if not exists level0_files_latest (
+                file_type text primary key,
+                file text not null,
+                created timestamp not null
+            )"""
+            )
+        )
+    )
+    db.session.execute(
+        text(
+            squeeze_query(
+                """\
+            create or replace function level0_files_latest_update()
+            returns trigger language plpgsql as $$
+            begin
+                insert into level0_files_latest (file_type, file, created)
+                select lower(substring(new.file from '[.]([^./]+)$')), new.file,
+                    new.created
+                where new.file ~ '[.][^./]+$'
+                on conflict (file_type) do update
+                set file = excluded.file, created = excluded.created
+                where level0_files_latest.created < excluded.created;
+                return null;
+            end
+            $$"""
+            )
+        )
+    )
+    db.session.execute(
+        text(
+            squeeze_query(
+                """\
+            create trigger level0_files_latest_update
+            after insert or update on level0_files_imported
+            for each row execute function level0_files_latest_update()"""
+            )
+        )
+    )
+    db.session.execute(
+        text(
+            squeeze_query(
+                """\
+            insert into level0_files_latest (file_type, file, created)
+            select distinct on (file_type)
+                lower(substring(file from '[.]([^./]+)$')) as file_type,
+                file, created
+            from level0_files_imported
+            where file ~ '[.][^./]+$'
+            and not exists (select 1 from level0_files_latest)
+            order by file_type, created desc"""
+            )
+        )
+    )
+
+
+def ensure_table_version(table: str) -> None:
+    """Count the changes to a table in table_versions if not done already
+
+    A statement trigger on the table increments its version for every
+    insert, update, delete and truncate, whoever does them. Nothing is done
+    if the table is missing or the trigger is installed, creating it locks
+    the table.
+    """
+    installed = db.session.execute(
+        text(
+            squeeze_query(
+                """\
+            select to_regclass(:t) is null or exists (
+                select 1 from pg_trigger
+                where tgname = 'table_versions_update'
+                and tgrelid = to_regclass(:t)
+            )"""
+            )
+        ),
+        params=dict(t=table),
+    ).scalar_one()
+    if installed:
+        return
+    db.session.execute(
+        text(
+            squeeze_query(
+                """\
+            create table if not exists table_versions (
+                name text primary key,
+                version bigint not null
+            )"""
+            )
+        )
+    )
+    db.session.execute(
+        text(
+            squeeze_query(
+                """\
+            create or replace function table_versions_update()
+            returns trigger language plpgsql as $$
+            begin
+                insert into table_versions (name, version)
+                values (tg_table_name, 1)
+                on conflict (name) do update
+                set version = table_versions.version + 1;
+                return null;
+            end
+            $$"""
+            )
+        )
+    )
+    db.session.execute(
+        text(
+            squeeze_query(
+                f"""\
+            create trigger table_versions_update
+            after insert or update or delete or truncate on {table}
+            for each statement execute function table_versions_update()"""
+            )
+        )
+    )
+    db.session.execute(
+        text(
+            squeeze_query(
+                """\
+            insert into table_versions (name, version) values (:t, 1)
+            on conflict (name) do nothing"""
+            )
+        ),
+        params=dict(t=table),
+    )
+
+
+def get_watermark(initial_days: float) -> datetime | None:
+    """Time of the last handled import
+
+    The first run starts initial_days before the latest import. Returns
+    None if nothing has been imported.
+    """
+    watermark = db.session.execute(
+        text("select imported from materialise_state where name = :n"),
+        params=dict(n=STATE_NAME),
+    ).scalar_one_or_none()
+    if watermark is not None:
+        return watermark
+    latest = db.session.execute(
+        text("select max(created) from level0_files_imported")
+    ).scalar_one()
+    if latest is None:
+        return None
+    return latest - timedelta(days=initial_days)
+
+
+def set_watermark(imported: datetime) -> None:
+    db.session.execute(
+        text(
+            squeeze_query(
+                """\
+            insert into materialise_state (name, imported)
+            values (:n, :i)
+            on conflict (name) do update set imported = excluded.imported"""
+            )
+        ),
+        params=dict(n=STATE_NAME, i=imported),
+    )
+
+
+def get_imported_files(
+    watermark: datetime, settle: float
+) -> list[tuple[str, datetime]]:
+    """Imports after the watermark that are at least settle seconds old
+
+    The created time of an import is set before it is committed, newer
+    imports can still show up with an earlier time and are left for the
+    next run.
+    """
+    result = db.session.execute(
+        text(
+            squeeze_query(
+                """\
+            select file, created from level0_files_imported
+            where created > :w
+            and created <= localtimestamp - make_interval(secs => :s)
+            order by created"""
+            )
+        ),
+        params=dict(w=watermark, s=settle),
+    )
+    return [(row.file, row.created) for row in result]
+
+
+def get_stw_ranges(files: Iterable[str]) -> list[tuple[int, int]]:
+    """Merged stw ranges of the scans that can have data in the files
+
+    Files with names that can not be interpreted are skipped.
+    """
+    ranges = []
+    for name in files:
+        stw = level0_file_stw(name)
+        if stw is None:
+            logger.warning("skipping level0 file with unknown name %s", name)
+            continue
+        ranges.append(
+            (
+                # scans that start before the file can have data in it
+                stw - SCAN_STW_SPAN - REFERENCE_STW_MARGIN,
+                stw + LEVEL0_FILE_STW_SPAN + REFERENCE_STW_MARGIN,
+            )
+        )
+    merged: list[tuple[int, int]] = []
+    for stw1, stw2 in sorted(ranges):
+        if merged and stw1 <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stw2))
+        else:
+            merged.append((stw1, stw2))
+    return merged
+
+
+def get_scans(stw1: int, stw2: int) -> list[Scan]:
+    result = db.session.execute(
+        text(
+            squeeze_query(
+                """\
+            select distinct backend, freqmode, stw from ac_cal_level1b
+            where stw between :s1 and :s2
+            order by backend, freqmode, stw"""
+            )
+        ),
+        params=dict(s1=stw1, s2=stw2),
+    )
+    return [(row.backend, row.freqmode, row.stw) for row in result]
+
+
+def get_scan_log(scan: Scan) -> dict[str, Any]:
+    backend, freqmode, scanid = scan
+    return ScanInfoExporter(backend, freqmode).extract_scan_log(scanid)
+
+
+def make_scan_row(backend: str, scan_log: dict[str, Any]) -> dict[str, Any]:
+    """scans_cache row of a scan log"""
+    row = {column: scan_log[key] for key, column in SCAN_LOG_COLUMNS.items()}
+    row["backend"] = backend
+    row["freqmode"] = int(scan_log["FreqMode"])
+    # a scan belongs to the day it starts, as in get_log_of_scans
+    row["date"] = mjd2datetime(scan_log["MJDStart"]).date()
+    for key, value in row.items():
+        if hasattr(value, "item"):
+            row[key] = value.item()
+    return row
+
+
+def update_scans(scans: list[Scan], workers: int) -> set[tuple]:
+    """Replace the scans_cache rows of the scans
+
+    Returns the (date, backend, freqmode) of the rows that were removed or
+    added.
+    """
+    scan_logs = map_in_app_context(get_scan_log, scans, workers)
+    days = set()
+    for backend, freqmode, scanid in scans:
+        result = db.session.execute(
+            text(
+                squeeze_query(
+                    """\
+                delete from scans_cache
+                where backend = :b and freqmode = :f and scanid = :s
+                returning date"""
+                )
+            ),
+            params=dict(b=backend, f=freqmode, s=scanid),
+        )
+        days.update((row.date, backend, freqmode) for row in result)
+    rows = [
+        make_scan_row(backend, scan_log)
+        for (backend, _, _), scan_log in zip(scans, scan_logs)
+        if scan_log
+    ]
+    if rows:
+        columns = list(rows[0])
+        db.session.execute(
+            text(
+                "insert into scans_cache ({0}) values ({1})".format(
+                    ", ".join(columns), ", ".join(f":{column}" for column in columns)
+                )
+            ),
+            rows,
+        )
+    days.update((row["date"], row["backend"], row["freqmode"]) for row in rows)
+    return days
+
+
+def update_measurements(days: Iterable[tuple]) -> None:
+    """Count the scans of the days again in measurements_cache"""
+    for day, backend, freqmode in sorted(days):
+        params = dict(d=day, b=backend, f=freqmode)
+        db.session.execute(
+            text(
+                squeeze_query(
+                    """\
+                delete from measurements_cache
+                where date = :d and backend = :b and freqmode = :f"""
+                )
+            ),
+            params=params,
+        )
+        db.session.execute(
+            text(
+                squeeze_query(
+                    """\
+                insert into measurements_cache (date, backend, freqmode, nscans)
+                select date, backend, freqmode, count(*) from scans_cache
+                where date = :d and backend = :b and freqmode = :f
+                group by date, backend, freqmode"""
+                )
+            ),
+            params=params,
+        )
+
+
+def update_monthly(days: Iterable[tuple]) -> None:
+    """Sum the scans of the months of the days again in measurements_monthly"""
+    for year, month in sorted({(day.year, day.month) for day, _, _ in days}):
+        params = dict(y=year, m=month, d1=date(year, month, 1))
+        db.session.execute(
+            text(
+                squeeze_query(
+                    """\
+                delete from measurements_monthly
+                where year = :y and month = :m"""
+                )
+            ),
+            params=params,
+        )
+        db.session.execute(
+            text(
+                squeeze_query(
+                    """\
+                insert into measurements_monthly (year, month, freqmode, nscans)
+                select :y, :m, freqmode, sum(nscans) from measurements_cache
+                where date >= :d1 and date < :d1 + interval '1 month'
+                group by freqmode"""
+                )
+            ),
+            params=params,
+        )
+
+
+def materialise(
+    batch_size: int = 100,
+    workers: int = 4,
+    initial_days: float = 7,
+    settle: float = 300,
+):
+    """Update the caches with the imports since the previous run
+
+    Returns the number of scans that were updated.
+    """
+    ensure_schema()
+    watermark = get_watermark(initial_days)
+    if watermark is None:
+        return 0
+    imported = get_imported_files(watermark, settle)
+    if not imported:
+        return 0
+    nscans = 0
+    for stw1, stw2 in get_stw_ranges(name for name, _ in imported):
+        scans = get_scans(stw1, stw2)
+        for start in range(0, len(scans), batch_size):
+            batch = scans[start : start + batch_size]
+            days = update_scans(batch, workers)
+            update_measurements(days)
+            update_monthly(days)
+            db.session.commit()
+            nscans += len(batch)
+            logger.info("materialised %i scans from stw %i", len(batch), batch[0][2])
+    set_watermark(max(created for _, created in imported))
+    db.session.commit()
+    return nscans
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Update scans_cache and measurements_cache with new level0 data"
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        help="run again after this many seconds, run once if not given",
+    )
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument(
+        "--initial-days",
+        type=float,
+        default=7,
+        help="days of imports to handle on the first run",
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=300,
+        help="seconds before an import is handled, longer than an import takes",
+    )
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--live", action="store_true", help="Use production databases")
+    group.add_argument("--local", action="store_true", help="Use local databases")
+    return parser.parse_args()
+
+
+def main():
+    logconf_file = Path(__file__).parent.parent.parent / "logconf.yaml"
+    if logconf_file.exists():
+        with open(logconf_file) as f:
+            config.dictConfig(safe_load(f))
+
+    args = parse_arguments()
+    if args.live:
+        app_config = LiveConfig()
+    elif args.local:
+        app_config = LocalConfig()
+    else:
+        app_config = ProdConfig()
+    # the caches are only used when serving requests
+    app_config.PRELOAD_CACHES = False
+    app = create_app(app_config)
+    workers = app.config.get("SCAN_LOG_WORKERS", 4)
+    while True:
+        with app.app_context():
+            nscans = materialise(
+                args.batch_size, workers, args.initial_days, args.settle
+            )
+        logger.info("materialised %i scans", nscans)
+        if args.interval is None:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
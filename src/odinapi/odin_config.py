@@ -26,9 +26,52 @@ if aws_access:
 
 class Config:
     TESTING = False
+    # Level1b scan cache: in-process LRU size and optional on-disk directory
+    L1B_CACHE_SIZE = int(environ.get("ODINAPI_L1B_CACHE_SIZE", "16"))
+    L1B_CACHE_DIR = environ.get("ODINAPI_L1B_CACHE_DIR")
+    # Send the level1b queries of a scan in one database round trip
+    L1B_PIPELINED_FETCH = environ.get("ODINAPI_L1B_PIPELINED_FETCH", "1") == "1"
+    # Bulk level1b endpoint: scans read per range query and scans per request
+    L1B_BULK_CHUNK_SIZE = int(environ.get("ODINAPI_L1B_BULK_CHUNK_SIZE", "32"))
+    L1B_BULK_MAX_SCANS = int(environ.get("ODINAPI_L1B_BULK_MAX_SCANS", "2000"))
+    # Seconds before the cached ac_cal_level1c median fits are read again
+    MEDIAN_FIT_CACHE_MAX_AGE = float(
+        environ.get("ODINAPI_MEDIAN_FIT_CACHE_MAX_AGE", "86400")
+    )
+    # Raw scan log requests: concurrent requests, seconds a request queues
+    # for a slot before it gets 429, and worker threads per request
+    RAW_CONCURRENCY = int(environ.get("ODINAPI_RAW_CONCURRENCY", "2"))
+    RAW_QUEUE_TIMEOUT = float(environ.get("ODINAPI_RAW_QUEUE_TIMEOUT", "10"))
+    SCAN_LOG_WORKERS = int(environ.get("ODINAPI_SCAN_LOG_WORKERS", "4"))
+    # Seconds the statistics are cached
+    STATISTICS_CACHE_MAX_AGE = float(
+        environ.get("ODINAPI_STATISTICS_CACHE_MAX_AGE", "300")
+    )
+    # Seconds the latest level0 import is cached, responses of the level1
+    # endpoints can be answered as not modified this long after an import
+    DATA_VERSION_MAX_AGE = float(environ.get("ODINAPI_DATA_VERSION_MAX_AGE", "10"))
+    # Seconds before the most recent days of the scan id index are read again
+    SCAN_INDEX_MAX_AGE = float(environ.get("ODINAPI_SCAN_INDEX_MAX_AGE", "600"))
+    # Seconds before the file listings of the PTZ bucket are read again
+    PTZ_REFRESH_INTERVAL = float(environ.get("ODINAPI_PTZ_REFRESH_INTERVAL", "3600"))
+    # Maximum number of scans per bulk PTZ request
+    PTZ_BULK_MAX_SCANS = int(environ.get("ODINAPI_PTZ_BULK_MAX_SCANS", "5000"))
+    # Number of PTZ profiles cached per worker
+    PTZ_CACHE_SIZE = int(environ.get("ODINAPI_PTZ_CACHE_SIZE", "4096"))
+    # Seconds before a scan without PTZ data is looked for again
+    PTZ_MISSING_MAX_AGE = float(environ.get("ODINAPI_PTZ_MISSING_MAX_AGE", "60"))
+    # Directory of the PTZ scan index, see odinapi.views.ptz_index
+    PTZ_INDEX_PATH = environ.get("ODINAPI_PTZ_INDEX_PATH", "")
+    # Directory for the parsed apriori data, kept between restarts
+    APRIORI_CACHE_DIR = environ.get("ODINAPI_APRIORI_CACHE_DIR")
+    # Part of all ETags, change it when a release changes the responses
+    ETAG_SALT = environ.get("ODINAPI_ETAG_SALT", "")
+    # Load process wide caches when the app is created
+    PRELOAD_CACHES = False
 
 
 class ProdConfig(Config):
+    PRELOAD_CACHES = environ.get("ODINAPI_PRELOAD_CACHES", "1") == "1"
     SQLALCHEMY_DATABASE_URI = f"postgresql+psycopg://{pg_user}:{pg_passwd}@{pg_host}/{pg_dbname}?sslmode={pg_sslmode}"
 
     SQLALCHEMY_ENGINE_OPTIONS = dict(
@@ -1,6 +1,11 @@
 import re
+from contextlib import ExitStack
+from typing import Any, Sequence
 
 from flask_sqlalchemy import SQLAlchemy
+from psycopg import Pipeline
+from psycopg.rows import dict_row
+from sqlalchemy import text
 
 db = SQLAlchemy()
 
@@ -10,3 +15,40 @@ pattern = re.compile(r"\s+")
 def squeeze_query(query: str) -> str:
     log_friendly_query = re.sub(pattern, " ", query)
     return log_friendly_query.strip()
+
+
+def execute_rows(query: str, params: dict[str, Any]) -> list[dict[str, Any]]:
+    """Execute a query in the current session and return the rows as dicts"""
+    return [
+        row._asdict() for row in db.session.execute(text(query), params=params).all()
+    ]
+
+
+def execute_pipelined(
+    queries: Sequence[str], params: dict[str, Any]
+) -> list[list[dict[str, Any]]]:
+    """Execute several queries in one round trip to the database
+
+    The queries are written with the same named parameters as for
+    sqlalchemy.text and each query uses the parameters it refers to. They
+    are sent using the pipeline mode of psycopg on the connection of the
+    current session, so that the database is only waited for once. If the
+    pipeline mode is not available the queries are executed one by one.
+    """
+    if not Pipeline.is_supported():
+        return [execute_rows(query, params) for query in queries]
+    connection = db.session.connection()
+    statements = [text(query).compile(dialect=connection.dialect) for query in queries]
+    driver_connection = connection.connection.driver_connection
+    with ExitStack() as stack:
+        cursors = []
+        with driver_connection.pipeline():  # ty:ignore[unresolved-attribute]
+            for statement in statements:
+                cursor = stack.enter_context(
+                    driver_connection.cursor(  # ty:ignore[unresolved-attribute]
+                        row_factory=dict_row
+                    )
+                )
+                cursor.execute(statement.string, statement.construct_params(params))
+                cursors.append(cursor)
+        return [cursor.fetchall() for cursor in cursors]
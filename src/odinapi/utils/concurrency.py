@@ -0,0 +1,64 @@
+"""Admission control and worker pools for expensive requests"""
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from typing import Callable, Iterable, TypeVar
+
+from flask import current_app
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class ConcurrencyLimit:
+    """Limit the number of requests doing the same expensive work
+
+    At most limit callers hold the limit at the same time. Other callers
+    queue for up to timeout seconds before they are turned away.
+    """
+
+    def __init__(self, limit: int = 1, timeout: float = 1.0):
+        self.limit = limit
+        self.timeout = timeout
+        self._semaphore = BoundedSemaphore(limit)
+
+    def acquire(self) -> bool:
+        return self._semaphore.acquire(timeout=self.timeout)
+
+    def release(self) -> None:
+        self._semaphore.release()
+
+
+_limits: dict[str, ConcurrencyLimit] = {}
+_limits_lock = Lock()
+
+
+def get_concurrency_limit(name: str, limit: int, timeout: float) -> ConcurrencyLimit:
+    """Return the process wide limit with the given name
+
+    limit and timeout are only used when the limit is first created.
+    """
+    with _limits_lock:
+        if name not in _limits:
+            _limits[name] = ConcurrencyLimit(limit, timeout)
+        return _limits[name]
+
+
+def map_in_app_context(
+    func: Callable[[T], R], items: Iterable[T], max_workers: int
+) -> list[R]:
+    """Call func for each item in a pool of max_workers threads
+
+    Each call runs in its own app context, and so gets its own database
+    session. The results are returned in the order of items.
+    """
+    if max_workers <= 1:
+        return [func(item) for item in items]
+    app = current_app._get_current_object()  # type: ignore[attr-defined]
+
+    def call(item: T) -> R:
+        with app.app_context():
+            return func(item)
+
+    with ThreadPoolExecutor(max_workers, thread_name_prefix="odinapi") as pool:
+        return list(pool.map(call, items))
@@ -0,0 +1,147 @@
+"""Conditional GET for the read-only level1 and vds endpoints
+
+Successful GET responses get an ETag, and requests with a matching
+If-None-Match header are answered with 304 Not Modified.
+
+Responses of versioned views only change with the data they are made from,
+so their ETag is made from a version of that data, the url and the Accept
+header. A request that matches is answered before the view runs. For the
+level1 data the version is given by the imports that may overlap the scan
+or the day of the request, so that other imports do not change the tag.
+Other responses get a hash of their content as ETag, which saves the
+transfer but not the work. Streamed responses of views that are not
+versioned get no ETag.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Callable, Iterable, Mapping
+
+from flask import Blueprint, Response, g, request
+
+from .data_version import (
+    DataVersion,
+    get_data_version,
+    get_latest_import,
+    get_table_version,
+    make_etag,
+)
+from .level0_files import L1B_PROCESSING_VERSION, scan_stw_range
+from .time_util import datetime2stw
+
+# the conversion from a date to stw is approximate
+DATE_STW_MARGIN = timedelta(hours=1)
+
+
+def get_stw_range(view_args: dict) -> tuple[int, int] | None:
+    """Satellite time of the level1 data of a request, None if not known
+
+    Requests for a scan cover the scan and its references, requests for a
+    date the day.
+    """
+    if "scanno" in view_args:
+        return scan_stw_range(int(view_args["scanno"]))
+    if "date" in view_args:
+        try:
+            day = datetime.strptime(view_args["date"], "%Y-%m-%d")
+        except ValueError:
+            return None
+        return (
+            datetime2stw(day - DATE_STW_MARGIN),
+            datetime2stw(day + timedelta(days=1) + DATE_STW_MARGIN),
+        )
+    return None
+
+
+def get_request_version() -> DataVersion:
+    """Version of the level1 data of the request
+
+    Only the imports that may overlap the stw range of the request count,
+    and the range is materialised once the latest of them is.
+    """
+    version = get_data_version()
+    stw_range = get_stw_range(request.view_args or {})
+    if version.imported is None or stw_range is None:
+        return version
+    imported = get_latest_import(*stw_range)
+    if imported is None or version.materialised is None:
+        return DataVersion(imported, None)
+    return DataVersion(imported, min(imported, version.materialised))
+
+
+def make_request_etag(*parts: Any) -> str | None:
+    """ETag of a request for level1 data, None if nothing is imported
+
+    parts are the versions of any other data the response is made from.
+    """
+    if get_data_version().imported is None:
+        return None
+    return make_etag(
+        get_request_version(),
+        L1B_PROCESSING_VERSION,
+        *parts,
+        request.url,
+        request.headers.get("Accept", ""),
+    )
+
+
+def make_collocations_etag() -> str | None:
+    """ETag of a request for data from the collocations table"""
+    version = get_table_version("collocations")
+    if version is None:
+        return None
+    return make_etag(
+        DataVersion(None, None),
+        version,
+        request.url,
+        request.headers.get("Accept", ""),
+    )
+
+
+def register_conditional_get(
+    blueprint: Blueprint,
+    versioned_views: Iterable[str] | Mapping[str, Callable[[], str | None]] = (),
+    make_versioned_etag: Callable[[], str | None] = make_request_etag,
+) -> None:
+    """Add ETags to the GET responses of the views of the blueprint
+
+    versioned_views are the names of the views whose responses only change
+    with the data version given by make_versioned_etag, by default when
+    new level0 data for the request is imported or materialised. Views that
+    are made from other data as well are mapped to their own function.
+    """
+    if not isinstance(versioned_views, Mapping):
+        versioned_views = {view: make_versioned_etag for view in versioned_views}
+    endpoints = {
+        f"{blueprint.name}.{view}": make for view, make in versioned_views.items()
+    }
+
+    @blueprint.before_request
+    def answer_not_modified():
+        if request.method not in ("GET", "HEAD") or request.endpoint not in endpoints:
+            return None
+        g.etag = endpoints[request.endpoint]()
+        if g.etag is not None and request.if_none_match.contains(g.etag):
+            response = Response(status=304)
+            response.set_etag(g.etag)
+            response.vary.add("Accept")
+            return response
+        return None
+
+    @blueprint.after_request
+    def add_etag(response: Response) -> Response:
+        if (
+            request.method not in ("GET", "HEAD")
+            or response.status_code != 200
+            or response.get_etag()[0] is not None
+        ):
+            return response
+        if request.endpoint in endpoints:
+            etag = g.get("etag")
+            if etag is not None:
+                response.set_etag(etag)
+                response.vary.add("Accept")
+            return response
+        if response.is_streamed:
+            return response
+        response.add_etag()
+        return response.make_conditional(request)
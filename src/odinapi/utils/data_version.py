@@ -0,0 +1,221 @@
+"""Version of the level1 data for HTTP validators
+
+The level1 data only changes when new level0 files are imported, and the
+cache tables when the materialiser has handled the imports. The times of
+the latest import and of the latest materialised import together work as
+the version of everything derived from them. The version is used for ETag
+and Last-Modified headers and as part of the keys of results cached in
+process. The imports that can overlap a range of satellite time are found
+in an index of the imports, to tell if the data of a scan can have changed.
+"""
+
+import hashlib
+from datetime import datetime
+from threading import Lock
+from typing import Any, Hashable, NamedTuple
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+from ..pg_database import db
+from .caching import TTLCache
+from .level0_files import LEVEL0_FILE_STW_SPAN, level0_file_stw
+
+DATA_VERSION_KEY = "data_version"
+
+# name of the materialiser state row with the latest materialised import
+MATERIALISE_STATE_NAME = "level0_files_imported"
+
+
+class DataVersion(NamedTuple):
+    imported: datetime | None
+    materialised: datetime | None
+
+
+_cache: TTLCache | None = None
+_version_cache: TTLCache | None = None
+_cache_lock = Lock()
+
+
+def get_cache() -> TTLCache:
+    """Return the process wide cache for results derived from the caches
+
+    Entries are kept for STATISTICS_CACHE_MAX_AGE seconds. Keys should
+    include the data version so that new imports are seen when it changes.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TTLCache(current_app.config.get("STATISTICS_CACHE_MAX_AGE", 300))
+        return _cache
+
+
+def get_version_cache() -> TTLCache:
+    """Return the process wide cache for the data versions
+
+    Entries are kept for DATA_VERSION_MAX_AGE seconds, so that a response
+    is answered as not modified for at most that long after an import.
+    """
+    global _version_cache
+    with _cache_lock:
+        if _version_cache is None:
+            _version_cache = TTLCache(
+                current_app.config.get("DATA_VERSION_MAX_AGE", 10)
+            )
+        return _version_cache
+
+
+def get_materialised() -> datetime | None:
+    """Time of the latest import handled by the materialiser
+
+    None if the materialiser has not run yet.
+    """
+    try:
+        with db.session.begin_nested():
+            return db.session.execute(
+                text("select imported from materialise_state where name = :n"),
+                params=dict(n=MATERIALISE_STATE_NAME),
+            ).scalar_one_or_none()
+    except ProgrammingError:
+        return None
+
+
+def get_data_version() -> DataVersion:
+    cache = get_version_cache()
+    version = cache.get(DATA_VERSION_KEY)
+    if version is None:
+        imported = db.session.execute(
+            text("select max(created) from level0_files_imported")
+        ).scalar_one()
+        version = DataVersion(imported, get_materialised())
+        cache.put(DATA_VERSION_KEY, version)
+    return version
+
+
+def get_table_version(table: str) -> int | None:
+    """Version of a table that is not derived from the level0 imports
+
+    The version is incremented by a trigger for every statement that
+    changes the table, see odinapi.materialise. None if the trigger is not
+    installed. It is cached as the data version.
+    """
+    cache = get_version_cache()
+    key = ("table_version", table)
+    version = cache.get(key)
+    if version is None:
+        try:
+            with db.session.begin_nested():
+                version = db.session.execute(
+                    text("select version from table_versions where name = :t"),
+                    params=dict(t=table),
+                ).scalar_one_or_none()
+        except ProgrammingError:
+            version = None
+        version = version or 0
+        cache.put(key, version)
+    return version or None
+
+
+def make_etag(version: DataVersion, *parts: Any) -> str:
+    """Strong entity tag for a resource at a data version
+
+    ETAG_SALT is included, so that all tags can be changed when a release
+    changes the responses.
+    """
+    tag = repr(
+        tuple(time.isoformat() if time else None for time in version)
+        + (current_app.config.get("ETAG_SALT", ""),)
+        + parts
+    )
+    return hashlib.sha1(tag.encode()).hexdigest()
+
+
+def get_cached(key: Hashable, compute, version: DataVersion) -> Any:
+    """Result of compute() for the key at the data version, cached in process"""
+    cache = get_cache()
+    value = cache.get((key, version))
+    if value is None:
+        value = compute()
+        cache.put((key, version), value)
+    return value
+
+
+class ImportIndex:
+    """Level0 imports sorted on the first stw of the files
+
+    Finds the latest import of a file that may overlap an stw range without
+    a query. The index is read once and then only the imports newer than
+    those in it are added, when the data version shows that there are any.
+    Files with names that can not be interpreted may overlap any range.
+    """
+
+    def __init__(self):
+        self.stw = np.empty(0, dtype="int64")
+        self.created = np.empty(0, dtype="datetime64[us]")
+        self.unknown: datetime | None = None
+        self.latest: datetime | None = None
+        self._lock = Lock()
+
+    def update(self, version: DataVersion) -> None:
+        """Add the imports up to the imported time of the version"""
+        with self._lock:
+            if version.imported is None or (
+                self.latest is not None and version.imported <= self.latest
+            ):
+                return
+            result = db.session.execute(
+                text(
+                    "select file, created from level0_files_imported where created > :c"
+                ),
+                params=dict(c=self.latest or datetime.min),
+            )
+            stws, created = [], []
+            for row in result:
+                stw = level0_file_stw(row.file)
+                if stw is None:
+                    self.unknown = max(self.unknown or row.created, row.created)
+                else:
+                    stws.append(stw)
+                    created.append(row.created)
+                self.latest = max(self.latest or row.created, row.created)
+            stw = np.concatenate([self.stw, np.array(stws, dtype="int64")])
+            order = np.argsort(stw, kind="stable")
+            self.stw = stw[order]
+            self.created = np.concatenate(
+                [self.created, np.array(created, dtype="datetime64[us]")]
+            )[order]
+
+    def get(self, stw1: int, stw2: int) -> datetime | None:
+        """Latest import of a file that may contain data between stw1 and stw2"""
+        with self._lock:
+            stw, created, latest = self.stw, self.created, self.unknown
+        ind1, ind2 = np.searchsorted(stw, [stw1 - LEVEL0_FILE_STW_SPAN, stw2 + 1])
+        if ind2 > ind1:
+            overlapping = created[ind1:ind2].max().astype(datetime)
+            latest = max(latest or overlapping, overlapping)
+        return latest
+
+
+_import_index: ImportIndex | None = None
+_import_index_lock = Lock()
+
+
+def get_import_index() -> ImportIndex:
+    """Return the process wide import index"""
+    global _import_index
+    with _import_index_lock:
+        if _import_index is None:
+            _import_index = ImportIndex()
+        return _import_index
+
+
+def get_latest_import(stw1: int, stw2: int) -> datetime | None:
+    """Latest import of level0 data that may be between stw1 and stw2
+
+    The imports are as recent as the cached data version.
+    """
+    index = get_import_index()
+    index.update(get_data_version())
+    return index.get(stw1, stw2)
@@ -0,0 +1,39 @@
+"""Helpers for relating imported level0 files to satellite time"""
+
+from pathlib import PurePosixPath
+
+# Level0 files are named after the satellite time word of their first
+# record, shifted four bits: 342009ec.ac1 starts at stw 0x342009ec << 4.
+LEVEL0_FILE_STW_SHIFT = 4
+
+# Generous upper limit of the stw span covered by a single level0 file
+# (about nine hours), used when deciding whether a file can touch a scan.
+LEVEL0_FILE_STW_SPAN = 1 << 19
+
+# Upper limit of the stw span of a scan (about four minutes)
+SCAN_STW_SPAN = 1 << 12
+
+# reference spectra are collected this many stw around the scan
+REFERENCE_STW_MARGIN = 256
+
+# Version of the level1b data read from the database and revision of the
+# processing done in views.level1b_scandata_exporter_v2. Bump the revision
+# whenever the output for a scan changes, cached scans are then recomputed.
+L1B_PROCESSING_VERSION = "8.1"
+
+
+def scan_stw_range(scanid: int) -> tuple[int, int]:
+    """Satellite time of the level0 data a scan and its references are read from"""
+    return (
+        scanid - REFERENCE_STW_MARGIN,
+        scanid + SCAN_STW_SPAN + REFERENCE_STW_MARGIN,
+    )
+
+
+def level0_file_stw(filename: str) -> int | None:
+    """Return the first stw of a level0 file or None if the name is unknown"""
+    stem = PurePosixPath(filename).name.split(".")[0]
+    try:
+        return int(stem, 16) << LEVEL0_FILE_STW_SHIFT
+    except ValueError:
+        return None
@@ -0,0 +1,114 @@
+"""Process wide cache of the ac_cal_level1c median fits
+
+The median fit spectra used by calibration step 2 form a small table that
+is rarely updated. The whole table is read in one query and kept as arrays,
+indexed on the columns CalibrationStep2 looks them up by. The cache can be
+loaded before the gunicorn workers are forked, the workers then share it.
+"""
+
+import logging
+import time
+from threading import Lock
+from typing import Any
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import text
+
+from ..pg_database import db, squeeze_query
+
+logger = logging.getLogger("odinapi.calibration_cache")
+
+MedianFitKey = tuple[int, int, int, tuple, tuple | None, tuple | None]
+
+
+def as_tuple(value: Any) -> tuple | None:
+    """Normalise an array value, a list or a postgres array literal"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = [item for item in value.strip("{}").split(",") if item.strip()]
+    return tuple(float(item) for item in value)
+
+
+def make_key(freqmode, version, intmode, ssb_fq, altitude_range, hotload_range):
+    return (
+        int(freqmode),
+        int(version),
+        int(intmode),
+        as_tuple(ssb_fq),
+        as_tuple(altitude_range),
+        as_tuple(hotload_range),
+    )
+
+
+class MedianFitCache:
+    """All median fits of ac_cal_level1c, reloaded after max_age seconds"""
+
+    def __init__(self, max_age: float = 86400):
+        self.max_age = max_age
+        self.fits: dict[MedianFitKey, np.ndarray] | None = None
+        self.loaded = 0.0
+        self._lock = Lock()
+
+    def load(self) -> None:
+        result = db.session.execute(
+            text(
+                squeeze_query(
+                    """\
+                select freqmode, version, intmode, ssb_fq, altitude_range,
+                hotload_range, median_fit, channels
+                from ac_cal_level1c
+                order by hotload_range"""
+                )
+            )
+        )
+        fits: dict[MedianFitKey, np.ndarray] = {}
+        for row in result:
+            key = make_key(
+                row.freqmode,
+                row.version,
+                row.intmode,
+                row.ssb_fq,
+                row.altitude_range,
+                row.hotload_range,
+            )
+            if key in fits:
+                continue
+            fit = np.frombuffer(row.median_fit, dtype="float64", count=row.channels)
+            fit.flags.writeable = False
+            fits[key] = fit
+        self.fits = fits
+        self.loaded = time.monotonic()
+        logger.info("loaded %i median fits", len(fits))
+
+    def get(self, key: MedianFitKey) -> np.ndarray | None:
+        with self._lock:
+            if self.fits is None or time.monotonic() - self.loaded > self.max_age:
+                self.load()
+            assert self.fits is not None
+            return self.fits.get(key)
+
+
+_median_fit_cache: MedianFitCache | None = None
+_median_fit_cache_lock = Lock()
+
+
+def get_median_fit_cache() -> MedianFitCache:
+    """Return the process wide median fit cache"""
+    global _median_fit_cache
+    with _median_fit_cache_lock:
+        if _median_fit_cache is None:
+            _median_fit_cache = MedianFitCache(
+                current_app.config.get("MEDIAN_FIT_CACHE_MAX_AGE", 86400)
+            )
+        return _median_fit_cache
+
+
+def get_median_fit(
+    freqmode, version, intmode, ssb_fq, altitude_range, hotload_range
+) -> np.ndarray | None:
+    """Median fit spectrum or None if there is no fit for the key"""
+    return get_median_fit_cache().get(
+        make_key(freqmode, version, intmode, ssb_fq, altitude_range, hotload_range)
+    )
@@ -3,29 +3,51 @@ from odinapi.pg_database import squeeze_query
 from flask import jsonify
 from flask.views import MethodView
 from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
 
 from ..pg_database import db
 
 
 class FileInfo(MethodView):
-    """plots information"""
+    """plots information
+
+    The latest import of each file type is read from level0_files_latest,
+    which is kept up to date by a trigger on level0_files_imported, or from
+    level0_files_imported until the materialiser has created the table.
+    """
+
+    FILE_TYPES = ["ac1", "ac2", "shk", "fba", "att"]
+
+    query = text(
+        squeeze_query(
+            """\
+        select file_type, created from level0_files_latest
+        where file_type = any(:t)"""
+        )
+    )
+
+    fallback_query = text(
+        squeeze_query(
+            """\
+        select distinct on (file_type) file_type, created
+        from (
+            select lower(substring(file from '[.]([^./]+)$')) as file_type, created
+            from level0_files_imported
+        ) as imported
+        where file_type = any(:t)
+        order by file_type, created desc"""
+        )
+    )
 
     def get(self, version):
         """GET"""
-        result_dict = {}
-        for file_ending in ["ac1", "ac2", "shk", "fba", "att"]:
-            query = text(
-                squeeze_query(
-                    """\
-                select created from level0_files_imported
-                where file ~ :f
-                order by created desc limit 1"""
-                )
-            )
-            db_result = db.session.execute(query, params=dict(f=".*" + file_ending))
-            first_row = db_result.first()
-            if first_row is not None:
-                result_dict[file_ending] = first_row[0]
-            else:
-                result_dict[file_ending] = None
+        result_dict = dict.fromkeys(self.FILE_TYPES)
+        params = dict(t=self.FILE_TYPES)
+        try:
+            with db.session.begin_nested():
+                db_result = list(db.session.execute(self.query, params=params))
+        except ProgrammingError:
+            db_result = db.session.execute(self.fallback_query, params=params)
+        for row in db_result:
+            result_dict[row.file_type] = row.created
         return jsonify(**result_dict)
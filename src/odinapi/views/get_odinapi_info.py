@@ -1,6 +1,9 @@
 """help functions to display config data"""
 
+from flask import current_app
+
 from odinapi.odin_aws.s3 import s3_stat
+from odinapi.views.read_ptz import get_ptz_store
 
 
 def get_vds_file_status():
@@ -64,6 +67,16 @@ def get_apriori_file_status():
     return apriori_files
 
 
+def get_ptz_store_status():
+    """returns the PTZ settings and the cache statistics of this worker"""
+    settings = {
+        key: value
+        for key, value in current_app.config.items()
+        if key.startswith("PTZ_")
+    }
+    return {"settings": settings, "caches": get_ptz_store().stats()}
+
+
 def get_config_data_files():
     """get data for various file types"""
     data = dict()
@@ -71,6 +84,7 @@ def get_config_data_files():
     data["vds-files"] = vds_files
     ptz_files = get_ptz_file_status()
     data["ptz-files"] = ptz_files
+    data["ptz-store"] = get_ptz_store_status()
     apriori_files = get_apriori_file_status()
     data["apriori-files"] = apriori_files
     return {"data": data}
@@ -0,0 +1,110 @@
+"""Binary response formats for level1b scans
+
+JSON stays the default. Clients can ask for an Arrow IPC stream or a NumPy
+.npz archive with the format argument or the Accept header. Both hold the
+data of the target spectra as contiguous arrays: one row per spectrum, with
+the spectra as a 2-D float64 array padded with NaN if the number of
+channels differs between spectra.
+
+In the Arrow stream the data for the whole scan (TrecSpectrum and the
+frequency grid, sub band and channel indexes) is stored as JSON in the
+schema metadata. In the .npz archive it is stored as separate arrays.
+"""
+
+import io
+import json
+
+import numpy as np
+import pyarrow as pa
+from flask import Response, request
+
+from .level1b_scandata_exporter_v2 import scan2dict_v4
+
+JSON_MIMETYPE = "application/json"
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+NPZ_MIMETYPE = "application/x-npz"
+
+FORMATS = {
+    "json": JSON_MIMETYPE,
+    "arrow": ARROW_MIMETYPE,
+    "npz": NPZ_MIMETYPE,
+}
+
+# frequency data given for each target spectrum, the rest is for the scan
+SPECTRUM_FREQUENCY_ITEMS = ("LOFreq", "AppliedDopplerCorr")
+
+
+def get_response_format(formats: dict[str, str] = FORMATS) -> str:
+    """Format asked for by the format argument or else the Accept header
+
+    Raises ValueError for an unknown format argument.
+    """
+    name = request.args.get("format")
+    if name:
+        if name not in formats:
+            raise ValueError(f"Unknown format: {name!r}")
+        return name
+    mimetype = request.accept_mimetypes.best_match(
+        list(formats.values()), default=JSON_MIMETYPE
+    )
+    return next(name for name, value in formats.items() if value == mimetype)
+
+
+def stack_spectra(spectra) -> np.ndarray:
+    """Spectra as one 2-D array, shorter spectra are padded with NaN"""
+    spectra = [np.asarray(spectrum, dtype="float64") for spectrum in spectra]
+    width = max((spectrum.shape[0] for spectrum in spectra), default=0)
+    stacked = np.full((len(spectra), width), np.nan)
+    for ind, spectrum in enumerate(spectra):
+        stacked[ind, : spectrum.shape[0]] = spectrum
+    return stacked
+
+
+def scan2arrays_v4(spectra) -> tuple[dict[str, np.ndarray], dict[str, np.ndarray]]:
+    """Arrays with one row per target spectrum and arrays for the scan"""
+    datadict = scan2dict_v4(spectra)
+    frequency = datadict.pop("Frequency")
+    scan = {
+        "TrecSpectrum": np.asarray(datadict.pop("TrecSpectrum"), dtype="float64"),
+    }
+    rows = {item: np.asarray(value) for item, value in datadict.items()}
+    rows["Spectrum"] = stack_spectra(datadict["Spectrum"])
+    for item, value in frequency.items():
+        if item in SPECTRUM_FREQUENCY_ITEMS:
+            rows[item] = np.asarray(value, dtype="float64")
+        else:
+            scan[item] = np.asarray(value)
+    return rows, scan
+
+
+def to_arrow_column(values: np.ndarray) -> pa.Array:
+    if values.ndim == 1:
+        return pa.array(values)
+    flat = pa.array(np.ascontiguousarray(values).reshape(-1))
+    return pa.FixedSizeListArray.from_arrays(flat, values.shape[1])
+
+
+def to_arrow(rows: dict[str, np.ndarray], scan: dict[str, np.ndarray]) -> bytes:
+    batch = pa.RecordBatch.from_arrays(
+        [to_arrow_column(values) for values in rows.values()], names=list(rows)
+    )
+    metadata = {item: json.dumps(value.tolist()) for item, value in scan.items()}
+    schema = batch.schema.with_metadata(metadata)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(batch.replace_schema_metadata(metadata))
+    return sink.getvalue().to_pybytes()
+
+
+def to_npz(rows: dict[str, np.ndarray], scan: dict[str, np.ndarray]) -> bytes:
+    buffer = io.BytesIO()
+    np.savez(buffer, **rows, **scan)
+    return buffer.getvalue()
+
+
+def make_binary_response(spectra, response_format: str) -> Response:
+    """Response with the target spectra of a scan in a binary format"""
+    rows, scan = scan2arrays_v4(spectra)
+    if response_format == "arrow":
+        return Response(to_arrow(rows, scan), mimetype=ARROW_MIMETYPE)
+    return Response(to_npz(rows, scan), mimetype=NPZ_MIMETYPE)
@@ -0,0 +1,224 @@
+"""Cache of fully calibrated level1b scans
+
+Level1b data for a scan only changes when new level0 data covering the
+scan is imported. Calibrated scans are therefore kept in a bounded
+in-process LRU and, optionally, in a content addressed directory on local
+disk. Every entry has the latest import of the level0 files that may
+overlap the scan when it was read, and it is dropped when that changes.
+The imports are checked in the process wide import index, as for the
+ETags of the scan.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from typing import Any, TypedDict
+
+from flask import current_app
+
+from ..utils.caching import LRUCache
+from ..utils.data_version import get_latest_import
+from ..utils.level0_files import L1B_PROCESSING_VERSION, scan_stw_range
+from .level1b_scandata_exporter_v2 import (
+    chunk_scanids,
+    get_scan_data_v2,
+    get_scans_data_v2,
+)
+
+logger = logging.getLogger("odinapi.l1b_cache")
+
+CacheKey = tuple[str, int, int, str]
+
+
+class CacheEntry(TypedDict):
+    key: CacheKey
+    imported: datetime | None
+    spectra: dict[str, Any]
+
+
+class Level1bCache:
+    """Two tier cache of level1b scans
+
+    Entries are keyed on backend, freqmode, scanid and processing version.
+    The disk tier is addressed by a hash of the key, files are written
+    atomically so that several worker processes can share a directory.
+    """
+
+    def __init__(self, maxsize: int = 16, cache_dir: str | None = None):
+        self.memory = LRUCache(maxsize)
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory.maxsize > 0 or self.cache_dir is not None
+
+    @staticmethod
+    def make_key(backend: str, freqmode: int, scanid: int) -> CacheKey:
+        return (str(backend), int(freqmode), int(scanid), L1B_PROCESSING_VERSION)
+
+    def path(self, key: CacheKey) -> Path:
+        assert self.cache_dir is not None
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return self.cache_dir / digest[:2] / f"{digest}.pickle"
+
+    def get(self, key: CacheKey) -> CacheEntry | None:
+        entry = self.memory.get(key)
+        if entry is None and self.cache_dir is not None:
+            entry = self._read(key)
+            if entry is not None:
+                self.memory.put(key, entry)
+        return entry
+
+    def put(self, entry: CacheEntry) -> None:
+        self.memory.put(entry["key"], entry)
+        if self.cache_dir is not None:
+            self._write(entry)
+
+    def discard(self, key: CacheKey) -> None:
+        self.memory.pop(key)
+        if self.cache_dir is None:
+            return
+        try:
+            self.path(key).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            logger.warning("could not remove cached scan %s: %s", key, err)
+
+    def _read(self, key: CacheKey) -> CacheEntry | None:
+        path = self.path(key)
+        try:
+            with open(path, "rb") as cache_file:
+                entry = pickle.load(cache_file)
+        except FileNotFoundError:
+            return None
+        except Exception as err:
+            logger.warning("could not read cached scan %s: %s", path, err)
+            return None
+        if not isinstance(entry, dict) or entry.get("key") != key:
+            return None
+        if "imported" not in entry:
+            return None
+        return entry  # ty:ignore[invalid-return-type]
+
+    def _write(self, entry: CacheEntry) -> None:
+        path = self.path(entry["key"])
+        tmp_name = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                dir=path.parent, suffix=".tmp", delete=False
+            ) as tmp:
+                tmp_name = tmp.name
+                pickle.dump(entry, tmp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_name, path)
+        except OSError as err:
+            logger.warning("could not write cached scan %s: %s", path, err)
+            if tmp_name is not None and os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+
+
+_level1b_cache: Level1bCache | None = None
+_level1b_cache_lock = Lock()
+
+
+def get_level1b_cache() -> Level1bCache:
+    """Return the process wide level1b cache"""
+    global _level1b_cache
+    with _level1b_cache_lock:
+        if _level1b_cache is None:
+            _level1b_cache = Level1bCache(
+                current_app.config.get("L1B_CACHE_SIZE", 16),
+                current_app.config.get("L1B_CACHE_DIR"),
+            )
+        return _level1b_cache
+
+
+def get_scan_import(scanid: int) -> datetime | None:
+    """Latest import of level0 data that the scan may be read from"""
+    return get_latest_import(*scan_stw_range(scanid))
+
+
+def is_outdated(entry: CacheEntry) -> bool:
+    """Check if level0 data overlapping the scan was imported after entry"""
+    return bool(find_outdated([entry]))
+
+
+def find_outdated(entries: list[CacheEntry]) -> set[CacheKey]:
+    """Keys of the entries with overlapping level0 data imported after them"""
+    return {
+        entry["key"]
+        for entry in entries
+        if get_scan_import(entry["key"][2]) != entry["imported"]
+    }
+
+
+def get_scan_data_cached(backend, freqmode, scanno, debug=False):
+    """get scan data, from the level1b cache when possible"""
+    cache = get_level1b_cache()
+    if debug or not cache.enabled:
+        return get_scan_data_v2(backend, freqmode, scanno, debug)
+
+    key = cache.make_key(backend, freqmode, scanno)
+    entry = cache.get(key)
+    if entry is not None:
+        if not is_outdated(entry):
+            return entry["spectra"]
+        logger.debug("discarding outdated level1b scan %s", key)
+        cache.discard(key)
+
+    # the import is found before the scan is read, so that data imported
+    # while processing invalidates the entry
+    imported = get_scan_import(key[2])
+    spectra = get_scan_data_v2(backend, freqmode, scanno)
+    if spectra == {}:
+        return spectra
+    cache.put(CacheEntry(key=key, imported=imported, spectra=spectra))
+    return spectra
+
+
+def iter_scan_data_cached(backend, freqmode, scanids, chunk_size=None):
+    """Yield scanid and scan data for several scans, using the cache
+
+    The scans are handled in chunks: cached scans are validated with one
+    query per chunk and the other scans are read with range queries. The
+    calibration step 2 median fits are shared by all scans.
+    """
+    if chunk_size is None:
+        chunk_size = current_app.config.get("L1B_BULK_CHUNK_SIZE", 32)
+    cache = get_level1b_cache()
+    calibrations: dict = {}
+    for chunk in chunk_scanids(sorted(set(scanids)), chunk_size):
+        cached = {}
+        if cache.enabled:
+            entries = {}
+            for scanid in chunk:
+                entry = cache.get(cache.make_key(backend, freqmode, scanid))
+                if entry is not None:
+                    entries[scanid] = entry
+            outdated = find_outdated(list(entries.values()))
+            for scanid, entry in entries.items():
+                if entry["key"] in outdated:
+                    cache.discard(entry["key"])
+                else:
+                    cached[scanid] = entry["spectra"]
+        missing = [scanid for scanid in chunk if scanid not in cached]
+        fetched = {}
+        if missing:
+            imported = {
+                scanid: get_scan_import(scanid) for scanid in missing if cache.enabled
+            }
+            fetched = get_scans_data_v2(backend, freqmode, missing, calibrations)
+            for scanid, spectra in fetched.items():
+                if scanid in imported and spectra != {}:
+                    key = cache.make_key(backend, freqmode, scanid)
+                    cache.put(
+                        CacheEntry(key=key, imported=imported[scanid], spectra=spectra)
+                    )
+        for scanid in chunk:
+            yield scanid, cached.get(scanid, fetched.get(scanid, {}))
@@ -1,12 +1,14 @@
 # pylint: disable=E0401,C0413,C0302,R0912,R0914
 """extract scan data from odin database and display on webapi"""
+from bisect import bisect_left, bisect_right
 from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
 from odinapi.pg_database import squeeze_query
-from flask import abort
+from flask import abort, current_app
 import numpy as np
 from dateutil.relativedelta import relativedelta
 import matplotlib
-from sqlalchemy import text
 
 matplotlib.use("Agg")
 
@@ -21,10 +23,205 @@ from odinapi.views.smr_frequency import (  # noqa
     Smrl1bFreqspec,
     Smrl1bFreqsort,
     freqfunc,
+    freqfunc_array,
+    get_bad_module_numbers,
     get_bad_ssb_modules,
+    get_sorted_frequency,
     doppler_corr,
 )
-from ..pg_database import db
+from ..pg_database import execute_pipelined, execute_rows
+from ..utils.level0_files import REFERENCE_STW_MARGIN
+from .calibration_cache import get_median_fit
+
+# several scans are only read with one range query if they are this close
+# (about an hour), to not read too much data between sparse scans
+BULK_CHUNK_MAX_STW = 1 << 16
+
+TARGET_COLUMNS = """\
+    select ac_level1b.stw, calstw, ac_level1b.backend, orbit,
+    mjd, lst, intmode, mode, spectra, alevel, version, channels,
+    skyfreq, lofreq, restfreq, maxsuppression, tsys, sourcemode,
+    freqmode, efftime, sbpath, latitude, longitude, altitude,
+    skybeamhit, ra2000, dec2000, vsource, qtarget, qachieved,
+    qerror, gpspos, gpsvel, sunpos, moonpos, sunzd, vgeo, vlsr,
+    ssb_fq, inttime, ac_level1b.frontend, hotloada, hotloadb, lo,
+    sig_type, imageloada, imageloadb, ac_level1b.soda,
+    ac_level0.frontend as ac0_frontend
+    """
+
+TARGET_FROM = """\
+    from ac_level1b
+    join attitude_level1 using (backend, stw)
+    join ac_level0 using (backend, stw)
+    join shk_level1 on ac_level1b.stw = shk_level1.stw and
+    ac_level1b.backend = shk_level1.backend and
+    ac_level1b.frontend = shk_level1.frontendsplit
+    where ac_level1b.backend = :b and
+    version = 8 and sig_type = 'SIG' and freqmode = :f"""
+
+TARGET_QUERY = squeeze_query(
+    TARGET_COLUMNS
+    + TARGET_FROM
+    + """
+    and calstw = :c
+    order by stw asc, intmode asc"""
+)
+
+TARGET_RANGE_QUERY = squeeze_query(
+    TARGET_COLUMNS
+    + TARGET_FROM
+    + """
+    and calstw between :c1 and :c2
+    order by calstw asc, stw asc, intmode asc"""
+)
+
+CALIBRATION_COLUMNS = """\
+    select ac_cal_level1b.stw, ac_cal_level1b.backend, orbit,
+    mjd, lst, intmode, mode, spectra, alevel, version, channels,
+    spectype, skyfreq, lofreq, restfreq, maxsuppression,
+    sourcemode, freqmode, sbpath, latitude, longitude, altitude,
+    tspill, skybeamhit, ra2000, dec2000, vsource, qtarget,
+    qachieved, qerror, gpspos, gpsvel, sunpos, moonpos, sunzd,
+    vgeo, vlsr, ssb_fq, inttime, ac_cal_level1b.frontend,
+    hotloada, hotloadb, lo, sig_type, imageloada, imageloadb,
+    ac_cal_level1b.soda, ac_level0.frontend as ac0_frontend
+    from ac_cal_level1b"""
+
+# calibration spectra are looked for with progressively looser joins
+CALIBRATION_JOINS = (
+    """
+    join attitude_level1 using (backend, stw)
+    join ac_level0 using (backend, stw)
+    join shk_level1 on ac_cal_level1b.stw = shk_level1.stw and
+    ac_cal_level1b.backend = shk_level1.backend and
+    ac_cal_level1b.frontend = shk_level1.frontendsplit""",
+    """
+    join attitude_level1 using (backend, stw)
+    join ac_level0 using (backend, stw)
+    join shk_level1 on ac_cal_level1b.stw = shk_level1.stw and
+    ac_cal_level1b.backend = shk_level1.backend""",
+    """
+    left join attitude_level1 using (backend, stw)
+    join ac_level0 using (backend, stw)
+    join shk_level1 on ac_cal_level1b.stw = shk_level1.stw and
+    ac_cal_level1b.backend = shk_level1.backend""",
+)
+
+CALIBRATION_QUERIES = tuple(
+    squeeze_query(
+        CALIBRATION_COLUMNS
+        + joins
+        + """
+        where ac_cal_level1b.stw = :c and
+        ac_cal_level1b.backend = :b
+        and version = 8 and freqmode = :f
+        order by stw asc, intmode asc, spectype asc"""
+    )
+    for joins in CALIBRATION_JOINS
+)
+
+CALIBRATION_RANGE_QUERIES = tuple(
+    squeeze_query(
+        CALIBRATION_COLUMNS
+        + joins
+        + """
+        where ac_cal_level1b.stw between :c1 and :c2 and
+        ac_cal_level1b.backend = :b
+        and version = 8 and freqmode = :f
+        order by stw asc, intmode asc, spectype asc"""
+    )
+    for joins in CALIBRATION_JOINS
+)
+
+# the columns needed for the scan log, see get_scan_logdata_v2
+LOG_TARGET_COLUMNS = """\
+    select ac_level1b.stw, calstw, mjd, intmode, tsys, freqmode,
+    efftime, latitude, longitude, altitude, sunzd, inttime,
+    ac_level1b.frontend, ac_level0.frontend as ac0_frontend
+    """
+
+LOG_TARGET_QUERY = squeeze_query(
+    LOG_TARGET_COLUMNS
+    + TARGET_FROM
+    + """
+    and calstw = :c
+    order by stw asc, intmode asc"""
+)
+
+LOG_CALIBRATION_QUERIES = tuple(
+    squeeze_query(
+        """\
+        select ac_cal_level1b.stw, mjd, intmode, spectype, freqmode,
+        latitude, longitude, altitude, tspill, sunzd, inttime,
+        ac_cal_level1b.frontend, ac_level0.frontend as ac0_frontend
+        from ac_cal_level1b"""
+        + joins
+        + """
+        where ac_cal_level1b.stw = :c and
+        ac_cal_level1b.backend = :b
+        and version = 8 and freqmode = :f
+        order by stw asc, intmode asc, spectype asc"""
+    )
+    for joins in CALIBRATION_JOINS
+)
+
+REFERENCE_FROM = """
+    from ac_level0
+    join attitude_level1 using (backend, stw)
+    join fba_level0 on fba_level0.stw = ac_level0.stw + :so"""
+
+REFERENCE_COLUMNS = (
+    """\
+    select backend, frontend, ac_level0.stw, inttime, cc,
+    sig_type, mech_type, skybeamhit"""
+    + REFERENCE_FROM
+)
+
+REFERENCE_QUERY = squeeze_query(
+    REFERENCE_COLUMNS
+    + """
+    where ac_level0.stw between :s1 and :s2
+    and sig_type = 'REF'
+    order by ac_level0.stw"""
+)
+
+SCAN_STW_RANGE = (
+    """\
+    with scan as (
+        select min(ac_level1b.stw) as stw1, max(ac_level1b.stw) as stw2
+    """
+    + TARGET_FROM
+    + """
+        and calstw = :c
+    )
+    """
+)
+
+SCAN_REFERENCE_WHERE = f"""
+    where ac_level0.stw between
+    (select stw1 from scan) - {REFERENCE_STW_MARGIN} and
+    (select stw2 from scan) + {REFERENCE_STW_MARGIN}
+    and sig_type = 'REF'"""
+
+# same as REFERENCE_QUERY but with the stw range of the scan found by the
+# database, so that it can be sent together with the other queries
+SCAN_REFERENCE_QUERY = squeeze_query(
+    SCAN_STW_RANGE
+    + REFERENCE_COLUMNS
+    + SCAN_REFERENCE_WHERE
+    + """
+    order by ac_level0.stw"""
+)
+
+# only tells if there are references for the scan
+SCAN_HAS_REFERENCE_QUERY = squeeze_query(
+    SCAN_STW_RANGE
+    + "select ac_level0.stw"
+    + REFERENCE_FROM
+    + SCAN_REFERENCE_WHERE
+    + """
+    limit 1"""
+)
 
 
 class ScandataExporter:
@@ -38,308 +235,219 @@ class ScandataExporter:
         self.scaninfo = []
         self.spectra = []
 
-    def get_db_data(self, freqmode, calstw):
-        """export scan data from database tables"""
+    def get_db_data_pipelined(
+        self,
+        freqmode,
+        calstw,
+        target_query=TARGET_QUERY,
+        calibration_queries=CALIBRATION_QUERIES,
+        reference_query=SCAN_REFERENCE_QUERY,
+    ):
+        """export scan data from database tables in one round trip
+
+        All queries, including the calibration fallbacks, are sent in one
+        pipeline and the fallback is chosen here.
+        """
         self.calstw = calstw
-        # extract all target spectrum data for the scan
-        temp = dict(b=self.backend, c=calstw, f=freqmode)
-        result = db.session.execute(
-            text(
-                squeeze_query(
-                    """\
-              select ac_level1b.stw, calstw, ac_level1b.backend, orbit,
-              mjd, lst, intmode, mode, spectra, alevel, version, channels,
-              skyfreq, lofreq, restfreq, maxsuppression, tsys, sourcemode,
-              freqmode, efftime, sbpath, latitude, longitude, altitude,
-              skybeamhit, ra2000, dec2000, vsource, qtarget, qachieved,
-              qerror, gpspos, gpsvel, sunpos, moonpos, sunzd, vgeo, vlsr,
-              ssb_fq, inttime, ac_level1b.frontend, hotloada, hotloadb, lo,
-              sig_type, imageloada, imageloadb, ac_level1b.soda,
-              ac_level0.frontend as ac0_frontend
-              from ac_level1b
-              join attitude_level1 using (backend, stw)
-              join ac_level0 using (backend, stw)
-              join shk_level1 on ac_level1b.stw = shk_level1.stw and
-              ac_level1b.backend = shk_level1.backend and
-              ac_level1b.frontend = shk_level1.frontendsplit
-              where calstw = :c and ac_level1b.backend = :b and
-              version = 8 and sig_type = 'SIG' and freqmode = :f
-              order by stw asc, intmode asc"""
-                )
-            ),
-            params=temp,
-        ).all()
-        # extract all calibration spectrum data for the scan
-        result2 = db.session.execute(
-            text(
-                squeeze_query(
-                    """\
-               select ac_cal_level1b.stw, ac_cal_level1b.backend, orbit,
-               mjd, lst, intmode, mode, spectra, alevel, version, channels,
-               spectype, skyfreq, lofreq, restfreq, maxsuppression,
-               sourcemode, freqmode, sbpath, latitude, longitude, altitude,
-               tspill, skybeamhit, ra2000, dec2000, vsource, qtarget,
-               qachieved, qerror, gpspos, gpsvel, sunpos, moonpos, sunzd,
-               vgeo, vlsr, ssb_fq, inttime, ac_cal_level1b.frontend,
-               hotloada, hotloadb, lo, sig_type, imageloada, imageloadb,
-               ac_cal_level1b.soda, ac_level0.frontend as ac0_frontend
-               from ac_cal_level1b
-               join attitude_level1 using (backend, stw)
-               join ac_level0 using (backend, stw)
-               join shk_level1 on ac_cal_level1b.stw = shk_level1.stw and
-               ac_cal_level1b.backend = shk_level1.backend and
-               ac_cal_level1b.frontend = shk_level1.frontendsplit
-               where ac_cal_level1b.stw = :c and
-               ac_cal_level1b.backend = :b
-               and version = 8 and freqmode = :f
-               order by stw asc, intmode asc, spectype asc"""
-                )
-            ),
-            params=temp,
-        ).all()
-        if result2 == []:
-            result2 = db.session.execute(
-                text(
-                    squeeze_query(
-                        """\
-               select ac_cal_level1b.stw, ac_cal_level1b.backend, orbit,
-               mjd, lst, intmode, mode, spectra, alevel, version, channels,
-               spectype, skyfreq, lofreq, restfreq, maxsuppression,
-               sourcemode, freqmode, sbpath, latitude, longitude, altitude,
-               tspill, skybeamhit, ra2000, dec2000, vsource, qtarget,
-               qachieved, qerror, gpspos, gpsvel, sunpos, moonpos, sunzd,
-               vgeo, vlsr, ssb_fq, inttime, ac_cal_level1b.frontend,
-               hotloada, hotloadb, lo, sig_type, imageloada, imageloadb,
-               ac_cal_level1b.soda, ac_level0.frontend as ac0_frontend
-               from ac_cal_level1b
-               join attitude_level1 using (backend, stw)
-               join ac_level0 using (backend, stw)
-               join shk_level1 on ac_cal_level1b.stw = shk_level1.stw and
-               ac_cal_level1b.backend = shk_level1.backend
-               where ac_cal_level1b.stw = :c and
-               ac_cal_level1b.backend = :b
-               and version = 8 and freqmode = :f
-               order by stw asc, intmode asc, spectype asc"""
-                    )
-                ),
-                params=temp,
-            ).all()
-            if result2 == []:
-                result2 = db.session.execute(
-                    text(
-                        squeeze_query(
-                            """\
-                   select ac_cal_level1b.stw, ac_cal_level1b.backend, orbit,
-                   mjd, lst, intmode, mode, spectra, alevel, version, channels,
-                   spectype, skyfreq, lofreq, restfreq, maxsuppression,
-                   sourcemode, freqmode, sbpath, latitude, longitude, altitude,
-                   tspill, skybeamhit, ra2000, dec2000, vsource, qtarget,
-                   qachieved, qerror, gpspos, gpsvel, sunpos, moonpos, sunzd,
-                   vgeo, vlsr, ssb_fq, inttime, ac_cal_level1b.frontend,
-                   hotloada, hotloadb, lo, sig_type, imageloada, imageloadb,
-                   ac_cal_level1b.soda, ac_level0.frontend as ac0_frontend
-                   from ac_cal_level1b
-                   left join attitude_level1  using (backend, stw)
-                   join ac_level0  using (backend, stw)
-                   join shk_level1 on ac_cal_level1b.stw = shk_level1.stw and
-                   ac_cal_level1b.backend = shk_level1.backend
-                   where ac_cal_level1b.stw = :c and
-                   ac_cal_level1b.backend = :b and
-                   version = 8 and freqmode = :f
-                   order by stw asc, intmode asc,
-                   spectype asc"""
-                        )
-                    ),
-                    params=temp,
-                ).all()
-        # extract all reference spectrum data for the scan
+        params = dict(
+            b=self.backend, c=calstw, f=freqmode, so=self.get_reference_stw_offset()
+        )
+        result, *calibration_results, refdata = execute_pipelined(
+            [target_query, *calibration_queries, reference_query], params
+        )
+        result2 = next((rows for rows in calibration_results if rows != []), [])
+        return self.combine_db_data(result, result2, refdata)
+
+    def get_db_data_sequential(
+        self,
+        freqmode,
+        calstw,
+        target_query=TARGET_QUERY,
+        calibration_queries=CALIBRATION_QUERIES,
+        reference_query=SCAN_REFERENCE_QUERY,
+    ):
+        """same as get_db_data_pipelined but with one query at a time
+
+        The calibration fallbacks are only queried when needed.
+        """
+        self.calstw = calstw
+        params = dict(
+            b=self.backend, c=calstw, f=freqmode, so=self.get_reference_stw_offset()
+        )
+        result = execute_rows(target_query, params)
+        result2 = []
+        for query in calibration_queries:
+            result2 = execute_rows(query, params)
+            if result2 != []:
+                break
+        refdata = execute_rows(reference_query, params)
+        return self.combine_db_data(result, result2, refdata)
+
+    def fetch_db_data(self, freqmode, calstw, *queries):
+        """export scan data with get_db_data_pipelined unless disabled
+
+        The queries are sent one at a time with L1B_PIPELINED_FETCH off.
+        """
+        if current_app.config.get("L1B_PIPELINED_FETCH", True):
+            return self.get_db_data_pipelined(freqmode, calstw, *queries)
+        return self.get_db_data_sequential(freqmode, calstw, *queries)
+
+    def get_reference_stw_offset(self):
+        """stw offset between ac_level0 and fba_level0"""
         if self.backend == "AC1":
-            stw_offset = -1
+            return -1
         elif self.backend == "AC2":
-            stw_offset = 0
-        else:
-            abort(400)
-
-        stw1 = result[0].stw - 256
-        stw2 = result[-1].stw + 256
-        refdata = db.session.execute(
-            text(
-                squeeze_query(
-                    """
-                  select backend, frontend, ac_level0.stw, inttime, cc,
-                  sig_type, mech_type, skybeamhit
-                  from ac_level0
-                  join attitude_level1  using (backend, stw)
-                  join fba_level0 on fba_level0.stw = ac_level0.stw+ :so
-                  where ac_level0.stw between :s1 and :s2
-                  and sig_type = 'REF'
-                  order by ac_level0.stw
-                             """
-                )
-            ),
-            params=dict(s1=stw1, s2=stw2, so=stw_offset),
-        )
-        self.refdata = [row._asdict() for row in refdata]
+            return 0
+        abort(400)
 
+    def combine_db_data(self, result, result2, refdata):
+        """combine target and calibration data"""
+        self.refdata = refdata
         if result == [] or result2 == [] or self.refdata == []:
             return 0
-        # combine target and calibration data
         self.specdata = []  # list of both target and calibration spectrum data
         self.scaninfo = []  # list of calstw tells which scan a spectrum belong
         for ind, row2 in enumerate(result2):
             # fist add calibration spectrum
-            self.specdata.append(row2._asdict())
-            self.scaninfo.append(row2.stw)
+            self.specdata.append(row2)
+            self.scaninfo.append(row2["stw"])
             if ind < len(result2) - 1:
-                if result2[ind].stw == result2[ind + 1].stw:
+                if result2[ind]["stw"] == result2[ind + 1]["stw"]:
                     continue
             for row in result:
-                if row.calstw == row2.stw:
-                    self.scaninfo.append(row.calstw)
-                    self.specdata.append(row._asdict())
+                if row["calstw"] == row2["stw"]:
+                    self.scaninfo.append(row["calstw"])
+                    self.specdata.append(row)
         return 1
 
     def decode_refdata(self):
         """decode reference data"""
+        rows = self.refdata
         refdata = {
-            "backend": [],
-            "frontend": [],
-            "stw": [],
-            "sig_type": [],
-            "mech_type": [],
-            "skybeamhit": [],
-            "inttime": [],
-            "cc": [],
-        }
-        for row in self.refdata:
-            for item in refdata:
-                if item == "cc":
-                    corrcoef = np.ndarray(
-                        shape=(8 * 96,), dtype="float64", buffer=row["cc"]  # ty:ignore[invalid-argument-type]
-                    )
-                    # store only zerolags
-                    zerolag = []
-                    for cci in corrcoef[0::96]:
-                        zerolag.append(zerolagfunc(cci, 1.0))
-                    refdata["cc"].append(zerolag)
-                else:
-                    refdata[item].append(row[item])  # ty:ignore[invalid-argument-type]
-        for item in refdata:
-            refdata[item] = np.array(refdata[item])
-        self.refdata = refdata
-
-    def decode_specdata(self):
-        """decode spec data"""
-        self.spectra = specdict()
-        for ind, res in enumerate(self.specdata):
-            spec = specdict()
-            spec["calstw"] = self.calstw
+            item: np.array([row[item] for row in rows])
             for item in [
+                "backend",
+                "frontend",
                 "stw",
-                "orbit",
-                "lst",
-                "intmode",
-                "mode",
-                "channels",
-                "skyfreq",
-                "lofreq",
-                "restfreq",
-                "maxsuppression",
-                "sbpath",
-                "latitude",
-                "longitude",
-                "altitude",
+                "sig_type",
+                "mech_type",
                 "skybeamhit",
-                "ra2000",
-                "dec2000",
-                "vsource",
-                "sunzd",
-                "vgeo",
-                "vlsr",
                 "inttime",
-                "lo",
-                "freqmode",
-                "soda",
-                "ac0_frontend",
-            ]:
-                spec[item] = res[item]
-
-            spec["mjd"] = self.get_mjd(res)
-            spec["hotloada"] = choose_nonzero(res["hotloada"], res["hotloadb"])
-            spec["imageloada"] = choose_nonzero(res["imageloada"], res["imageloadb"])
-            for item in [
-                "qtarget",
-                "qachieved",
-                "qerror",
-                "gpspos",
-                "gpsvel",
-                "sunpos",
-                "moonpos",
-            ]:
-                try:
-                    spec[item] = np.array(res[item]).astype(float).tolist()
-                except AttributeError:
-                    spec[item] = ()
-
-            spec["ssb_fq"] = np.array(res["ssb_fq"]).astype(float) * 1e6
-            # change backend and frontend to integer
-            spec["backend"] = backend_char2int(res["backend"])
-            spec["frontend"] = frontend_char2int(res["frontend"])
-            data = np.ndarray(
-                shape=(res["channels"],), dtype="float64", buffer=res["spectra"]
+            ]
+        }
+        # store only zerolags, the first lag of each band
+        corrcoef = decode_correlations([row["cc"] for row in rows])
+        refdata["cc"] = zerolagfunc_array(corrcoef[:, ::CC_LAGS], 1.0)
+        self.refdata = refdata
+
+    def decode_specdata(self):
+        """decode spec data
+
+        The fields are decoded column by column into arrays, with the
+        spectra in one 2-D array.
+        """
+        rows = self.specdata
+        nspec = len(rows)
+        columns = {
+            item: np.array(values)
+            for item, values in zip(
+                SPECTRUM_COLUMNS, zip(*map(itemgetter(*SPECTRUM_COLUMNS), rows))
             )
-            try:
-                if res["ac0_frontend"] == "SPL" and res["spectype"] == "SSB":
-                    data = data[0:448]
-            except KeyError:
-                # this operation only needs to be done with SSB data
-                pass
-            spec["spectrum"] = data
-            # deal with fields that only are stored for calibration
-            # or target signals
-            try:
-                spec["tsys"] = res["tsys"]
-                spec["efftime"] = res["efftime"]
-            except KeyError:
-                spec["tsys"] = 0.0
-                spec["efftime"] = 0.0
-            try:
-                spec["tspill"] = res["tspill"]
-                tspill_index = ind
-                if res["spectype"] == "CAL":
-                    spec["type"] = 3
-                elif res["spectype"] == "SSB":
-                    spec["type"] = 9
-            except KeyError:
-                spec["type"] = 8
-                spec["tspill"] = self.specdata[tspill_index]["tspill"]
-            spec["sourcemode"] = (
-                res["sourcemode"]
-                .replace("STRAT", "stratospheric")
-                .replace("ODD_H", "Odd hydrogen")
-                .replace("ODD_N", "Odd nitrogen")
-                .replace("WATER", "Water isotope")
-                .replace("SUMMER", "Summer mesosphere")
-                .replace("DYNAM", "Transport")
-                + " FM="
-                + str(res["freqmode"])
+        }
+        columns["calstw"] = np.full(nspec, self.calstw)
+        columns["mjd"] = np.array([self.get_mjd(row) for row in rows])
+        columns["hotloada"] = np.array(
+            [choose_nonzero(row["hotloada"], row["hotloadb"]) for row in rows]
+        )
+        columns["imageloada"] = np.array(
+            [choose_nonzero(row["imageloada"], row["imageloadb"]) for row in rows]
+        )
+        for item in POSITION_COLUMNS:
+            columns[item] = np.array([row[item] for row in rows], dtype=float)
+        columns["ssb_fq"] = np.array([row["ssb_fq"] for row in rows], dtype=float) * 1e6
+        # change backend and frontend to integer
+        columns["backend"] = np.array([backend_char2int(row["backend"]) for row in rows])
+        columns["frontend"] = np.array(
+            [frontend_char2int(row["frontend"]) for row in rows]
+        )
+        columns["spectrum"] = self.decode_spectra(rows)
+        columns.update(self.decode_spectypes(rows))
+        columns["sourcemode"] = np.array(
+            [decode_sourcemode(row["sourcemode"], row["freqmode"]) for row in rows]
+        )
+        columns["version"] = np.full(nspec, 8)
+        columns["quality"] = np.zeros(nspec, dtype=int)
+        columns["discipline"] = np.ones(nspec, dtype=int)
+        columns["topic"] = np.ones(nspec, dtype=int)
+        columns["spectrum_index"] = np.arange(nspec)
+        columns["obsmode"] = np.full(nspec, 2)
+        columns["freqres"] = np.full(nspec, 1000000.0)
+        columns["frequency"] = np.zeros(nspec, dtype=int)
+        empty = np.empty((nspec, 0))
+        self.spectra = {item: columns.get(item, empty) for item in specdict()}
+
+    def decode_logdata(self):
+        """decode the data needed for the scan log, see get_scan_logdata_v2"""
+        rows = self.specdata
+        columns = {item: np.array([row[item] for row in rows]) for item in LOG_COLUMNS}
+        columns["mjd"] = np.array([self.get_mjd(row) for row in rows])
+        columns["frontend"] = np.array(
+            [frontend_char2int(row["frontend"]) for row in rows]
+        )
+        columns.update(self.decode_spectypes(rows))
+        columns["quality"] = np.zeros(len(rows), dtype=int)
+        self.spectra = columns
+
+    @staticmethod
+    def decode_spectypes(rows):
+        """decode the fields that only are stored for calibration or target
+        signals, targets use the tspill of the calibration spectrum before
+        them
+        """
+        tsys = []
+        efftime = []
+        tspill = []
+        spectype = []
+        for row in rows:
+            if "tspill" in row:
+                tsys.append(0.0)
+                efftime.append(0.0)
+                tspill.append(row["tspill"])
+                spectype.append(CALIBRATION_SPECTYPES[row["spectype"]])
+            else:
+                tsys.append(row["tsys"])
+                efftime.append(row["efftime"])
+                tspill.append(tspill[-1])
+                spectype.append(8)
+        return {
+            "tsys": np.array(tsys),
+            "efftime": np.array(efftime),
+            "tspill": np.array(tspill),
+            "type": np.array(spectype),
+        }
+
+    @staticmethod
+    def decode_spectra(rows):
+        """decode the spectrum blobs into one array with a row per spectrum"""
+        channels = [
+            min(row["channels"], 448)
+            if row["ac0_frontend"] == "SPL" and row.get("spectype") == "SSB"
+            else row["channels"]
+            for row in rows
+        ]
+        # spectra of a scan have the same length, this raises otherwise
+        spectra = np.empty((len(rows), channels[0] if rows else 0))
+        for ind, row in enumerate(rows):
+            spectra[ind] = np.frombuffer(
+                row["spectra"], dtype="float64", count=channels[ind]
             )
-            spec["version"] = 8
-            spec["quality"] = 0
-            spec["discipline"] = 1
-            spec["topic"] = 1
-            spec["spectrum_index"] = ind
-            spec["obsmode"] = 2
-            spec["freqres"] = 1000000.0
-            spec["frequency"] = 0
-            for item in spec:
-                self.spectra[item].append(spec[item])
+        return spectra
 
     def get_mjd(self, data):
         """decode mjd data"""
         if data["mjd"] is not None:
             return data["mjd"]
-        if data["spectype"] in ["SSB", "CAL"]:
+        if data.get("spectype") in ["SSB", "CAL"]:
             # field MJD is missing for some calibration spectra:
             # use MJD of the first target spectrum in scan
             for row in self.specdata:
@@ -353,7 +461,9 @@ class CalibrationStep2:
     i.e. remove ripple"""
 
     def __init__(self, freqmode, version):
-        self.spectra = [caldict()]
+        # median fits already looked up, by version, intmode, freqmode,
+        # ssb_fq, altitude range and hotload range
+        self.spectra = {}
         self.spec = []
         self.freqmode = freqmode
         self.version = version
@@ -410,27 +520,17 @@ class CalibrationStep2:
             *[int(np.floor(hotload)), int(np.ceil(hotload))]
         )
         # find out if we already have required data
-        for spec in self.spectra:
-            if np.all(
-                [
-                    spec["version"],
-                    spec["intmode"],
-                    spec["freqmode"],
-                    spec["ssb_fq"],
-                    spec["altitude_range"],
-                    spec["hotload_range"],
-                ]
-                == [
-                    self.version,
-                    intmode,
-                    self.freqmode,
-                    ssb_fq,
-                    self.altitude_range,
-                    hotload_range,
-                ]
-            ):
-                self.spec = spec
-                return
+        key = (
+            self.version,
+            intmode,
+            self.freqmode,
+            tuple(ssb_fq),
+            self.altitude_range,
+            hotload_range,
+        )
+        self.spec = self.spectra.get(key)
+        if self.spec is not None:
+            return
         if self.freqmode in [1, 2, 8, 13, 17, 19, 21]:
             medianfit = self.get_medianfit(intmode, ssb_fq, hotload)
         else:
@@ -443,60 +543,33 @@ class CalibrationStep2:
         self.spec["altitude_range"] = self.altitude_range
         self.spec["hotload_range"] = hotload_range
         self.spec["spectrum"] = medianfit
-        self.spectra.append(self.spec)
+        self.spectra[key] = self.spec
 
     def get_medianfit(self, intmode, ssb_fq, hotload):
         """get median fit spectrum"""
         [hotload_range1, hotload_range2, hl_1, hl_2] = self.get_hotload_range(hotload)
-        query_string = squeeze_query(
-            """\
-            select hotload_range, altitude_range, median_fit, channels
-            from ac_cal_level1c where freqmode = :f and
-            version = :v and intmode = :i and ssb_fq = :s
-            and altitude_range = :a and hotload_range = :h
-            order by hotload_range"""
+        medianfit1 = get_median_fit(
+            self.freqmode,
+            self.version,
+            intmode,
+            ssb_fq,
+            self.altitude_range,
+            hotload_range1,
         )
-
-        result1 = db.session.execute(
-            text(query_string),
-            params=dict(
-                f=self.freqmode,
-                v=int(self.version),
-                i=intmode,
-                s=ssb_fq.__repr__().translate(str.maketrans("[]", "{}")),
-                a=self.altitude_range,
-                h=hotload_range1,
-            ),
-        ).all()
-        result2 = db.session.execute(
-            text(query_string),
-            params=dict(
-                f=self.freqmode,
-                v=int(self.version),
-                i=intmode,
-                s=ssb_fq.__repr__().translate(str.maketrans("[]", "{}")),
-                a=self.altitude_range,
-                h=hotload_range2,
-            ),
-        ).all()
-        if result1 != []:
-            medianfit1 = np.ndarray(
-                shape=(result1[0].channels,),
-                dtype="float64",
-                buffer=result1[0].median_fit,
-            )
-        if result2 != []:
-            medianfit2 = np.ndarray(
-                shape=(result2[0].channels,),
-                dtype="float64",
-                buffer=result2[0].median_fit,
-            )
-        if result1 and result2:
+        medianfit2 = get_median_fit(
+            self.freqmode,
+            self.version,
+            intmode,
+            ssb_fq,
+            self.altitude_range,
+            hotload_range2,
+        )
+        if medianfit1 is not None and medianfit2 is not None:
             weight1 = 1 - np.abs(hl_1 - hotload) / np.abs(hl_2 - hl_1)
             medianfit = weight1 * medianfit1 + (1 - weight1) * medianfit2
-        elif result1:
+        elif medianfit1 is not None:
             medianfit = medianfit1
-        elif result2:
+        elif medianfit2 is not None:
             medianfit = medianfit2
         else:
             medianfit = 0.0
@@ -541,6 +614,77 @@ def caldict():
     return cal
 
 
+# fields copied as they are from the database rows
+SPECTRUM_COLUMNS = (
+    "stw",
+    "orbit",
+    "lst",
+    "intmode",
+    "mode",
+    "channels",
+    "skyfreq",
+    "lofreq",
+    "restfreq",
+    "maxsuppression",
+    "sbpath",
+    "latitude",
+    "longitude",
+    "altitude",
+    "skybeamhit",
+    "ra2000",
+    "dec2000",
+    "vsource",
+    "sunzd",
+    "vgeo",
+    "vlsr",
+    "inttime",
+    "lo",
+    "freqmode",
+    "soda",
+    "ac0_frontend",
+)
+
+# attitude and position vectors
+POSITION_COLUMNS = (
+    "qtarget",
+    "qachieved",
+    "qerror",
+    "gpspos",
+    "gpsvel",
+    "sunpos",
+    "moonpos",
+)
+
+# fields copied as they are for the scan log
+LOG_COLUMNS = (
+    "stw",
+    "intmode",
+    "latitude",
+    "longitude",
+    "altitude",
+    "sunzd",
+    "inttime",
+    "freqmode",
+    "ac0_frontend",
+)
+
+CALIBRATION_SPECTYPES = {"CAL": 3, "SSB": 9}
+
+
+def decode_sourcemode(sourcemode, freqmode):
+    """human readable source mode"""
+    return (
+        sourcemode.replace("STRAT", "stratospheric")
+        .replace("ODD_H", "Odd hydrogen")
+        .replace("ODD_N", "Odd nitrogen")
+        .replace("WATER", "Water isotope")
+        .replace("SUMMER", "Summer mesosphere")
+        .replace("DYNAM", "Transport")
+        + " FM="
+        + str(freqmode)
+    )
+
+
 def specdict():
     """creates an empty dictionary"""
     spec = dict()
@@ -610,6 +754,22 @@ def specdict():
     return spec
 
 
+# reference correlator data: lags for each of the eight bands
+CC_BANDS = 8
+CC_LAGS = 96
+CC_SIZE = CC_BANDS * CC_LAGS
+
+
+def decode_correlations(blobs):
+    """decode correlator blobs into an array with a row per blob"""
+    itemsize = np.dtype("float64").itemsize
+    if all(len(blob) == CC_SIZE * itemsize for blob in blobs):
+        return np.frombuffer(b"".join(blobs), dtype="float64").reshape(-1, CC_SIZE)
+    return np.array(
+        [np.frombuffer(blob, dtype="float64", count=CC_SIZE) for blob in blobs]
+    ).reshape(-1, CC_SIZE)
+
+
 def inv_erfc(zerolag):
     """inverse error function"""
     pcoef = [1.591863138, -2.442326820, 0.37153461]
@@ -661,6 +821,16 @@ def zerolagfunc(zlag, vterm):
     return xterm * xterm / 2.0
 
 
+def zerolagfunc_array(zlag, vterm):
+    """zerolag function for an array of zerolags"""
+    zlag = np.asarray(zlag, dtype="float64")
+    result = np.zeros(zlag.shape)
+    valid = ~((zlag >= 1.0) | (zlag <= 0.0))
+    xterm = vterm / inv_erfc(zlag[valid])
+    result[valid] = xterm * xterm / 2.0
+    return result
+
+
 def planck(temp, freq):
     """planck tb"""
     hconst = 6.626176e-34  # Planck constant (Js)
@@ -680,7 +850,18 @@ def scan2dictlist_v2():
 
 def scan2dictlist_v4(spectra):
     """create a dictionary with lists"""
-    datadict = {
+    datadict = scan2dict_v4(spectra)
+    for item in datadict:
+        try:
+            datadict[item] = datadict[item].tolist()
+        except AttributeError:
+            pass
+    return datadict
+
+
+def scan2dict_v4(spectra):
+    """create a dictionary with the v4 names of the target spectra data"""
+    return {
         "Version": spectra["version"][2::],
         "Quality": spectra["quality"][2::],
         "STW": spectra["stw"][2::],
@@ -724,12 +905,6 @@ def scan2dictlist_v4(spectra):
         "Frequency": spectra["frequency"],
         "ZeroLagVar": spectra["zerolagvar"][2::],
     }
-    for item in datadict:
-        try:
-            datadict[item] = datadict[item].tolist()
-        except AttributeError:
-            pass
-    return datadict
 
 
 def plot_scan(backend, calstw, spectra):
@@ -969,93 +1144,92 @@ def unsplit_splitmode(scangr):
     """unpslit data (from splitmode) to make it symmetric with
     data from other modes
     """
-    spectra = copyemptydict(scangr.spectra)
-    stw = np.array(scangr.spectra["stw"])
-    for ind, _ in enumerate(stw):
-        tempdata = copyemptydict(scangr.spectra)
-        for item in scangr.spectra:
-            tempdata[item] = scangr.spectra[item][ind]
-        spectrum = np.zeros(896)
-        if scangr.spectra["intmode"][0] == 2047:
-            spectrum[224:448] = scangr.spectra["spectrum"][ind][0:224]
-            spectrum[672:896] = scangr.spectra["spectrum"][ind][224:448]
-        else:
-            spectrum[0:224] = scangr.spectra["spectrum"][ind][0:224]
-            spectrum[448:672] = scangr.spectra["spectrum"][ind][224:448]
-        tempdata["spectrum"] = spectrum
-        tempdata["intmode"] = 511
-        for item in tempdata:
-            spectra[item].append(tempdata[item])
+    spectra = {item: np.asarray(value) for item, value in scangr.spectra.items()}
+    part = spectra["spectrum"]
+    spectrum = np.zeros((part.shape[0], 896))
+    if spectra["intmode"][0] == 2047:
+        spectrum[:, 224:448] = part[:, 0:224]
+        spectrum[:, 672:896] = part[:, 224:448]
+    else:
+        spectrum[:, 0:224] = part[:, 0:224]
+        spectrum[:, 448:672] = part[:, 224:448]
+    spectra["spectrum"] = spectrum
+    spectra["intmode"] = np.full(part.shape[0], 511)
     scangr.spectra = spectra
-    for item in scangr.spectra:
-        scangr.spectra[item] = np.array(scangr.spectra[item])
     return scangr
 
 
+UNSPLIT_SPECTYPES = (3, 9, 8)
+
+
+def get_unsplit_pairs(stw, spectype):
+    """indexes of the two halves of each spectrum to unsplit
+
+    The halves have the same stw and type. Pairs are ordered on stw and
+    then on type (3, 9, 8), stw and type combinations that do not occur
+    exactly twice are left out.
+    """
+    stw = np.asarray(stw)
+    rank = np.full(stw.shape[0], len(UNSPLIT_SPECTYPES))
+    for ind, value in enumerate(UNSPLIT_SPECTYPES):
+        rank[np.asarray(spectype) == value] = ind
+    order = np.lexsort((np.arange(stw.shape[0]), rank, stw))
+    stw, rank = stw[order], rank[order]
+    starts = np.flatnonzero(
+        np.r_[True, (stw[1:] != stw[:-1]) | (rank[1:] != rank[:-1])]
+    )
+    sizes = np.diff(np.r_[starts, stw.shape[0]])
+    starts = starts[(sizes == 2) & (rank[starts] < len(UNSPLIT_SPECTYPES))]
+    return order[starts], order[starts + 1]
+
+
 def unsplit_normalmode(scangr):
-    """unsplit deta from intmode != 511 e.g. freqmode 1"""
-    spectra = copyemptydict(scangr.spectra)
-    for stw_i in np.sort(np.unique(scangr.spectra["stw"])):
-        for spectype in [3, 9, 8]:
-            specind = np.nonzero(
-                (scangr.spectra["stw"] == stw_i) & (scangr.spectra["type"] == spectype)
-            )[0]
-            if specind.shape[0] != 2:
-                continue
-            tempdata = copyemptydict(scangr.spectra)
-            for item in scangr.spectra:
-                tempdata[item] = scangr.spectra[item][specind[0]]
-            freqvec = freqfunc(
-                tempdata["lofreq"], tempdata["skyfreq"], tempdata["ssb_fq"]
-            )
-            freqi = []
-            for item in range(4):
-                freqi.append(np.mean(freqvec[item * 224 : (item + 1) * 224]))
-            spectrum = []
-            part1 = scangr.spectra["spectrum"][specind[0]]
-            part2 = scangr.spectra["spectrum"][specind[1]]
-            spec1i = 0
-            spec2i = 0
-            for indi in np.argsort(np.array(freqi)):
-                if tempdata["skyfreq"] < tempdata["lofreq"]:
-                    # Lower sideband mode, e.g. FM 8:
-                    if indi >= 2:
-                        spectrum = np.append(
-                            spectrum, part1[spec1i * 224 : (spec1i + 1) * 224]
-                        )
-                        spec1i = spec1i + 1
-                    else:
-                        spectrum = np.append(
-                            spectrum, part2[spec2i * 224 : (spec2i + 1) * 224]
-                        )
-                        spec2i = spec2i + 1
-                else:
-                    # Upper sideband mode, e.g. FM 1:
-                    if indi < 2:
-                        spectrum = np.append(
-                            spectrum, part1[spec1i * 224 : (spec1i + 1) * 224]
-                        )
-                        spec1i = spec1i + 1
-                    else:
-                        spectrum = np.append(
-                            spectrum, part2[spec2i * 224 : (spec2i + 1) * 224]
-                        )
-                        spec2i = spec2i + 1
-            tempdata["spectrum"] = spectrum
-            tempdata["intmode"] = 511
-            for item in tempdata:
-                spectra[item].append(tempdata[item])
+    """unsplit deta from intmode != 511 e.g. freqmode 1
+
+    The two halves of each spectrum hold two sub bands each. The sub bands
+    are put in frequency order, the upper sideband ones come from the
+    first half (the lower sideband ones in lower sideband modes, e.g.
+    FM 8).
+    """
+    columns = {item: np.asarray(value) for item, value in scangr.spectra.items()}
+    first, second = get_unsplit_pairs(columns["stw"], columns["type"])
+    spectra = {item: value[first] for item, value in columns.items()}
+    freqvec = freqfunc_array(spectra["lofreq"], spectra["skyfreq"], spectra["ssb_fq"])
+    freqi = freqvec.reshape(-1, 4, 224).mean(axis=2)
+    lower = spectra["skyfreq"] < spectra["lofreq"]
+    indi = np.argsort(freqi, axis=1)
+    from_first = np.where(lower[:, np.newaxis], indi >= 2, indi < 2)
+    # sub band of the first half, or of the second half after it
+    band = np.where(
+        from_first,
+        np.cumsum(from_first, axis=1) - 1,
+        np.cumsum(~from_first, axis=1) + 1,
+    )
+    parts = np.hstack(
+        [
+            columns["spectrum"][first, 0:448],
+            columns["spectrum"][second, 0:448],
+        ]
+    )
+    channels = (band[:, :, np.newaxis] * 224 + np.arange(224)).reshape(-1, 896)
+    spectra["spectrum"] = np.take_along_axis(parts, channels, axis=1)
+    spectra["intmode"] = np.full(first.shape[0], 511)
     scangr.spectra = spectra
-    for item in scangr.spectra:
-        scangr.spectra[item] = np.array(scangr.spectra[item])
     return scangr
 
 
-def apply_calibration_step2(scangr):
-    """apply correction"""
-    calgr = CalibrationStep2(
-        scangr.spectra["freqmode"][2], scangr.spectra["version"][2]
-    )
+def apply_calibration_step2(scangr, calibrations=None):
+    """apply correction
+
+    calibrations can be a dict shared between scans, so that the median
+    fits are only read once per freqmode and version.
+    """
+    key = (scangr.spectra["freqmode"][2], scangr.spectra["version"][2])
+    if calibrations is None:
+        calibrations = {}
+    calgr = calibrations.get(key)
+    if calgr is None:
+        calgr = calibrations[key] = CalibrationStep2(*key)
     for index, speci in enumerate(scangr.specdata):
         if scangr.spectra["type"][index] == 8:
             # load calibration (high-altitude) spectrum
@@ -1063,7 +1237,7 @@ def apply_calibration_step2(scangr):
             # apply correction
             calgr.calibration_step2(scangr.spectra, index)
     for item in scangr.spectra:
-        scangr.spectra[item] = np.array(scangr.spectra[item])
+        scangr.spectra[item] = np.asarray(scangr.spectra[item])
     return scangr
 
 
@@ -1080,18 +1254,20 @@ def get_freqinfo(scangr, debug=False):
         "ChannelsID": [],
         "AppliedDopplerCorr": [],
     }
-    freqgr = Smrl1bFreqspec()
-    freqsortgr = Smrl1bFreqsort()
+    bad_modules = {
+        backend: get_bad_module_numbers(backend, spectra, debug)
+        for backend in np.unique(scangr.spectra["backend"])
+    }
 
     for numspec, _ in enumerate(scangr.spectra["stw"]):
-        freqvec = freqgr.get_frequency(scangr.spectra, numspec)
-        bad_modules = get_bad_ssb_modules(
-            scangr.spectra["backend"][numspec], spectra, freqvec, debug
-        )
-        freqvec.shape = (freqvec.shape[0] * freqvec.shape[1],)
-        freqvec, tempspec, ssb, channels_id = freqsortgr.get_sorted_ac_spectrum(
-            freqvec, spectra[numspec], bad_modules
+        # the channel layout is normally the same for all spectra in the
+        # scan and is only computed once
+        freqvec, layout = get_sorted_frequency(
+            scangr.spectra, numspec, bad_modules[scangr.spectra["backend"][numspec]]
         )
+        tempspec = spectra[numspec, layout.index]
+        ssb = list(layout.ssb)
+        channels_id = layout.channels_id
         # correcting freqvec for Doppler
         lofreq, freqvec = doppler_corr(
             scangr.spectra["skyfreq"][numspec],
@@ -1162,7 +1338,7 @@ def get_freqinfo(scangr, debug=False):
                 )
             )
         channels.append(tempspec.shape[0])
-        scangr.spectra["spectrum"].append(np.around(tempspec, decimals=3).tolist())
+        scangr.spectra["spectrum"].append(np.around(tempspec, decimals=3))
     scangr.spectra["frequency"] = freqinfo
     scangr.spectra["channels"] = channels
     return scangr
@@ -1173,16 +1349,147 @@ def get_scan_data_v2(backend, freqmode, scanno, debug=False):
     calstw = int(scanno)
     scangr = ScandataExporter(backend)
     try:
-        isok = scangr.get_db_data(freqmode, calstw)
+        isok = scangr.fetch_db_data(freqmode, calstw)
+    except IndexError:
+        isok = 0
+    if isok == 0:
+        return {}
+    return process_scan_data(scangr, debug)
+
+
+def get_scan_logdata_v2(backend, freqmode, scanno):
+    """get the scan data needed for the scan log, without the spectra
+
+    Only the geolocation and housekeeping columns are read. The spectra
+    are paired as in unsplit_normalmode and the quality of the first
+    spectrum is found with the checks that do not need the spectra, the
+    quality of the target spectra is not complete. Returns None if the
+    quality needs the spectra, then get_scan_data_v2 must be used.
+    """
+    scangr = ScandataExporter(backend)
+    try:
+        isok = scangr.fetch_db_data(
+            freqmode,
+            int(scanno),
+            LOG_TARGET_QUERY,
+            LOG_CALIBRATION_QUERIES,
+            SCAN_HAS_REFERENCE_QUERY,
+        )
     except IndexError:
         isok = 0
     if isok == 0:
         return {}
+    scangr.decode_logdata()
+    spectra = scangr.spectra
+    if spectra["intmode"][0] != 511 and spectra["ac0_frontend"][0] != "SPL":
+        first, _ = get_unsplit_pairs(spectra["stw"], spectra["type"])
+        spectra = {item: value[first] for item, value in spectra.items()}
+    if spectra["frontend"][0] == 3 and spectra["freqmode"][0] in (14, 22, 24):
+        # quality depends on the frequency correction, see get_freqinfo
+        return None
+    qualgr = QualityControl(spectra, [])
+    if qualgr.efftime_is_suspicious():
+        return None
+    qualgr.run_scan_control()
+    spectra["quality"] = qualgr.quality
+    return spectra
+
+
+def get_db_data_range(backend, freqmode, scanids):
+    """export data for several scans from database tables
+
+    The scans are read with range queries over calstw and the result is
+    filtered on scanids. Returns a ScandataExporter with combined data
+    for each scan that was found.
+    """
+    scanids = sorted({int(scanid) for scanid in scanids})
+    if scanids == []:
+        return {}
+    params = dict(b=backend, c1=scanids[0], c2=scanids[-1], f=freqmode)
+    targets = group_rows(execute_rows(TARGET_RANGE_QUERY, params), "calstw")
+    targets = {scanid: targets[scanid] for scanid in scanids if scanid in targets}
+    if targets == {}:
+        return {}
+    # looser calibration joins are only tried for scans still missing data
+    calibrations = {}
+    for query in CALIBRATION_RANGE_QUERIES:
+        missing = targets.keys() - calibrations.keys()
+        if not missing:
+            break
+        rows = group_rows(execute_rows(query, params), "stw")
+        calibrations.update(
+            (scanid, rows[scanid]) for scanid in missing if scanid in rows
+        )
+    scangr = ScandataExporter(backend)
+    stws = [row["stw"] for rows in targets.values() for row in rows]
+    refdata = execute_rows(
+        REFERENCE_QUERY,
+        dict(
+            s1=min(stws) - REFERENCE_STW_MARGIN,
+            s2=max(stws) + REFERENCE_STW_MARGIN,
+            so=scangr.get_reference_stw_offset(),
+        ),
+    )
+    refstws = [row["stw"] for row in refdata]
+    scans = {}
+    for scanid, result in targets.items():
+        first = bisect_left(refstws, result[0]["stw"] - REFERENCE_STW_MARGIN)
+        last = bisect_right(refstws, result[-1]["stw"] + REFERENCE_STW_MARGIN)
+        scangr = ScandataExporter(backend)
+        scangr.calstw = scanid
+        if scangr.combine_db_data(
+            result, calibrations.get(scanid, []), refdata[first:last]
+        ):
+            scans[scanid] = scangr
+    return scans
+
+
+def group_rows(rows, column):
+    """group rows, ordered on column, by the value of column"""
+    return {
+        value: list(group) for value, group in groupby(rows, itemgetter(column))
+    }
+
+
+def chunk_scanids(scanids, max_scans, max_stw=BULK_CHUNK_MAX_STW):
+    """split sorted scanids into chunks that are read with one range query"""
+    chunk = []
+    for scanid in scanids:
+        if chunk and (len(chunk) >= max_scans or scanid - chunk[0] > max_stw):
+            yield chunk
+            chunk = []
+        chunk.append(scanid)
+    if chunk:
+        yield chunk
+
+
+def get_scans_data_v2(backend, freqmode, scanids, calibrations=None):
+    """get scan data for several scans
+
+    Returns a dict with the scan data for each scanid, {} for scans
+    without data. Errors while processing a scan are raised as for a single
+    scan. Pass the same calibrations dict for consecutive calls to share
+    the calibration step 2 median fits between them.
+    """
+    if calibrations is None:
+        calibrations = {}
+    scangrs = get_db_data_range(backend, freqmode, scanids)
+    scans = {}
+    for scanid in scanids:
+        scangr = scangrs.get(int(scanid))
+        if scangr is None:
+            scans[scanid] = {}
+            continue
+        scans[scanid] = process_scan_data(scangr, calibrations=calibrations)
+    return scans
+
 
+def process_scan_data(scangr, debug=False, calibrations=None):
+    """calibrate and quality check scan data read from the database"""
     scangr.decode_refdata()
     scangr.decode_specdata()
     # perform calibration step2 for target spectrum
-    scangr = apply_calibration_step2(scangr)
+    scangr = apply_calibration_step2(scangr, calibrations)
 
     if scangr.spectra["ac0_frontend"][0] == "SPL":
         # "unpslit data" to make it symmetric with data from other modes
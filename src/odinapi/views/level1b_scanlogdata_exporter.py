@@ -2,19 +2,25 @@
 """module for extracting scan log data
 from odin scan
 """
+
 from datetime import datetime
 from odinapi.pg_database import squeeze_query
 from dateutil.relativedelta import relativedelta
 import numpy as np
 import matplotlib
+from flask import current_app
 from sqlalchemy import text
 
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt  # noqa
 from matplotlib import dates  # noqa
 from ..pg_database import db
-from odinapi.views.level1b_scandata_exporter_v2 import get_scan_data_v2  # noqa
+from odinapi.views.level1b_scandata_exporter_v2 import (  # noqa
+    get_scan_data_v2,
+    get_scan_logdata_v2,
+)
 from odinapi.utils.time_util import mjd2stw, datetime2mjd, mjd2datetime  # noqa
+from odinapi.utils.concurrency import map_in_app_context  # noqa
 
 
 class ScanInfoExporter:
@@ -44,7 +50,9 @@ class ScanInfoExporter:
     def extract_scan_log(self, scanid):
         """extract log info for a given scan"""
         try:
-            scan_data = get_scan_data_v2(self.backend, self.freqmode, scanid)
+            scan_data = get_scan_logdata_v2(self.backend, self.freqmode, scanid)
+            if scan_data is None:
+                scan_data = get_scan_data_v2(self.backend, self.freqmode, scanid)
         except (IndexError, TypeError, ValueError):
             return {}
 
@@ -71,10 +79,14 @@ class ScanInfoExporter:
         }
 
     def get_log_of_scans(self, date_start, date_end, scanids):
-        """loop over scans and extract the desired data"""
+        """extract the desired data for the scans in a pool of workers"""
+        scan_logs = map_in_app_context(
+            self.extract_scan_log,
+            scanids,
+            current_app.config.get("SCAN_LOG_WORKERS", 4),
+        )
         list_of_scan_logs = []
-        for scanid in scanids:
-            scan_log = self.extract_scan_log(scanid)
+        for scan_log in scan_logs:
             if scan_log == {}:
                 continue
             # check that scan starts within desired time span
@@ -0,0 +1,253 @@
+"""Index from scan id to the row group of the scan in the PTZ parquet files
+
+The index is a directory with a sorted array of the scans, that is memory
+mapped by the api, and a list of the indexed files:
+
+    index.json          the files and the name of the current array
+    scans-<n>.npy       key, file, row group and row range of every scan
+
+Keys are the scan id shifted one bit with the backend in the lowest bit, as
+a scan id can be used by both backends. A scan that is split over row groups
+has one entry per row group. The index is built, and later updated with the
+new and changed files, by scanning the bucket:
+
+    python -m odinapi.views.ptz_index INDEX_DIR [--bucket BUCKET]
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Iterable
+
+import numpy as np
+import pyarrow.parquet as pq
+from fsspec import AbstractFileSystem
+
+logger = logging.getLogger("odinapi.ptz_index")
+
+BACKENDS = ("AC1", "AC2")
+
+INDEX_FILE = "index.json"
+
+SCAN_DTYPE = np.dtype(
+    [
+        ("key", "<i8"),
+        ("file", "<i4"),
+        ("row_group", "<i4"),
+        ("start", "<i4"),
+        ("stop", "<i4"),
+    ]
+)
+
+
+def make_keys(backend: str, scanid) -> np.ndarray:
+    return (np.asarray(scanid, dtype="int64") << 1) | BACKENDS.index(backend)
+
+
+def file_version(info: dict) -> str:
+    """Changes when the file is replaced"""
+    return f"{info.get('size')}:{info.get('ETag', info.get('mtime'))}"
+
+
+class PTZIndex:
+    """Memory mapped index of the scans in the PTZ files
+
+    The directory is read again when index.json has changed, which is
+    checked at most every max_age seconds. If it can not be read the
+    loaded index is kept and it is tried again at the next check.
+    """
+
+    def __init__(self, path: str | os.PathLike, max_age: float = 600):
+        self.path = Path(path)
+        self.max_age = max_age
+        self.files: list[str] = []
+        self.scans = np.empty(0, dtype=SCAN_DTYPE)
+        self.checked: float | None = None
+        self._mtime: float | None = None
+        self._lock = Lock()
+
+    def load(self) -> None:
+        index_file = self.path / INDEX_FILE
+        try:
+            mtime = index_file.stat().st_mtime
+        except FileNotFoundError:
+            logger.warning("no ptz index in %s", self.path)
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(index_file) as f:
+                index = json.load(f)
+            scans = np.load(self.path / index["scans"], mmap_mode="r")
+        except (OSError, ValueError) as e:
+            logger.warning("could not load the ptz index in %s: %s", self.path, e)
+            return
+        self.scans = scans
+        self.files = [file["path"] for file in index["files"]]
+        self._mtime = mtime
+        logger.info("loaded %i ptz scans from %s", len(self.scans), self.path)
+
+    def get(self, backend: str, scanid: int) -> list[tuple[str, int, int, int]]:
+        """File, row group and row range of the parts of the scan
+
+        Empty if the scan is not in the index.
+        """
+        with self._lock:
+            if self.checked is None or time.monotonic() - self.checked > self.max_age:
+                self.load()
+                self.checked = time.monotonic()
+            files, scans = self.files, self.scans
+        key = make_keys(backend, scanid)
+        start, stop = np.searchsorted(scans["key"], [key, key + 1])
+        return [
+            (files[file], int(row_group), int(row1), int(row2))
+            for _, file, row_group, row1, row2 in scans[start:stop].tolist()
+        ]
+
+
+def read_file_scans(filesystem: AbstractFileSystem, path: str) -> np.ndarray:
+    """Row group and row range of the scans in a file, the file field unset"""
+    with filesystem.open(path) as f:
+        parquet_file = pq.ParquetFile(f)
+        parts = []
+        for row_group in range(parquet_file.num_row_groups):
+            scanids = (
+                parquet_file.read_row_group(row_group, columns=["ScanID"])["ScanID"]
+                .to_numpy()
+                .astype("int64")
+            )
+            if len(scanids) == 0:
+                continue
+            unique, first = np.unique(scanids, return_index=True)
+            _, last = np.unique(scanids[::-1], return_index=True)
+            part = np.zeros(len(unique), dtype=SCAN_DTYPE)
+            part["key"] = unique
+            part["row_group"] = row_group
+            part["start"] = first
+            part["stop"] = len(scanids) - last
+            parts.append(part)
+    if not parts:
+        return np.empty(0, dtype=SCAN_DTYPE)
+    return np.concatenate(parts)
+
+
+def list_files(
+    filesystem: AbstractFileSystem, bucket: str
+) -> Iterable[tuple[str, str, dict]]:
+    """Backend, path and info of the parquet files in the bucket"""
+    for backend in BACKENDS:
+        path = f"{bucket}/{backend.lower()}"
+        if not filesystem.exists(path):
+            continue
+        files = filesystem.find(path, detail=True)
+        for file in sorted(files):
+            if file.endswith(".parquet"):
+                yield backend, file, files[file]
+
+
+def read_index(path: Path) -> tuple[list[dict], np.ndarray]:
+    try:
+        with open(path / INDEX_FILE) as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return [], np.empty(0, dtype=SCAN_DTYPE)
+    return index["files"], np.load(path / index["scans"])
+
+
+def build_index(
+    filesystem: AbstractFileSystem, bucket: str, path: str | os.PathLike
+) -> int:
+    """Index the new and changed files in the bucket
+
+    Files that are gone are dropped from the index. Returns the number of
+    files that were read.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    old_files, old_scans = read_index(path)
+    old_ids = {
+        (file["path"], file["version"]): file_id
+        for file_id, file in enumerate(old_files)
+    }
+    # the old scans grouped by file, old_scans[bounds[i]:bounds[i + 1]] for
+    # file i
+    old_scans = old_scans[np.argsort(old_scans["file"], kind="stable")]
+    bounds = np.searchsorted(old_scans["file"], np.arange(len(old_files) + 1))
+    files = []
+    parts = []
+    nread = 0
+    for backend, file, info in list_files(filesystem, bucket):
+        version = file_version(info)
+        file_id = len(files)
+        old_id = old_ids.get((file, version))
+        if old_id is None:
+            scans = read_file_scans(filesystem, file)
+            scans["key"] = make_keys(backend, scans["key"])
+            nread += 1
+            logger.info("indexed %i scans in %s", len(scans), file)
+        else:
+            scans = old_scans[bounds[old_id] : bounds[old_id + 1]]
+        scans["file"] = file_id
+        files.append(dict(path=file, version=version))
+        parts.append(scans)
+    scans = np.concatenate([np.empty(0, dtype=SCAN_DTYPE)] + parts)
+    scans = scans[np.argsort(scans["key"], kind="stable")]
+    write_index(path, files, scans)
+    return nread
+
+
+def scans_file_time(name: str) -> int:
+    return int(name.removeprefix("scans-").removesuffix(".npy"))
+
+
+def write_index(path: Path, files: list[dict], scans: np.ndarray) -> None:
+    """Replace the index, readers see either the old or the new one
+
+    The scans file of the replaced index is kept, as a reader can have read
+    the old index.json but not yet the scans file. Older ones are removed.
+    """
+    try:
+        with open(path / INDEX_FILE) as f:
+            previous = scans_file_time(json.load(f)["scans"])
+    except FileNotFoundError:
+        previous = None
+    scans_file = f"scans-{time.time_ns()}.npy"
+    np.save(path / scans_file, scans)
+    tmp_file = path / f"{INDEX_FILE}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(dict(scans=scans_file, files=files), f)
+    os.replace(tmp_file, path / INDEX_FILE)
+    if previous is None:
+        return
+    for file in path.glob("scans-*.npy"):
+        if scans_file_time(file.name) < previous:
+            file.unlink()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Build or update the index of the scans in the PTZ files"
+    )
+    parser.add_argument("path", help="directory of the index")
+    parser.add_argument("--bucket", default="odin-zpt")
+    return parser.parse_args()
+
+
+def main():
+    import s3fs
+
+    logging.basicConfig(level=logging.INFO)
+    args = parse_arguments()
+    filesystem = s3fs.S3FileSystem(
+        config_kwargs={"retries": {"max_attempts": 10, "mode": "adaptive"}}
+    )
+    nread = build_index(filesystem, args.bucket, args.path)
+    logger.info("read %i new or changed files", nread)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,20 @@
+import hashlib
+import logging
+import os
 import tempfile
-from functools import lru_cache
-from typing import Tuple, TypedDict
+from pathlib import Path
+from threading import Lock
+from typing import Iterable, Tuple, TypedDict
 
 import numpy as np
 import numpy.typing as npt
+from flask import current_app
 from scipy.io import loadmat
 
 from ..odin_aws.s3 import s3_fileobject
+from ..utils.defs import SPECIES
+
+logger = logging.getLogger("odinapi.apriori")
 
 DAYS_PER_YEAR = 365  # neglect leap year
 BUCKET = "odin-apriori"
@@ -84,25 +92,130 @@ def get_vmr_interpolated_for_lat(vmr, latitudes, latitude):
     return vmr[:, ind1] * w1 + vmr[:, ind2] * w2
 
 
-@lru_cache(maxsize=None)
-def _load_apriori_datadict(species: str, source: str | None = None) -> tuple[dict[str, np.ndarray], str]:
-    filename = (
+def get_apriori_filename(species: str, source: str | None = None) -> str:
+    return (
         "apriori_{}_{}.mat".format(species, source)
         if source
         else "apriori_{}.mat".format(species)
     )
-    uri = f"s3://{BUCKET}/{filename}"
 
-    with tempfile.NamedTemporaryFile(suffix=".mat") as tmp:
-        buffer = s3_fileobject(uri)
-        if buffer:
-            tmp.write(buffer.read())
-        else:
-            raise AprioriException(f"No such file: {uri}")
-        data = loadmat(tmp.name)
 
-    datadict = get_datadict(data, "Bdx" if source is None else source.upper())
-    return datadict, uri
+class AprioriStore:
+    """Process wide apriori data
+
+    The .mat files are parsed straight from the downloaded bytes. With a
+    cache directory the parsed arrays are also saved there as .npz files,
+    so that a restarted process does not need S3. The files are written
+    atomically, several worker processes can share a directory. Remove the
+    directory to read changed apriori files from S3 again.
+    """
+
+    def __init__(self, cache_dir: str | None = None):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self._data: dict[tuple[str, str | None], tuple[dict[str, np.ndarray], str]] = {}
+        self._versions: dict[tuple[str, str | None], str] = {}
+        self._lock = Lock()
+
+    def get(
+        self, species: str, source: str | None = None
+    ) -> tuple[dict[str, np.ndarray], str]:
+        """Data dict and uri of the apriori file"""
+        key = (species, source)
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None:
+            entry = self.load(species, source)
+            with self._lock:
+                self._data[key] = entry
+        return entry
+
+    def version(self, species: str, source: str | None = None) -> str:
+        """Digest of the apriori data, the same in every process with the data"""
+        key = (species, source)
+        with self._lock:
+            version = self._versions.get(key)
+        if version is None:
+            datadict, _ = self.get(species, source)
+            digest = hashlib.sha1()
+            for name in sorted(datadict):
+                digest.update(name.encode())
+                digest.update(np.ascontiguousarray(datadict[name]).tobytes())
+            version = digest.hexdigest()
+            with self._lock:
+                self._versions[key] = version
+        return version
+
+    def load(
+        self, species: str, source: str | None = None
+    ) -> tuple[dict[str, np.ndarray], str]:
+        filename = get_apriori_filename(species, source)
+        uri = f"s3://{BUCKET}/{filename}"
+        datadict = self._read(filename)
+        if datadict is None:
+            buffer = s3_fileobject(uri)
+            if not buffer:
+                raise AprioriException(f"No such file: {uri}")
+            data = loadmat(buffer)
+            datadict = get_datadict(data, "Bdx" if source is None else source.upper())
+            self._write(filename, datadict)
+        return datadict, uri
+
+    def preload(self, species: Iterable[str] = SPECIES) -> None:
+        """Load the apriori data of the species from their default source"""
+        for name in sorted(species):
+            try:
+                self.get(name)
+            except AprioriException as err:
+                logger.warning("could not preload apriori: %s", err)
+        logger.info("loaded apriori data for %i species", len(self._data))
+
+    def path(self, filename: str) -> Path:
+        assert self.cache_dir is not None
+        return self.cache_dir / f"{Path(filename).stem}.npz"
+
+    def _read(self, filename: str) -> dict[str, np.ndarray] | None:
+        if self.cache_dir is None:
+            return None
+        path = self.path(filename)
+        try:
+            with np.load(path) as npz:
+                return {key: npz[key] for key in npz.files}
+        except FileNotFoundError:
+            return None
+        except Exception as err:
+            logger.warning("could not read cached apriori %s: %s", path, err)
+            return None
+
+    def _write(self, filename: str, datadict: dict[str, np.ndarray]) -> None:
+        if self.cache_dir is None:
+            return
+        path = self.path(filename)
+        tmp_name = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                dir=path.parent, suffix=".tmp", delete=False
+            ) as tmp:
+                tmp_name = tmp.name
+                np.savez(tmp, **datadict)
+            os.replace(tmp_name, path)
+        except OSError as err:
+            logger.warning("could not write cached apriori %s: %s", path, err)
+            if tmp_name is not None and os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+
+
+_apriori_store: AprioriStore | None = None
+_apriori_store_lock = Lock()
+
+
+def get_apriori_store() -> AprioriStore:
+    """Return the process wide apriori store"""
+    global _apriori_store
+    with _apriori_store_lock:
+        if _apriori_store is None:
+            _apriori_store = AprioriStore(current_app.config.get("APRIORI_CACHE_DIR"))
+        return _apriori_store
 
 
 class Apriori(TypedDict):
@@ -113,6 +226,7 @@ class Apriori(TypedDict):
     latitude: float
     path: str
 
+
 def get_apriori(
     species: str,
     day_of_year: float,
@@ -120,7 +234,7 @@ def get_apriori(
     source: str | None = None,
     datadir: str = "",
 ) -> Apriori:
-    datadict, uri = _load_apriori_datadict(species, source)
+    datadict, uri = get_apriori_store().get(species, source)
 
     doy = float(day_of_year)
     vmr = get_vmr_interpolated_for_doy(datadict["vmr"], datadict["doy"], doy)
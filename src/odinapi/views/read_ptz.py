@@ -1,14 +1,50 @@
+"""PTZ profiles from the parquet files in the odin-zpt bucket
+
+The files are stored per backend in directories named after the high bits
+of the satellite time word, <backend>/<stw >> 24:x>/, and are named after
+the first scan in them like the level0 files. A scan is therefore in the
+last file, of its own or the previous directory, that starts before it.
+"""
+
 import logging
-from typing import List, Literal, TypedDict
+import posixpath
+import time
+from collections import defaultdict
+from threading import Lock
+from typing import Collection, Iterable, List, Literal, TypedDict
 
+import numpy as np
+import pyarrow as pa
 import pyarrow.compute as pc
 import pyarrow.dataset as ds
 import s3fs
+from flask import current_app
+from fsspec import AbstractFileSystem
+from pyarrow.fs import FSSpecHandler, PyFileSystem
+
+from ..utils.caching import LRUCache, TTLCache
+from ..utils.level0_files import level0_file_stw
+from .ptz_index import PTZIndex, file_version
 
 logger = logging.getLogger("odinapi.ptz")
 
 Backend = Literal["AC1", "AC2"]
 
+PTZ_BUCKET = "odin-zpt"
+
+
+PTZ_ARROW_SCHEMA = pa.schema(
+    [
+        ("ScanID", pa.int64()),
+        ("MJD", pa.float64()),
+        ("Latitude", pa.float64()),
+        ("Longitude", pa.float64()),
+        ("Altitude", pa.list_(pa.float64())),
+        ("Pressure", pa.list_(pa.float64())),
+        ("Temperature", pa.list_(pa.float64())),
+    ]
+)
+
 
 class PTZ(TypedDict):
     Pressure: list[float]
@@ -21,60 +57,420 @@ class PTZ(TypedDict):
 
 def prefix_names(stw: int) -> List[str]:
     dir_name = stw >> 6 * 4
-    return [f"{dir_name:x}", f"{dir_name-1:x}"]
+    return [f"{dir_name:x}", f"{dir_name - 1:x}"]
 
 
-def get_ptz(
-    backend: Backend, scanid: int, mjd: int, lat: float, lon: float
-) -> PTZ | None:
-    s3 = s3fs.S3FileSystem(
-        config_kwargs={
-            "retries": {"max_attempts": 10, "mode": "adaptive"},
-        }
-    )
-    result: PTZ | None = None
-    for prefix in prefix_names(scanid):
-        s3_path = f"odin-zpt/{backend.lower()}/{prefix}"
-        s3.invalidate_cache(s3_path)
+def empty_table() -> pa.Table:
+    return pa.table({"ScanID": pa.array([], type=pa.int64())})
+
+
+def may_contain(row_group: ds.RowGroupInfo, scanid: int) -> bool:
+    """Check the ScanID statistics of a row group, if there are any"""
+    stats = row_group.statistics.get("ScanID")
+    if not stats:
+        return True
+    return stats["min"] <= scanid <= stats["max"]
+
+
+class PTZStore:
+    """Process wide access to the PTZ parquet files
+
+    One filesystem client is kept for the process. The file listings of the
+    directories are cached for refresh_interval seconds, and the parquet
+    metadata of the most recently used files is kept for the version of the
+    file in the listing, so that a scan costs one read of the row groups that
+    can hold it. With an index of the scans the row groups are known without
+    searching the directories. The rows of the most recently read scans are
+    kept, and scans that were not found are not looked for again for
+    missing_max_age seconds.
+    """
+
+    def __init__(
+        self,
+        filesystem: AbstractFileSystem | None = None,
+        bucket: str = PTZ_BUCKET,
+        refresh_interval: float = 3600,
+        max_files: int = 256,
+        index: PTZIndex | None = None,
+        max_scans: int = 4096,
+        missing_max_age: float = 60,
+    ):
+        self.bucket = bucket
+        self.index = index
+        self.refresh_interval = refresh_interval
+        # PTZ data of a scan does not change once it is written
+        self.scans = LRUCache(max_scans)
+        self.missing = TTLCache(missing_max_age, max_scans)
+        self._filesystem = filesystem
+        self._arrow_filesystem: PyFileSystem | None = None
+        self._listings: dict[str, tuple[float, dict[str, str]]] = {}
+        self._fragments = LRUCache(max_files)
+        self._lock = Lock()
+
+    @property
+    def filesystem(self) -> AbstractFileSystem:
+        with self._lock:
+            if self._filesystem is None:
+                self._filesystem = s3fs.S3FileSystem(
+                    config_kwargs={
+                        "retries": {"max_attempts": 10, "mode": "adaptive"},
+                    }
+                )
+            return self._filesystem
+
+    @property
+    def arrow_filesystem(self) -> PyFileSystem:
+        filesystem = self.filesystem
+        with self._lock:
+            if self._arrow_filesystem is None:
+                self._arrow_filesystem = PyFileSystem(FSSpecHandler(filesystem))
+            return self._arrow_filesystem
+
+    def list_versions(self, path: str) -> dict[str, str]:
+        """Sorted parquet files in the directory and their versions
+
+        Empty if the directory does not exist.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._listings.get(path)
+        if cached is not None and now - cached[0] < self.refresh_interval:
+            return cached[1]
+        filesystem = self.filesystem
+        filesystem.invalidate_cache(path)
         try:
-            dataset = ds.dataset(s3_path, format="parquet", filesystem=s3)
+            infos = filesystem.ls(path, detail=True)
         except FileNotFoundError:
-            logger.warning(
-                "Path does not exist: %s, looking for scanid %x(%i)",
-                s3_path,
-                scanid,
-                scanid,
+            logger.warning("Path does not exist: %s", path)
+            infos = []
+        files = {
+            info["name"]: file_version(info)
+            for info in sorted(infos, key=lambda info: info["name"])
+            if info["name"].endswith(".parquet")
+        }
+        with self._lock:
+            self._listings[path] = (now, files)
+        return files
+
+    def list_files(self, path: str) -> list[str]:
+        """Sorted parquet files in the directory, [] if it does not exist"""
+        return list(self.list_versions(path))
+
+    def find_file(self, backend: Backend, scanid: int) -> str | None:
+        """The file that can hold the scan, None if there is none"""
+        candidates = []
+        for prefix in prefix_names(scanid):
+            path = f"{self.bucket}/{backend.lower()}/{prefix}"
+            for file in self.list_files(path):
+                stw = level0_file_stw(file)
+                if stw is not None and stw <= scanid:
+                    candidates.append((stw, file))
+        if not candidates:
+            return None
+        return max(candidates)[1]
+
+    def scan_version(self, backend: Backend, scanid: int) -> list[tuple[str, str]]:
+        """The files that the scan is read from and their versions
+
+        Empty if there is no file that can hold the scan.
+        """
+        parts = self.index.get(backend, scanid) if self.index is not None else []
+        files = {part[0] for part in parts}
+        file = self.find_file(backend, scanid)
+        if file is not None:
+            files.add(file)
+        return [
+            (file, self.list_versions(posixpath.dirname(file)).get(file, ""))
+            for file in sorted(files)
+        ]
+
+    def get_fragment(self, file: str) -> ds.ParquetFileFragment:
+        """The parquet file with its metadata read
+
+        The metadata is read again when the version of the file in the
+        listing of its directory changes, i.e. when the file is replaced.
+        """
+        version = self.list_versions(posixpath.dirname(file)).get(file)
+        fragment = self._fragments.get((file, version))
+        if fragment is None:
+            fragment = ds.ParquetFileFormat().make_fragment(
+                file, filesystem=self.arrow_filesystem
             )
-            continue
-        except Exception as e:
-            logger.error("Error reading dataset in %s: %s", s3_path, e)
-            continue
+            fragment.ensure_complete_metadata()
+            self._fragments.put((file, version), fragment)
+        return fragment
+
+    def read_file(
+        self,
+        file: str,
+        scanids: Collection[int],
+        row_groups: Iterable[int] = (),
+        searched: Iterable[int] | None = None,
+    ) -> pa.Table:
+        """The rows of the scans in the file
+
+        The given row groups are read together with the row groups whose
+        statistics allow any of the searched scans, by default all scans.
+        """
+        fragment = self.get_fragment(file)
+        searched = scanids if searched is None else searched
+        row_groups = set(row_groups) | {
+            row_group.id
+            for row_group in fragment.row_groups
+            if any(may_contain(row_group, scanid) for scanid in searched)
+        }
+        if not row_groups:
+            return fragment.physical_schema.empty_table()
+        return fragment.subset(row_group_ids=sorted(row_groups)).to_table(
+            filter=ds.field("ScanID").isin(sorted(scanids))
+        )
+
+    def read_parts(
+        self, parts: list[tuple[str, int, int, int]], scanid: int
+    ) -> pa.Table:
+        """The rows of the scan in the row groups given by the index"""
+        table = pa.concat_tables(
+            self.get_fragment(file)
+            .subset(row_group_ids=[row_group])
+            .to_table()
+            .slice(start, stop - start)
+            for file, row_group, start, stop in parts
+        )
+        return table.filter(pc.equal(table["ScanID"], scanid))
+
+    def fetch_scan(self, backend: Backend, scanid: int) -> pa.Table | None:
+        """The PTZ rows of the scan, empty if it can not be found
+
+        Scans in the index are read from the row groups given there, others,
+        and scans that are not where the index says, from the file that can
+        hold them. None if the file can not be read.
+        """
+        parts = self.index.get(backend, scanid) if self.index is not None else []
+        if parts:
+            try:
+                table = self.read_parts(parts, scanid)
+            except Exception as e:
+                logger.warning(
+                    "Error reading indexed ScanID %i from %s: %s",
+                    scanid,
+                    parts[0][0],
+                    e,
+                )
+            else:
+                if table.num_rows > 0:
+                    logger.debug("found scanid %x(%i) in the index", scanid, scanid)
+                    return table
+                logger.warning("ScanID %i not found where indexed", scanid)
+        file = self.find_file(backend, scanid)
+        if file is None:
+            logger.debug("No ptz file found for scanid %x(%i)", scanid, scanid)
+            return empty_table()
         try:
-            table = dataset.to_table(filter=ds.field("ScanID") == scanid)
+            table = self.read_file(file, [scanid])
         except Exception as e:
             logger.error(
-                "Error exporting dataset to table with ScanID filter (%i) from %s: %s",
+                "Error reading ScanID %i from %s: %s",
                 scanid,
-                s3_path,
+                file,
                 e,
             )
-            continue
+            return None
         if table.num_rows == 0:
             logger.debug(
-                "No ptz data found for scanid %x(%i) in path %s",
-                scanid,
-                scanid,
-                s3_path,
+                "No ptz data found for scanid %x(%i) in %s", scanid, scanid, file
             )
-            continue
-        ptz = table.sort_by("z")
-        logger.debug("found scanid %x(%i) in path %s", scanid, scanid, s3_path)
-        result = PTZ(
-            Altitude=pc.multiply(ptz["z"], 1000).to_pylist(),  # type:ignore
-            Pressure=pc.round(pc.multiply(ptz["p"], 100), ndigits=8).to_pylist(),  # type: ignore
-            Temperature=pc.round(ptz["t"], ndigits=3).to_pylist(),  # type:ignore
-            Latitude=lat,
-            Longitude=lon,
-            MJD=mjd,
+        else:
+            logger.debug("found scanid %x(%i) in %s", scanid, scanid, file)
+        return table
+
+    def read_scan(self, backend: Backend, scanid: int) -> pa.Table | None:
+        """The PTZ rows of the scan, None if the scan can not be found
+
+        Found scans are cached, scans that are not found are remembered for
+        a while.
+        """
+        key = (backend, scanid)
+        table = self.scans.get(key)
+        if table is not None:
+            return table
+        if self.missing.get(key):
+            return None
+        table = self.fetch_scan(backend, scanid)
+        if table is None:
+            return None
+        if table.num_rows == 0:
+            self.missing.put(key, True)
+            return None
+        self.scans.put(key, table)
+        return table
+
+    def read_scans(self, backend: Backend, scanids: Iterable[int]) -> pa.Table:
+        """The PTZ rows of the scans that can be found
+
+        Scans that are not cached are grouped by file and each file is read
+        once, filtered on the scan ids. Scans that are not where the index
+        says are looked for in the file that can hold them.
+        """
+        tables = []
+        scans: defaultdict[str, set[int]] = defaultdict(set)
+        row_groups: defaultdict[str, set[int]] = defaultdict(set)
+        searched: defaultdict[str, set[int]] = defaultdict(set)
+        indexed = set()
+        missing = []
+        for scanid in scanids:
+            table = self.scans.get((backend, scanid))
+            if table is not None:
+                tables.append(table)
+                continue
+            if self.missing.get((backend, scanid)):
+                continue
+            parts = self.index.get(backend, scanid) if self.index is not None else []
+            for file, row_group, _, _ in parts:
+                scans[file].add(scanid)
+                row_groups[file].add(row_group)
+            if parts:
+                indexed.add(scanid)
+            else:
+                file = self.find_file(backend, scanid)
+                if file is None:
+                    missing.append(scanid)
+                else:
+                    scans[file].add(scanid)
+                    searched[file].add(scanid)
+        file_tables, found, not_found = self.read_files(
+            backend, scans, row_groups, searched
+        )
+        tables.extend(file_tables)
+        missing.extend(not_found - indexed)
+        stale: defaultdict[str, set[int]] = defaultdict(set)
+        for scanid in sorted(indexed - found):
+            file = self.find_file(backend, scanid)
+            if file is None:
+                missing.append(scanid)
+            else:
+                stale[file].add(scanid)
+        if stale:
+            logger.warning("%i scans not found where indexed", len(indexed - found))
+            file_tables, _, not_found = self.read_files(backend, stale, {}, stale)
+            tables.extend(file_tables)
+            missing.extend(not_found)
+        for scanid in missing:
+            self.missing.put((backend, scanid), True)
+        logger.debug(
+            "read ptz for %i scans from %i files",
+            sum(len(file_scans) for file_scans in scans.values()),
+            len(scans),
         )
-    return result
+        if not tables:
+            return empty_table()
+        return pa.concat_tables(tables, promote_options="default")
+
+    def read_files(
+        self,
+        backend: Backend,
+        scans: dict[str, set[int]],
+        row_groups: dict[str, set[int]],
+        searched: dict[str, set[int]],
+    ) -> tuple[list[pa.Table], set[int], set[int]]:
+        """Read the scans of each file and cache the found scans
+
+        Returns the tables and the scans that were found and not found in
+        the files that could be read.
+        """
+        tables = []
+        found: set[int] = set()
+        not_found: set[int] = set()
+        for file, file_scans in scans.items():
+            try:
+                table = self.read_file(
+                    file,
+                    file_scans,
+                    row_groups.get(file, ()),
+                    searched.get(file, set()),
+                )
+            except Exception as e:
+                logger.error(
+                    "Error reading %i scans from %s: %s", len(file_scans), file, e
+                )
+                continue
+            file_found = split_scans(table)
+            for scanid, scan_table in file_found.items():
+                self.scans.put((backend, scanid), scan_table)
+            found.update(file_found)
+            not_found.update(file_scans.difference(file_found))
+            tables.append(table)
+        return tables, found, not_found
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Sizes, hits and misses of the caches"""
+        return {
+            "scans": self.scans.stats(),
+            "missing": self.missing.stats(),
+            "files": self._fragments.stats(),
+        }
+
+
+_ptz_store: PTZStore | None = None
+_ptz_store_lock = Lock()
+
+
+def get_ptz_store() -> PTZStore:
+    """Return the process wide PTZ store"""
+    global _ptz_store
+    with _ptz_store_lock:
+        if _ptz_store is None:
+            refresh_interval = current_app.config.get("PTZ_REFRESH_INTERVAL", 3600)
+            index_path = current_app.config.get("PTZ_INDEX_PATH")
+            _ptz_store = PTZStore(
+                refresh_interval=refresh_interval,
+                index=PTZIndex(index_path, refresh_interval) if index_path else None,
+                max_scans=current_app.config.get("PTZ_CACHE_SIZE", 4096),
+                missing_max_age=current_app.config.get("PTZ_MISSING_MAX_AGE", 60),
+            )
+        return _ptz_store
+
+
+def make_ptz(table: pa.Table, mjd: float, lat: float, lon: float) -> PTZ:
+    ptz = table.sort_by("z")
+    return PTZ(
+        Altitude=pc.multiply(ptz["z"], 1000).to_pylist(),  # type:ignore
+        Pressure=pc.round(pc.multiply(ptz["p"], 100), ndigits=8).to_pylist(),  # type: ignore
+        Temperature=pc.round(ptz["t"], ndigits=3).to_pylist(),  # type:ignore
+        Latitude=lat,
+        Longitude=lon,
+        MJD=mjd,
+    )
+
+
+def split_scans(table: pa.Table) -> dict[int, pa.Table]:
+    """The rows of each scan in the table, by scan id"""
+    table = table.sort_by("ScanID")
+    scanids, starts = np.unique(
+        table["ScanID"].to_numpy().astype("int64"), return_index=True
+    )
+    stops = np.append(starts[1:], table.num_rows)
+    return {
+        int(scanid): table.slice(start, stop - start)
+        for scanid, start, stop in zip(scanids, starts, stops)
+    }
+
+
+def get_ptz(
+    backend: Backend, scanid: int, mjd: int, lat: float, lon: float
+) -> PTZ | None:
+    table = get_ptz_store().read_scan(backend, scanid)
+    if table is None:
+        return None
+    return make_ptz(table, mjd, lat, lon)
+
+
+def ptz_to_arrow(records: Iterable[dict]) -> bytes:
+    """Arrow IPC stream with one row per scan, the profiles as lists"""
+    table = pa.Table.from_pylist(
+        [dict(ScanID=record["ScanID"], **(record["Data"] or {})) for record in records],
+        schema=PTZ_ARROW_SCHEMA,
+    )
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,177 @@
+"""Process wide index from scan id to the date of the scan in scans_cache
+
+scans_cache is organised by date, freqmode and backend, but the per scan
+endpoints only know the freqmode and the scan id. The index keeps the
+(freqmode, scanid) of every scan in scans_cache together with the date of
+the scan in two sorted arrays, 12 bytes per scan, so that the date can be
+found without a query. The index can be loaded before the gunicorn workers
+are forked, the workers then share it, otherwise it is loaded in a thread of
+its own on first use. When it is older than max_age seconds the most recent
+days are read again by one request while the others keep using the old
+arrays. Scans that are not in the index, or not yet, are looked up by scan
+id as before.
+"""
+
+import logging
+import time
+from datetime import date
+from threading import Lock, Thread
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import text
+
+from ..pg_database import db, squeeze_query
+
+logger = logging.getLogger("odinapi.scan_index")
+
+# freqmodes are stored in the low bits of the keys
+FREQMODE_BITS = 8
+
+# rows read from the database at a time when the index is loaded
+FETCH_SIZE = 100_000
+
+
+def make_keys(freqmode, scanid) -> np.ndarray:
+    return (np.asarray(scanid, dtype="int64") << FREQMODE_BITS) | np.asarray(
+        freqmode, dtype="int64"
+    )
+
+
+class ScanIndex:
+    """Sorted (freqmode, scanid) keys and the dates of the scans
+
+    The keys and days are replaced together, readers take both from data
+    and never wait for a load or refresh.
+    """
+
+    def __init__(self, max_age: float = 600, refresh_days: int = 7):
+        self.max_age = max_age
+        self.refresh_days = refresh_days
+        # dates as proleptic Gregorian ordinals, see date.toordinal
+        self.data = (np.empty(0, dtype="int64"), np.empty(0, dtype="int32"))
+        self.loaded: float | None = None
+        self._lock = Lock()
+        self._loader: Thread | None = None
+
+    @property
+    def keys(self) -> np.ndarray:
+        return self.data[0]
+
+    @property
+    def days(self) -> np.ndarray:
+        return self.data[1]
+
+    def read(self, since: date | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """Sorted keys and days of the scans, from the date since if given"""
+        result = db.session.execute(
+            text(
+                squeeze_query(
+                    """\
+                select freqmode, scanid, date - date '0001-01-01' + 1 as day
+                from scans_cache
+                where date >= :d"""
+                )
+            ),
+            params=dict(d=since or date.min),
+            execution_options=dict(yield_per=FETCH_SIZE),
+        )
+        rows = np.concatenate(
+            [np.empty((0, 3), dtype="int64")]
+            + [
+                np.array(rows, dtype="int64").reshape(-1, 3)
+                for rows in result.partitions()
+            ]
+        )
+        keys = make_keys(rows[:, 0], rows[:, 1])
+        order = np.argsort(keys, kind="stable")
+        return keys[order], rows[order, 2].astype("int32")
+
+    def load(self) -> None:
+        self.data = self.read()
+        self.loaded = time.monotonic()
+        logger.info("loaded %i scans into the scan index", len(self.keys))
+
+    def refresh(self) -> None:
+        """Read the scans of the most recent days again"""
+        old_keys, old_days = self.data
+        if len(old_days) == 0:
+            self.load()
+            return
+        since = date.fromordinal(int(old_days.max()) - self.refresh_days)
+        keys, days = self.read(since)
+        keep = old_days < since.toordinal()
+        all_keys = np.concatenate([old_keys[keep], keys])
+        all_days = np.concatenate([old_days[keep], days])
+        order = np.argsort(all_keys, kind="stable")
+        self.data = all_keys[order], all_days[order]
+        self.loaded = time.monotonic()
+        logger.info("refreshed %i scans in the scan index", len(keys))
+
+    def is_stale(self) -> bool:
+        return self.loaded is None or time.monotonic() - self.loaded > self.max_age
+
+    def update(self) -> None:
+        """Load or refresh the index if no other thread is doing it
+
+        The index is loaded in the background, so that no request waits
+        for all of scans_cache to be read.
+        """
+        if not self._lock.acquire(blocking=False):
+            return
+        if self.loaded is None:
+            app = current_app._get_current_object()  # type: ignore[attr-defined]
+            self._loader = Thread(
+                target=self._load_in_background,
+                args=(app,),
+                name="odinapi-scan-index",
+                daemon=True,
+            )
+            self._loader.start()
+            return
+        try:
+            if self.is_stale():
+                self.refresh()
+        finally:
+            self._lock.release()
+
+    def _load_in_background(self, app) -> None:
+        try:
+            with app.app_context():
+                self.load()
+        except Exception:
+            logger.exception("could not load the scan index")
+        finally:
+            self._lock.release()
+
+    def get(self, freqmode: int, scanid: int) -> date | None:
+        """Date of the scan or None if it is not in the index
+
+        None is also returned until the index is loaded.
+        """
+        if self.is_stale():
+            self.update()
+        keys, days = self.data
+        key = make_keys(freqmode, scanid)
+        ind = np.searchsorted(keys, key)
+        if ind == len(keys) or keys[ind] != key:
+            return None
+        return date.fromordinal(int(days[ind]))
+
+
+_scan_index: ScanIndex | None = None
+_scan_index_lock = Lock()
+
+
+def get_scan_index() -> ScanIndex:
+    """Return the process wide scan index"""
+    global _scan_index
+    with _scan_index_lock:
+        if _scan_index is None:
+            _scan_index = ScanIndex(current_app.config.get("SCAN_INDEX_MAX_AGE", 600))
+        return _scan_index
+
+
+def get_scan_date(freqmode: int, scanid: int) -> date | None:
+    """Date of the scan in scans_cache or None if it is not in the index"""
+    return get_scan_index().get(freqmode, scanid)
@@ -1,5 +1,8 @@
 """functionality to generate frequency per spectrum in scan"""
 
+from functools import lru_cache
+from typing import NamedTuple
+
 import numpy as np
 
 
@@ -26,14 +29,7 @@ class Smrl1bFreqspec:
         self.backend = scan_h["backend"][numspec]
         self.freqres = scan_h["freqres"][numspec]
         self.restfreq = scan_h["restfreq"][ispec]
-        # Note:
-        # Backend == 1 -> AC1
-        # Backend == 2 -> AC2
-        # Backend == 3 -> AOS
-        if self.backend == 3:
-            freq = self.aos_freq()
-        else:
-            freq = self.ac_freq()
+        freq = self.get_if_frequency()
         # correcting Doppler in LO
         lofreq = scan_h["lofreq"][ispec] - (self.skyfreq - self.restfreq)
         if (self.skyfreq - lofreq) > 0.0:
@@ -42,6 +38,16 @@ class Smrl1bFreqspec:
             freq = lofreq - freq
         return np.array(freq)
 
+    def get_if_frequency(self):
+        """intermediate frequencies of the channels"""
+        # Note:
+        # Backend == 1 -> AC1
+        # Backend == 2 -> AC2
+        # Backend == 3 -> AOS
+        if self.backend == 3:
+            return self.aos_freq()
+        return self.ac_freq()
+
     def aos_freq(self):
         """aos frequency"""
         nchan = self.channels
@@ -270,8 +276,10 @@ class Smrl1bFreqsort:
         self.channels_id = self.channels_id[index]
 
 
-def get_bad_ssb_modules(backend, spectra, freqvec, debug=False):
-    """get bad ssb modules"""
+def get_bad_module_numbers(backend, spectra, debug=False):
+    """get numbers (1-8) of bad ssb modules, also the ones that are dead
+    in any of the spectra
+    """
     if debug:
         bad_modules = np.array([], dtype=int)
     else:
@@ -280,20 +288,79 @@ def get_bad_ssb_modules(backend, spectra, freqvec, debug=False):
         elif backend == 2:
             bad_modules = np.array([3])
 
-    for numspec in range(spectra.shape[0]):
-        tempspec = np.array(spectra[numspec])
-        tempspec.shape = (8, 112)
-        ytest = np.mean(tempspec, 1)
-        badssb_ind = np.nonzero((ytest == 0))[0]
-        if badssb_ind.shape[0] > 0:
-            bad_modules = np.append(bad_modules, badssb_ind + 1)
-    bad_modules = np.unique(bad_modules)
+    ytest = np.mean(np.reshape(spectra, (-1, 8, 112)), 2)
+    badssb_ind = np.nonzero(np.any(ytest == 0, 0))[0]
+    bad_modules = np.append(bad_modules, badssb_ind + 1)
+    return np.unique(bad_modules)
+
+
+def get_bad_ssb_modules(backend, spectra, freqvec, debug=False):
+    """get bad ssb modules"""
+    bad_modules = get_bad_module_numbers(backend, spectra, debug)
     # transform ssb number to mean frequency
     freq_modules = np.mean(freqvec, 1)
     bad_modules = freq_modules[bad_modules - 1]
     return bad_modules
 
 
+class FrequencyLayout(NamedTuple):
+    """filtered and sorted channels, shared by spectra with the same setup"""
+
+    ifreq: np.ndarray  # intermediate frequency of the kept channels
+    index: np.ndarray  # index of the kept channels in the spectrum
+    ssb: tuple  # sub band, first and last index, as from Smrl1bFreqsort
+    channels_id: np.ndarray
+
+
+@lru_cache(maxsize=1024)
+def get_frequency_layout(backend, intmode, channels, ssb_fq, upper, bad_modules):
+    """get the channel layout for a backend setup
+
+    The layout does not depend on the LO frequency, so it is computed once
+    for the intermediate frequencies, with the sign of the sideband. The
+    arrays are read-only since the layout is shared.
+    """
+    freqgr = Smrl1bFreqspec()
+    freqgr.backend = backend
+    freqgr.intmode = intmode
+    freqgr.channels = channels
+    freqgr.freqcal = np.array(ssb_fq)
+    ifreq = freqgr.get_if_frequency()
+    sideband_freq = ifreq if upper else -ifreq
+    freq_modules = np.mean(sideband_freq, 1)[np.array(bad_modules, dtype=int) - 1]
+    _, index, ssb, channels_id = Smrl1bFreqsort().get_sorted_ac_spectrum(
+        sideband_freq.flatten(), np.arange(sideband_freq.size), freq_modules
+    )
+    layout = FrequencyLayout(ifreq.flatten()[index], index, tuple(ssb), channels_id)
+    for array in (layout.ifreq, layout.index, layout.channels_id):
+        array.flags.writeable = False
+    return layout
+
+
+def get_sorted_frequency(scan_h, ispec, bad_modules, numspec=2):
+    """get sorted frequencies of spectrum ispec and the channel layout
+
+    This gives the same result as Smrl1bFreqspec.get_frequency followed by
+    Smrl1bFreqsort.get_sorted_ac_spectrum, bad_modules are the numbers of
+    the bad ssb modules.
+    """
+    skyfreq = scan_h["skyfreq"][ispec]
+    # correcting Doppler in LO
+    lofreq = scan_h["lofreq"][ispec] - (skyfreq - scan_h["restfreq"][ispec])
+    upper = bool((skyfreq - lofreq) > 0.0)
+    layout = get_frequency_layout(
+        int(scan_h["backend"][numspec]),
+        int(scan_h["mode"][numspec]),
+        int(scan_h["channels"][numspec]),
+        tuple(float(freq) for freq in scan_h["ssb_fq"][numspec]),
+        upper,
+        tuple(int(module) for module in bad_modules),
+    )
+    if upper:
+        return lofreq + layout.ifreq, layout
+    return lofreq - layout.ifreq, layout
+
+
 def doppler_corr(skyfreq, restfreq, lofreq, freqvec):
     """correcting for Doppler in LO"""
     lofreq = lofreq - (skyfreq - restfreq)
@@ -333,3 +400,34 @@ def freqfunc(lofreq, skyfreq, ssb_freq):
             freqi /= 1.0e9
             freqvec[icount] = freqi
     return freqvec
+
+
+def freqfunc_layout():
+    """channel offsets and ssb index of the simple freqvec in freqfunc"""
+    seqvec = [1, 1, 1, -1, 1, 1, 1, -1, 1, -1, 1, 1, 1, -1, 1, 1]
+    offsets = []
+    ssb_index = []
+    for adci in range(8):
+        klen = seqvec[2 * adci] * 112
+        dfreq = 1.0e6 / seqvec[2 * adci]
+        if seqvec[2 * adci + 1] < 0:
+            dfreq = -dfreq
+        offsets.append(np.arange(klen) * dfreq)
+        ssb_index.append(np.full(klen, adci // 2))
+    return np.concatenate(offsets), np.concatenate(ssb_index)
+
+
+FREQFUNC_OFFSETS, FREQFUNC_SSB_INDEX = freqfunc_layout()
+
+
+def freqfunc_array(lofreq, skyfreq, ssb_freq):
+    """simple freqvec for several spectra at once, same as freqfunc
+
+    lofreq and skyfreq have one value per spectrum and ssb_freq one row
+    per spectrum. Returns one freqvec per row.
+    """
+    lofreq = np.asarray(lofreq, dtype="float64")[:, np.newaxis]
+    skyfreq = np.asarray(skyfreq, dtype="float64")[:, np.newaxis]
+    freq = np.asarray(ssb_freq)[:, FREQFUNC_SSB_INDEX] + FREQFUNC_OFFSETS
+    freqvec = np.where(skyfreq >= lofreq, lofreq + freq, lofreq - freq)
+    return freqvec / 1.0e9
@@ -48,6 +48,19 @@ class QualityControl:
         self.check_moon_in_mainbeam()
         self.get_zerolagvar()
 
+    def run_scan_control(self):
+        """Quality checks that do not need the spectra or the references
+
+        These give the full quality of the calibration spectra, as long as
+        the noise can be checked without estimating the efftime.
+        """
+        self.check_tspill()
+        self.check_trec()
+        self.check_noise()
+        self.check_scan()
+        self.check_nr_of_spec()
+        self.check_int()
+
     def check_tspill(self):
         """check tspill is ok"""
         qual = 0x0001
@@ -76,10 +89,7 @@ class QualityControl:
         noise_min = 0.5
         noise_max = 6
         bandwidth = 1e6
-        if (
-            self.specdata["efftime"][2] > self.specdata["inttime"][2] * 2
-            or self.specdata["efftime"][2] < self.specdata["inttime"][2] * 0.5
-        ):
+        if self.efftime_is_suspicious():
             # estimated noise is suspicious
             # low or high, make a new estimate
             self.estimate_efftime(bandwidth)
@@ -92,6 +102,13 @@ class QualityControl:
         if not test.shape[0] == 0:
             self.quality = self.quality + qual
 
+    def efftime_is_suspicious(self):
+        """check if efftime must be estimated from the spectra"""
+        return (
+            self.specdata["efftime"][2] > self.specdata["inttime"][2] * 2
+            or self.specdata["efftime"][2] < self.specdata["inttime"][2] * 0.5
+        )
+
     def estimate_efftime(self, bandwidth, zdiff=10e3):
         """estimate integration efftime"""
         tbspec = np.array(self.specdata["spectrum"])
@@ -161,60 +178,60 @@ class QualityControl:
         )[0]
         self.quality[ind] = self.quality[ind] + qual
 
+    def get_reference_brackets(self):
+        """find the references surrounding each spectrum
+
+        refdata is sorted on stw, so the number of references before a
+        spectrum and the index of the first reference after it are found
+        for all spectra at once. Returns these and the number of references.
+        """
+        refstw = np.atleast_1d(self.refdata["stw"])
+        stw = np.atleast_1d(self.specdata["stw"])
+        nbefore = np.searchsorted(refstw, stw, side="left")
+        after = np.searchsorted(refstw, stw, side="right")
+        return nbefore, after, refstw.shape[0]
+
+    def flag_target_spectra(self, qual, flagged):
+        """add qual to the flagged spectra, except the calibration spectra"""
+        ind = np.nonzero(flagged)[0]
+        ind = ind[ind >= 2]
+        self.quality[ind] = self.quality[ind] + qual
+
     def check_obs_sequence(self):
         """check if atmospheric spectrum is collected between
         two accepted sky beam 1 references
         """
         qual = 0x0080
-        for ind, stw in enumerate(self.specdata["stw"]):
-            if ind < 2:
-                continue
-            ind1 = np.atleast_1d(self.refdata["stw"] < stw).nonzero()[0]
-            ind2 = np.atleast_1d(self.refdata["stw"] > stw).nonzero()[0]
-            if ind1.shape[0] == 0 or ind2.shape[0] == 0:
-                self.quality[ind] = self.quality[ind] + qual
-                continue
-            if ind1.shape[0] < 2:
-                self.quality[ind] = self.quality[ind] + qual
-                continue
-            if (
-                self.refdata["mech_type"][ind1[-2]] != "SK1"
-                or self.refdata["mech_type"][ind1[-1]] != "SK1"
-                or self.refdata["mech_type"][ind2[0]] != "SK1"
-            ):
-                self.quality[ind] = self.quality[ind] + qual
-                continue
-            test1 = np.atleast_1d(
-                (self.refdata["skybeamhit"][ind1[-1]] & EARTH1 == EARTH1)
-                | (self.refdata["skybeamhit"][ind1[-1]] & MOON1 == MOON1)
-                | (self.refdata["skybeamhit"][ind1[-1]] & SUN1 == SUN1)
-            ).nonzero()[0]
-            test2 = np.atleast_1d(
-                (self.refdata["skybeamhit"][ind2[0]] & EARTH1 == EARTH1)
-                | (self.refdata["skybeamhit"][ind2[0]] & MOON1 == MOON1)
-                | (self.refdata["skybeamhit"][ind2[0]] & SUN1 == SUN1)
-            ).nonzero()[0]
-            if test1.shape[0] != 0 or test2.shape[0] != 0:
-                self.quality[ind] = self.quality[ind] + qual
+        nbefore, after, nref = self.get_reference_brackets()
+        flagged = (nbefore < 2) | (after >= nref)
+        if nref > 0:
+            mech_type = np.atleast_1d(self.refdata["mech_type"])
+            skybeamhit = np.atleast_1d(self.refdata["skybeamhit"])
+            last = np.clip(nbefore - 1, 0, nref - 1)
+            second_last = np.clip(nbefore - 2, 0, nref - 1)
+            first = np.clip(after, 0, nref - 1)
+            hit = (skybeamhit & (EARTH1 | MOON1 | SUN1)) != 0
+            flagged = (
+                flagged
+                | (mech_type[second_last] != "SK1")
+                | (mech_type[last] != "SK1")
+                | (mech_type[first] != "SK1")
+                | hit[last]
+                | hit[first]
+            )
+        self.flag_target_spectra(qual, flagged)
 
     def check_ref_inttime(self):
         """check that surrounding references integration time are the same"""
         qual = 0x0100
-        for ind, stw in enumerate(self.specdata["stw"]):
-            if ind < 2:
-                continue
-            ind1 = np.nonzero((self.refdata["stw"] < stw))[0]
-            ind2 = np.nonzero((self.refdata["stw"] > stw))[0]
-            if ind1.shape[0] == 0 or ind2.shape[0] == 0:
-                self.quality[ind] = self.quality[ind] + qual
-                continue
-            if (
-                np.abs(
-                    self.refdata["inttime"][ind1[-1]] - self.refdata["inttime"][ind2[0]]
-                )
-                > 0.2
-            ):
-                self.quality[ind] = self.quality[ind] + qual
+        nbefore, after, nref = self.get_reference_brackets()
+        flagged = (nbefore == 0) | (after >= nref)
+        if nref > 0:
+            inttime = np.atleast_1d(self.refdata["inttime"])
+            last = np.clip(nbefore - 1, 0, nref - 1)
+            first = np.clip(after, 0, nref - 1)
+            flagged = flagged | (np.abs(inttime[last] - inttime[first]) > 0.2)
+        self.flag_target_spectra(qual, flagged)
 
     def check_moon_in_mainbeam(self):
         """check if moon is in the main beam"""
@@ -257,24 +274,21 @@ class QualityControl:
         """identify the power variation of the two surrounding
         reference measurements
         """
-        ones = np.array(np.ones(8) * -1).tolist()
-        for ind, stw in enumerate(self.specdata["stw"]):
-            if ind < 2:
-                self.zerolagvar.append(ones)
-                continue
-            ind1 = np.nonzero((self.refdata["stw"] < stw))[0]
-            ind2 = np.nonzero((self.refdata["stw"] > stw))[0]
-            if ind1.shape[0] == 0 or ind2.shape[0] == 0:
-                self.zerolagvar.append(ones)
-                continue
-            zero1 = np.array(self.refdata["cc"][ind1[-1]])
-            zero2 = np.array(self.refdata["cc"][ind2[0]])
+        nbefore, after, nref = self.get_reference_brackets()
+        frac = -np.ones((nbefore.shape[0], 8))
+        valid = (nbefore > 0) & (after < nref)
+        valid[:2] = False
+        if np.any(valid):
+            cc = np.asarray(self.refdata["cc"], dtype=float)
+            zero1 = cc[nbefore[valid] - 1]
+            zero2 = cc[after[valid]]
             gaindiff = np.abs(zero1 - zero2)
-            gain = np.array((zero1 + zero2) / 2.0)
-            frac = np.array(ones)
-            index = np.nonzero((gain > 0))[0]
-            frac[index] = gaindiff[index] / gain[index] * 100.0
-            self.zerolagvar.append(np.around(frac, decimals=4).tolist())
+            gain = (zero1 + zero2) / 2.0
+            fracvalid = -np.ones(gain.shape)
+            index = gain > 0
+            fracvalid[index] = gaindiff[index] / gain[index] * 100.0
+            frac[valid] = np.around(fracvalid, decimals=4)
+        self.zerolagvar = frac.tolist()
 
 
 class QualityDisplay:
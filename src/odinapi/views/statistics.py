@@ -5,8 +5,11 @@ from flask import jsonify, abort, request
 from flask.views import MethodView
 from datetime import date, datetime, timedelta
 
+import numpy as np
 from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
 from ..pg_database import db
+from ..utils.data_version import get_cached, get_data_version, make_etag
 
 
 def find_last_day_of_month(year, month):
@@ -18,14 +21,32 @@ def find_last_day_of_month(year, month):
 
 
 class FreqmodeStatistics(MethodView):
-    """Statistics of total number of scans per freqmode"""
+    """Statistics of total number of scans per freqmode
+
+    The totals are summed from the measurements_monthly rollup, which the
+    materialiser creates and updates, or from measurements_cache until the
+    materialiser has run, and cached in process until new level0 data is
+    materialised. Responses have ETag and Last-Modified headers given by the
+    latest materialised import, so clients can revalidate them.
+    """
 
     query = text(
+        squeeze_query(
+            """\
+        select freqmode, sum(nscans)
+        from measurements_monthly
+        where year between :y1 and :y2
+        group by freqmode
+        order by freqmode"""
+        )
+    )
+
+    fallback_query = text(
         squeeze_query(
             """\
         select freqmode, sum(nscans)
         from measurements_cache
-        where date between :d1 and :d2
+        where date between make_date(:y1, 1, 1) and make_date(:y2, 12, 31)
         group by freqmode
         order by freqmode"""
         )
@@ -43,35 +64,47 @@ class FreqmodeStatistics(MethodView):
 
     def get_all(self):
         """Get freqmode scans summed up for all years"""
-        first_date = "2001-01-01"
-        last_date = "{0}-12-31".format(datetime.now().year)
-        info_list = self.gen_data(dict(d1=first_date, d2=last_date))
-        return jsonify(Data=info_list)
+        return self.make_response(None, dict(y1=2001, y2=datetime.now().year))
 
     def get_year(self, year):
         """Get freqmode scans summed up for a single year"""
-        first_date = "{0}-01-01".format(year)
-        last_date = "{0}-12-31".format(year)
-        info_list = self.gen_data(dict(d1=first_date, d2=last_date))
-        return jsonify(Data=info_list)
+        return self.make_response(year, dict(y1=year, y2=year))
+
+    def make_response(self, year, params):
+        data_version = get_data_version()
+        info_list = get_cached(
+            ("freqmode_statistics", year),
+            lambda: self.gen_data(params),
+            data_version,
+        )
+        response = jsonify(Data=info_list)
+        if data_version.materialised is not None:
+            response.set_etag(make_etag(data_version, "freqmode_statistics", year))
+            response.last_modified = data_version.materialised
+        return response.make_conditional(request)
 
     def gen_data(self, params):
-        query = db.session.execute(self.query, params=params)
-        result = [row._asdict() for row in query]
-        return result
+        try:
+            with db.session.begin_nested():
+                query = db.session.execute(self.query, params=params)
+                return [row._asdict() for row in query]
+        except ProgrammingError:
+            # measurements_monthly is missing until the materialiser has run
+            query = db.session.execute(self.fallback_query, params=params)
+            return [row._asdict() for row in query]
 
 
 class TimelineFreqmodeStatistics(MethodView):
     """Statistics of number of scans per freqmode for different years"""
 
-    query = text(
-        """\
-        select freqmode, sum(nscans)
+    query = """\
+        select freqmode, date_trunc('{period}', date) as period, sum(nscans)
         from measurements_cache
         where date between :d1 and :d2
-        group by freqmode
+        group by freqmode, period
         order by freqmode"""
-    )
+    years_query = text(squeeze_query(query.format(period="year")))
+    months_query = text(squeeze_query(query.format(period="month")))
 
     def get(self, version):
         """GET"""
@@ -85,46 +118,40 @@ class TimelineFreqmodeStatistics(MethodView):
 
     def get_years(self):
         """Get freqmode scans per year for all years"""
-        info_dict = {}
         years = list(range(2001, datetime.now().year + 1))
-        for year in years:
-            first_date = "{0}-01-01".format(year)
-            last_date = "{0}-12-31".format(year)
-            result = db.session.execute(
-                self.query, params=dict(d1=first_date, d2=last_date)
-            )
-            for row in result:
-                try:
-                    info_dict[row.freqmode].append([year, row.sum])
-                except KeyError:
-                    info_dict[row.freqmode] = [[year, row.sum]]
-        info_dict = self._fill_blanks(years, info_dict)
+        result = db.session.execute(
+            self.years_query,
+            params=dict(d1=date(years[0], 1, 1), d2=date(years[-1], 12, 31)),
+        )
+        info_dict = self._make_timeline(
+            years, [(row.freqmode, row.period.year, row.sum) for row in result]
+        )
         return jsonify(Data=info_dict, Years=years)
 
     def get_months(self, year):
         """Get freqmode scans per month for a single year"""
-        info_dict = {}
         months = list(range(1, 13))
-        for month in months:
-            first_date = date(year, month, 1)
-            last_date = find_last_day_of_month(year, month)
-            result = db.session.execute(
-                self.query, params=dict(d1=first_date, d2=last_date)
-            )
-            for row in result:
-                try:
-                    info_dict[row.freqmode].append([month, row.sum])
-                except KeyError:
-                    info_dict[row.freqmode] = [[month, row.sum]]
-        info_dict = self._fill_blanks(months, info_dict)
+        result = db.session.execute(
+            self.months_query,
+            params=dict(d1=date(year, 1, 1), d2=find_last_day_of_month(year, 12)),
+        )
+        info_dict = self._make_timeline(
+            months, [(row.freqmode, row.period.month, row.sum) for row in result]
+        )
         return jsonify(Data=info_dict, Months=months, Year=year)
 
-    def _fill_blanks(self, indices, info_dict):
-        for key in info_dict:
-            for n, ind in enumerate(indices):
-                try:
-                    if info_dict[key][n][0] != ind:
-                        info_dict[key].insert(n, [ind, 0])
-                except IndexError:
-                    info_dict[key].append([ind, 0])
-        return info_dict
+    def _make_timeline(self, indices, counts):
+        """[[index, count], ...] for each freqmode, with 0 for missing indices
+
+        counts holds (freqmode, index, count) for the indices with scans.
+        """
+        if not counts:
+            return {}
+        freqmode, index, count = zip(*counts)
+        freqmodes, rows = np.unique(freqmode, return_inverse=True)
+        matrix = np.zeros((len(freqmodes), len(indices)), dtype="int64")
+        matrix[rows, np.searchsorted(indices, index)] = count
+        return {
+            int(freqmode): [[ind, int(n)] for ind, n in zip(indices, row)]
+            for freqmode, row in zip(freqmodes, matrix)
+        }
@@ -1,6 +1,10 @@
 from collections import namedtuple
+from typing import Any, Iterable, Iterator
 
-from flask import url_for
+from flask import Response, current_app, request, stream_with_context, url_for
+
+JSON_MIMETYPE = "application/json"
+NDJSON_MIMETYPE = "application/x-ndjson"
 
 
 def copyemptydict(a):
@@ -18,6 +22,61 @@ def make_rfc5988_link(url, **params):
     return link
 
 
+def iter_json_list(
+    items: Iterable[Any],
+    key: str = "Data",
+    count_key: str | None = "Count",
+    **fields: Any,
+) -> Iterator[str]:
+    """Encode {**fields, key: [*items], count_key: n} piece by piece
+
+    The items are encoded one at a time while they are read, so that a
+    response can be streamed without holding the whole list in memory.
+    The count is left out if count_key is None.
+    """
+    dumps = current_app.json.dumps
+    head = "".join(f"{dumps(name)}: {dumps(value)}, " for name, value in fields.items())
+    yield f"{{{head}{dumps(key)}: ["
+    count = 0
+    for item in items:
+        yield ("," if count else "") + dumps(item)
+        count += 1
+    yield f"], {dumps(count_key)}: {count}}}" if count_key is not None else "]}"
+
+
+def iter_ndjson(items: Iterable[Any]) -> Iterator[str]:
+    dumps = current_app.json.dumps
+    for item in items:
+        yield dumps(item) + "\n"
+
+
+def make_list_response(
+    items: Iterable[Any],
+    key: str = "Data",
+    count_key: str | None = "Count",
+    headers: dict[str, str] | None = None,
+    **fields: Any,
+) -> Response:
+    """Streamed response with the items of a list endpoint
+
+    The response is the JSON object {**fields, key: [*items], count_key: n}
+    unless the client accepts application/x-ndjson, then it is one item per
+    line. Either way the items are encoded as they are read.
+    """
+    mimetype = request.accept_mimetypes.best_match(
+        [JSON_MIMETYPE, NDJSON_MIMETYPE], default=JSON_MIMETYPE
+    )
+    if mimetype == NDJSON_MIMETYPE:
+        body = iter_ndjson(items)
+    else:
+        body = iter_json_list(items, key, count_key, **fields)
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers=headers,
+    )
+
+
 def make_rfc5988_pagination_header(offset, limit, count, url_endpoint, **url_values):
     pagination = OffsetAndLimitPagination(offset, limit, count)
     pages = {
@@ -1,9 +1,15 @@
 from datetime import datetime
-from threading import Lock
 from typing import TypedDict
 
 from dateutil.relativedelta import relativedelta
-from flask import abort, jsonify, request
+from flask import (
+    Response,
+    abort,
+    current_app,
+    jsonify,
+    request,
+    stream_with_context,
+)
 from flask.views import MethodView
 from numpy import around
 from sqlalchemy import text
@@ -16,25 +22,35 @@ from odinapi.utils import (
     use_agg,  # noqa: F401
 )
 from odinapi.utils.collocations import get_collocations
+from odinapi.utils.concurrency import ConcurrencyLimit, get_concurrency_limit
+from odinapi.utils.conditional import make_request_etag
 from odinapi.utils.defs import FREQMODE_TO_BACKEND, SPECIES
-from odinapi.utils.time_util import datetime2mjd, mjd2stw
+from odinapi.utils.time_util import datetime2mjd, mjd2datetime, mjd2stw
 from odinapi.views.urlgen import get_freqmode_raw_url
-from odinapi.views.views_cached import get_scan_log_data
+from odinapi.views.views_cached import SCAN_LIST_FETCH_SIZE, get_scan_log_data
 
 from ..pg_database import db
 from .geoloc_tools import get_geoloc_info
 from .get_odinapi_info import get_config_data_files
-from .level1b_scandata_exporter_v2 import get_scan_data_v2, scan2dictlist_v4
-from .level1b_scanlogdata_exporter import get_scan_logdata
+from .l1b_formats import (
+    ARROW_MIMETYPE,
+    JSON_MIMETYPE,
+    get_response_format,
+    make_binary_response,
+)
+from .level1b_cache import get_scan_data_cached, iter_scan_data_cached
+from .level1b_scandata_exporter_v2 import scan2dictlist_v4
+from .level1b_scanlogdata_exporter import ScanInfoExporter, get_scan_logdata
 from .read_ace import read_ace_file
-from .read_apriori import AprioriException, get_apriori
+from .read_apriori import AprioriException, get_apriori, get_apriori_store
 from .read_mipas import read_esa_mipas_file, read_mipas_file
 from .read_mls import read_mls_file
 from .read_odinsmr2_old import read_qsmr_file
 from .read_osiris import read_osiris_file
-from .read_ptz import get_ptz
+from .read_ptz import get_ptz, get_ptz_store, make_ptz, ptz_to_arrow, split_scans
 from .read_sageIII import read_sageIII_file
 from .read_smiles import read_smiles_file
+from .utils import make_list_response
 
 
 class QueryParams(TypedDict, total=False):
@@ -216,23 +232,30 @@ class FreqmodeInfo(MethodView):
             return jsonify(Info={})
 
 
+def get_raw_limit() -> ConcurrencyLimit:
+    """Limit of concurrent requests that process raw scan logs"""
+    return get_concurrency_limit(
+        "raw",
+        current_app.config.get("RAW_CONCURRENCY", 2),
+        current_app.config.get("RAW_QUEUE_TIMEOUT", 10.0),
+    )
+
+
 class FreqmodeInfoNoBackend(MethodView):
     """loginfo for all scans from a given date and freqmode without backend"""
 
-    LOCK = Lock()
-
     def __init__(self):
         import logging
 
         self.logger = logging.getLogger("odinapi").getChild(self.__class__.__name__)
 
-    @classmethod
-    def _acquire_lock(cls, timeout: int = 1) -> bool:
-        return cls.LOCK.acquire(timeout=timeout)
+    @staticmethod
+    def _acquire_lock() -> bool:
+        return get_raw_limit().acquire()
 
-    @classmethod
-    def _release_lock(cls) -> None:
-        cls.LOCK.release()
+    @staticmethod
+    def _release_lock() -> None:
+        get_raw_limit().release()
 
     def get(self, version, date, freqmode):
         """Get frequency mode info without backend"""
@@ -311,20 +334,18 @@ class FreqmodeInfoNoBackend(MethodView):
 class ScanInfoNoBackend(MethodView):
     """Get scan info without backend"""
 
-    LOCK = Lock()
-
     def __init__(self):
         import logging
 
         self.logger = logging.getLogger("odinapi").getChild(self.__class__.__name__)
 
-    @classmethod
-    def _acquire_lock(cls, timeout: int = 1) -> bool:
-        return cls.LOCK.acquire(timeout=timeout)
+    @staticmethod
+    def _acquire_lock() -> bool:
+        return get_raw_limit().acquire()
 
-    @classmethod
-    def _release_lock(cls) -> None:
-        cls.LOCK.release()
+    @staticmethod
+    def _release_lock() -> None:
+        get_raw_limit().release()
 
     def get(self, version, date, freqmode, scanno):
         """Get scan info without backend"""
@@ -408,11 +429,21 @@ class ScanSpec(MethodView):
         if version != "v4":
             return jsonify({"Error": f"Version {version} not supported, only v4"}), 404
 
-        spectra = get_scan_data_v2(backend, freqmode, scanno, debug)
+        try:
+            response_format = get_response_format()
+        except ValueError:
+            abort(400)
+
+        spectra = get_scan_data_cached(backend, freqmode, scanno, debug)
         if spectra == {}:
             abort(404)
         # spectra is a dictionary containing the relevant data
-        return jsonify(scan2dictlist_v4(spectra))
+        if response_format != "json":
+            response = make_binary_response(spectra, response_format)
+        else:
+            response = jsonify(scan2dictlist_v4(spectra))
+        response.vary.add("Accept")
+        return response
 
 
 class ScanSpecNoBackend(MethodView):
@@ -430,15 +461,113 @@ class ScanSpecNoBackend(MethodView):
             abort(404)
         try:
             debug = get_args.get_bool("debug")
+            response_format = get_response_format()
         except ValueError:
             abort(400)
 
-        spectra = get_scan_data_v2(backend, freqmode, scanno, bool(debug))
+        spectra = get_scan_data_cached(backend, freqmode, scanno, bool(debug))
         if spectra == {}:
             abort(404)
 
-        data = scan2dictlist_v4(spectra)
-        return jsonify(Data=data, Type="L1b", Count=None)
+        if response_format != "json":
+            response = make_binary_response(spectra, response_format)
+        else:
+            data = scan2dictlist_v4(spectra)
+            response = jsonify(Data=data, Type="L1b", Count=None)
+        response.vary.add("Accept")
+        return response
+
+
+class ScanSpecListNoBackend(MethodView):
+    """Get L1b data for several scans"""
+
+    def get(self, version, freqmode):
+        """Stream L1b data for a list of scans or a time period
+
+        Scans are given either as repeated scanid arguments or as a
+        start_time and end_time. The response is newline delimited JSON
+        with one object per scan, ordered by scanid. Data is null for
+        scans without L1b data.
+        """
+        if version != "v5":
+            return jsonify({"Error": f"Version {version} not supported, only v5"}), 404
+
+        try:
+            backend = FREQMODE_TO_BACKEND[freqmode]
+        except KeyError:
+            abort(404)
+        try:
+            scanids = [int(scanid) for scanid in get_args.get_list("scanid") or []]
+            start_time = get_args.get_datetime("start_time")
+            end_time = get_args.get_datetime("end_time")
+        except ValueError:
+            abort(400)
+
+        if scanids and (start_time or end_time):
+            abort(400)
+        if not scanids:
+            if not (start_time and end_time) or start_time > end_time:
+                abort(400)
+            # mjd2stw is approximate, the exact period is checked below
+            scanids = ScanInfoExporter(backend, freqmode).get_scanids(
+                mjd2stw(datetime2mjd(start_time) - 0.1),
+                mjd2stw(datetime2mjd(end_time) + 0.1),
+            )
+        if len(scanids) > current_app.config.get("L1B_BULK_MAX_SCANS", 2000):
+            return jsonify({"Error": "Too many scans requested"}), 400
+
+        def in_period(spectra):
+            if start_time is None:
+                return True
+            return start_time <= mjd2datetime(spectra["mjd"][0]) <= end_time
+
+        def generate():
+            for scanid, spectra in iter_scan_data_cached(backend, freqmode, scanids):
+                if spectra == {}:
+                    if start_time is not None:
+                        continue
+                    data = None
+                elif in_period(spectra):
+                    data = scan2dictlist_v4(spectra)
+                else:
+                    continue
+                yield (
+                    current_app.json.dumps(dict(ScanID=scanid, Type="L1b", Data=data))
+                    + "\n"
+                )
+
+        return Response(
+            stream_with_context(generate()), mimetype="application/x-ndjson"
+        )
+
+
+def make_ptz_etag() -> str | None:
+    """ETag of a request for the PTZ data of a scan
+
+    The response changes with the scan log, for the position of the scan,
+    and with the PTZ files of the scan.
+    """
+    view_args = request.view_args or {}
+    backend = view_args.get("backend") or FREQMODE_TO_BACKEND.get(view_args["freqmode"])
+    if backend is None:
+        return None
+    return make_request_etag(get_ptz_store().scan_version(backend, view_args["scanno"]))
+
+
+def make_apriori_etag() -> str | None:
+    """ETag of a request for the apriori data at a scan
+
+    The response changes with the scan log, for the position and day of the
+    scan, and with the apriori data of the species.
+    """
+    view_args = request.view_args or {}
+    try:
+        version = get_apriori_store().version(
+            view_args["species"], get_args.get_string("aprsource")
+        )
+    except AprioriException:
+        return None
+    return make_request_etag(version)
 
 
 class ScanPTZ(MethodView):
@@ -482,6 +611,91 @@ class ScanPTZNoBackend(MethodView):
         return jsonify(Data=ptz, Type="ptz", Count=None)
 
 
+class ScanPTZListNoBackend(MethodView):
+    """Get PTZ data for several scans"""
+
+    FORMATS = {"json": JSON_MIMETYPE, "arrow": ARROW_MIMETYPE}
+
+    query = """\
+        select distinct on (scanid)
+            scanid, mjdstart, mjdend, latstart, latend, lonstart, lonend
+        from scans_cache
+        where freqmode = :f and backend = :b and {condition}
+        order by scanid"""
+
+    def get(self, version, freqmode):
+        """Get PTZ data for a list of scans or the scans of a day
+
+        Scans are given either as repeated scanid arguments or as a date.
+        Each PTZ file is read once for all the scans in it. Data is null
+        for scans without PTZ data.
+        """
+        if version != "v5":
+            return jsonify({"Error": f"Version {version} not supported, only v5"}), 404
+
+        try:
+            backend = FREQMODE_TO_BACKEND[freqmode]
+        except KeyError:
+            abort(404)
+        try:
+            scanids = [int(scanid) for scanid in get_args.get_list("scanid") or []]
+            day = request.args.get("date")
+            if day is not None:
+                day = datetime.strptime(day, "%Y-%m-%d").date()
+            response_format = get_response_format(self.FORMATS)
+        except ValueError:
+            abort(400)
+        if bool(scanids) == (day is not None):
+            abort(400)
+        max_scans = current_app.config.get("PTZ_BULK_MAX_SCANS", 5000)
+        if len(scanids) > max_scans:
+            return jsonify({"Error": "Too many scans requested"}), 400
+
+        if scanids:
+            condition, params = "scanid = any(:s)", dict(s=scanids)
+        else:
+            condition, params = "date = :d", dict(d=day)
+        rows = db.session.execute(
+            text(squeeze_query(self.query.format(condition=condition))),
+            params=dict(params, f=freqmode, b=backend),
+        ).all()
+        if len(rows) > max_scans:
+            return jsonify({"Error": "Too many scans requested"}), 400
+        tables = split_scans(
+            get_ptz_store().read_scans(backend, [row.scanid for row in rows])
+        )
+        geolocs = {
+            row.scanid: get_geoloc_info(
+                {
+                    "LonStart": [row.lonstart],
+                    "LatStart": [row.latstart],
+                    "LonEnd": [row.lonend],
+                    "LatEnd": [row.latend],
+                    "MJDStart": [row.mjdstart],
+                    "MJDEnd": [row.mjdend],
+                }
+            )
+            for row in rows
+        }
+
+        def get_data(scanid):
+            if scanid not in tables or scanid not in geolocs:
+                return None
+            mjd, _, lat, lon = geolocs[scanid]
+            return make_ptz(tables[scanid], mjd, lat, lon)
+
+        records = [
+            dict(ScanID=scanid, Data=get_data(scanid))
+            for scanid in (scanids or geolocs)
+        ]
+        if response_format == "arrow":
+            response = Response(ptz_to_arrow(records), mimetype=ARROW_MIMETYPE)
+        else:
+            response = make_list_response(records, Type="ptz")
+        response.vary.add("Accept")
+        return response
+
+
 class ScanAPR(MethodView):
     """Get apriori data for a certain species"""
 
@@ -760,10 +974,13 @@ class VdsDateInfo(MethodView):
         """GET-method"""
         if version not in ["v4"]:
             abort(404)
-        datadict = self.gen_data(version, backend, freqmode, species, instrument, date)
-        return jsonify(datadict)
+        return make_list_response(
+            self.iter_data(version, backend, freqmode, species, instrument, date),
+            key="VDS",
+            count_key=None,
+        )
 
-    def gen_data(self, version, backend, freqmode, species, instrument, date):
+    def iter_data(self, version, backend, freqmode, species, instrument, date):
         result = db.session.execute(
             self.query,
             params=dict(
@@ -773,8 +990,8 @@ class VdsDateInfo(MethodView):
                 instrument=instrument,
                 date=date,
             ),
+            execution_options=dict(yield_per=SCAN_LIST_FETCH_SIZE),
         )
-        datadict = {"VDS": []}
         odin_keys = [
             "Date",
             "FreqMode",
@@ -845,8 +1062,7 @@ class VdsDateInfo(MethodView):
                 row["file"],
                 row["file_index"],
             )
-            datadict["VDS"].append(data)
-        return datadict
+            yield data
 
 
 class VdsScanInfo(MethodView):
@@ -867,14 +1083,16 @@ class VdsScanInfo(MethodView):
         """GET-method"""
         if version not in ["v4"]:
             abort(404)
-        datadict = self.gen_data(version, backend, freqmode)
-        return jsonify(datadict)
+        return make_list_response(
+            self.iter_data(version, backend, freqmode), key="VDS", count_key=None
+        )
 
-    def gen_data(self, version, backend, freqmode):
+    def iter_data(self, version, backend, freqmode):
         result = db.session.execute(
-            self.query, params=dict(backend=backend, freqmode=freqmode)
+            self.query,
+            params=dict(backend=backend, freqmode=freqmode),
+            execution_options=dict(yield_per=SCAN_LIST_FETCH_SIZE),
         )
-        datadict = {"VDS": []}
         odin_keys = [
             "Date",
             "FreqMode",
@@ -917,8 +1135,7 @@ class VdsScanInfo(MethodView):
                     freqmode,
                     row["scanid"],
                 )
-            datadict["VDS"].append(data)
-        return datadict
+            yield data
 
 
 class VdsExtData(MethodView):
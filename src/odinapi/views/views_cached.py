@@ -6,17 +6,107 @@ from datetime import datetime, date, timedelta
 from odinapi.pg_database import squeeze_query
 from typing import TypedDict
 
-from flask import abort, jsonify, request
+from flask import abort, jsonify, request, url_for
 from flask.views import MethodView
 from sqlalchemy import TextClause, text
 
 from odinapi.pg_database import db
 from .level1b_scanlogdata_exporter import ScanInfoExporter
+from .scan_index import get_scan_date
 from .urlgen import get_freqmode_info_url
+from .utils import make_list_response, make_rfc5988_link
 from ..utils import get_args
 from ..utils.defs import FREQMODE_TO_BACKEND, SPECIES
 
 
+# scans_cache columns and the scan log keys they are given as
+SCANS_CACHE_KEYS = {
+    "freqmode": "FreqMode",
+    "backend": "BackEnd",
+    "scanid": "ScanID",
+    "altend": "AltEnd",
+    "altstart": "AltStart",
+    "latend": "LatEnd",
+    "latstart": "LatStart",
+    "lonend": "LonEnd",
+    "lonstart": "LonStart",
+    "mjdend": "MJDEnd",
+    "mjdstart": "MJDStart",
+    "numspec": "NumSpec",
+    "sunzd": "SunZD",
+    "datetime": "DateTime",
+    "quality": "Quality",
+}
+
+# scans read from the database at a time when a scan list is streamed
+SCAN_LIST_FETCH_SIZE = 1000
+
+
+def translate_scan_row(row):
+    """Scan log record of a scans_cache row"""
+    return {
+        SCANS_CACHE_KEYS[key]: value
+        for key, value in row.items()
+        if key in SCANS_CACHE_KEYS
+    }
+
+
+def iter_scans_cached(query, params):
+    """Scan log records read with a server side cursor
+
+    The rows are fetched SCAN_LIST_FETCH_SIZE at a time, so only a part of
+    the result is held in memory when it is streamed.
+    """
+    result = db.session.execute(
+        query,
+        params=params,
+        execution_options=dict(yield_per=SCAN_LIST_FETCH_SIZE),
+    )
+    for row in result.mappings():
+        yield translate_scan_row(row)
+
+
+def get_scan_rows_cached(freqmode, backend, scanid):
+    """scans_cache rows of a scan
+
+    The scan is looked up with its date if it is in the scan index, else by
+    scan id alone.
+    """
+    params = dict(s=scanid, f=freqmode, b=backend)
+    scan_date = get_scan_date(freqmode, scanid)
+    if scan_date is not None:
+        rows = db.session.execute(
+            text(
+                squeeze_query(
+                    """\
+                select *
+                from scans_cache
+                where date = :d
+                    and scanid = :s
+                    and freqmode = :f
+                    and backend = :b"""
+                )
+            ),
+            params=dict(params, d=scan_date),
+        ).all()
+        if rows:
+            return rows
+    return db.session.execute(
+        text(
+            squeeze_query(
+                """\
+            select *
+            from scans_cache
+            where scanid = :s
+                and freqmode = :f
+                and backend = :b
+            order by backend, freqmode"""
+            )
+        ),
+        params=params,
+    ).all()
+
+
 def get_scan_logdata_cached(date, freqmode, scanid=None):
     # generate query
     backend = ""
@@ -41,20 +131,7 @@ def get_scan_logdata_cached(date, freqmode, scanid=None):
             query_string, params=dict(d=date, f=freqmode, b=backend)
         )
     elif scanid is not None:
-        query_string = text(
-            squeeze_query(
-                """\
-            select *
-            from scans_cache
-            where scanid = :s
-                and freqmode = :f
-                and backend = :b
-            order by backend, freqmode"""
-            )
-        )
-        query = db.session.execute(
-            query_string, params=dict(s=scanid, f=freqmode, b=backend)
-        )
+        query = get_scan_rows_cached(freqmode, backend, scanid)
     else:
         abort(404)
 
@@ -62,23 +139,7 @@ def get_scan_logdata_cached(date, freqmode, scanid=None):
     result = [row._asdict() for row in query]
 
     # translate keys
-    key_translation = {
-        "freqmode": "FreqMode",
-        "backend": "BackEnd",
-        "scanid": "ScanID",
-        "altend": "AltEnd",
-        "altstart": "AltStart",
-        "latend": "LatEnd",
-        "latstart": "LatStart",
-        "lonend": "LonEnd",
-        "lonstart": "LonStart",
-        "mjdend": "MJDEnd",
-        "mjdstart": "MJDStart",
-        "numspec": "NumSpec",
-        "sunzd": "SunZD",
-        "datetime": "DateTime",
-        "quality": "Quality",
-    }
+    key_translation = SCANS_CACHE_KEYS
     translated = {}
 
     for key in key_translation:
@@ -299,14 +360,19 @@ def make_loginfo_v4(loginfo, keylist, ind, version, date, backend):
 
 
 def make_loginfo_v5(loginfo, keylist, ind, version, apriori=None):
+    record = {key: loginfo[key][ind] for key in set(keylist) | {"FreqMode", "ScanID"}}
+    return make_loginfo_record_v5(record, keylist, version, apriori)
+
+
+def make_loginfo_record_v5(record, keylist, version, apriori=None):
     if apriori is None:
         apriori = SPECIES
-    freq_mode = loginfo["FreqMode"][ind]
-    scanid = loginfo["ScanID"][ind]
+    freq_mode = record["FreqMode"]
+    scanid = record["ScanID"]
 
     datadict = dict()
     for key in keylist:
-        datadict[key] = loginfo[key][ind]
+        datadict[key] = record[key]
     datadict["URLS"] = dict()
     datadict["URLS"]["URL-log"] = ("{0}rest_api/{1}/level1/{2}/{3}/Log/").format(
         request.url_root, version, freq_mode, scanid
@@ -384,35 +450,42 @@ class FreqmodeInfoCached(MethodView):
 class FreqmodeInfoCachedNoBackend(MethodView):
     """loginfo for all scans without backend specification"""
 
+    query = text(
+        squeeze_query(
+            """\
+        select *
+        from scans_cache
+        where date = :d
+        and freqmode = :f
+        and backend = :b
+        order by scanid"""
+        )
+    )
+
     def get(self, version, date, freqmode, scanno=None, apriori=None):
-        """Get frequency mode info from cache without backend"""
+        """Get frequency mode info from cache without backend
+
+        The scans are streamed as they are read from the cache table.
+        """
         if version != "v5":
             return jsonify({"Error": f"Version {version} not supported, only v5"}), 404
 
+        try:
+            backend = FREQMODE_TO_BACKEND[freqmode]
+        except KeyError:
+            abort(404)
         if apriori is None:
             apriori = SPECIES
-        loginfo = {}
         keylist = FreqmodeInfoCached.KEYS_V4
-
-        loginfo = get_scan_logdata_cached(date, freqmode=int(freqmode), scanid=scanno)
-
-        for key in loginfo:
-            try:
-                loginfo[key] = loginfo[key].tolist()
-            except AttributeError:
-                pass
-
-        loginfo["Info"] = []
-        try:
-            for ind in range(len(loginfo["ScanID"])):
-                loginfo["Info"].append(
-                    make_loginfo_v5(loginfo, keylist, ind, version, apriori)
-                )
-        except KeyError:
-            loginfo["Info"] = []
-
-        data = loginfo["Info"]
-        return jsonify(Data=data, Type="Log", Count=len(data))
+        records = iter_scans_cached(self.query, dict(d=date, f=freqmode, b=backend))
+        return make_list_response(
+            (
+                make_loginfo_record_v5(record, keylist, version, apriori)
+                for record in records
+                if scanno is None or record["ScanID"] == scanno
+            ),
+            Type="Log",
+        )
 
 
 class ScanInfoCachedNoBackend(MethodView):
@@ -515,14 +588,56 @@ class L1LogCached_v4(L1LogCached):
 class L1LogCachedList(MethodView):
     """Get a list of L1 Logs for a certain period"""
 
+    # date, the day the scan starts, is at most a day before datetime, the
+    # middle of the scan, and lets the query use the index on date
+    QUERY = """\
+        select {columns}
+        from scans_cache
+        where backend = :b
+        and freqmode = :f
+        and date between :d1 and :d2
+        and datetime >= :t1
+        and datetime < :t2
+        {after}
+        order by scanid
+        {limit}"""
+
+    def get_query(self, columns, after, limit):
+        return text(
+            squeeze_query(
+                self.QUERY.format(
+                    columns=columns,
+                    after="and scanid > :a" if after is not None else "",
+                    limit=limit,
+                )
+            )
+        )
+
     def get(self, version, freqmode):
-        """Get L1 log list for a time period"""
+        """Get L1 log list for a time period
+
+        The scans are read with one query over the period and streamed as
+        they are read. With the limit argument at most limit scans are
+        returned, and a Link header points to the next page, which starts
+        after the last scan of this one.
+        """
         if version != "v5":
             return jsonify({"Error": f"Version {version} not supported, only v5"}), 404
 
-        start_time = get_args.get_datetime("start_time")
-        end_time = get_args.get_datetime("end_time")
-        if start_time and end_time and start_time > end_time:
+        try:
+            backend = FREQMODE_TO_BACKEND[freqmode]
+        except KeyError:
+            abort(404)
+        try:
+            start_time = get_args.get_datetime("start_time")
+            end_time = get_args.get_datetime("end_time")
+            limit = get_args.get_int("limit")
+            after = get_args.get_int("after")
+        except ValueError:
+            abort(400)
+        if not start_time or not end_time or start_time > end_time:
+            abort(400)
+        if limit is not None and limit < 1:
             abort(400)
 
         apriori = get_args.get_list("apriori")
@@ -533,28 +648,44 @@ class L1LogCachedList(MethodView):
         else:
             apriori = set(apriori)
 
-        log_list = []
-        the_date = start_time
-        keylist = FreqmodeInfoCached.KEYS_V4
-
-        while the_date < end_time:
-            loginfo = get_scan_logdata_cached(
-                the_date.strftime("%Y-%m-%d"), freqmode=int(freqmode), scanid=None
-            )
-
-            for key in loginfo:
-                try:
-                    loginfo[key] = loginfo[key].tolist()
-                except AttributeError:
-                    pass
-
-            try:
-                for ind in range(len(loginfo["ScanID"])):
-                    log_entry = make_loginfo_v5(loginfo, keylist, ind, version, apriori)
-                    log_list.append(log_entry)
-            except KeyError:
-                pass
-
-            the_date += timedelta(days=1)
+        params = dict(
+            b=backend,
+            f=freqmode,
+            d1=start_time.date() - timedelta(days=1),
+            d2=end_time.date(),
+            t1=start_time,
+            t2=end_time,
+            a=after,
+        )
+        headers = {}
+        if limit is not None:
+            # the scan after the last one of this page tells if there are more
+            boundary = db.session.execute(
+                self.get_query("scanid", after, "offset :o limit 2"),
+                params=dict(params, o=limit - 1),
+            ).all()
+            if len(boundary) == 2:
+                url_values = request.args.to_dict(flat=False)
+                url_values["after"] = boundary[0].scanid
+                url = url_for(
+                    request.endpoint,  # ty:ignore[invalid-argument-type]
+                    _external=True,
+                    version=version,
+                    freqmode=freqmode,
+                    **url_values,
+                )
+                headers["Link"] = make_rfc5988_link(url, rel="next")
 
-        return jsonify(Data=log_list, Type="Log", Count=len(log_list))
+        records = iter_scans_cached(
+            self.get_query("*", after, "limit :l" if limit is not None else ""),
+            dict(params, l=limit),
+        )
+        keylist = FreqmodeInfoCached.KEYS_V4
+        return make_list_response(
+            (
+                make_loginfo_record_v5(record, keylist, version, apriori)
+                for record in records
+            ),
+            headers=headers,
+            Type="Log",
+        )
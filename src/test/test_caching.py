@@ -0,0 +1,68 @@
+from odinapi.utils import caching
+from odinapi.utils.caching import LRUCache, TTLCache
+
+
+class TestLRUCache:
+    def test_get_returns_default_on_miss(self):
+        cache = LRUCache(2)
+        assert cache.get("a") is None
+        assert cache.get("a", 1) == 1
+        assert cache.stats()["misses"] == 2
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == 1
+        cache.put("c", 3)
+        assert "a" in cache
+        assert "b" not in cache
+        assert "c" in cache
+        assert len(cache) == 2
+
+    def test_counts_hits(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.get("a")
+        cache.get("b")
+        assert cache.stats() == {"size": 1, "maxsize": 2, "hits": 1, "misses": 1}
+
+    def test_zero_size_stores_nothing(self):
+        cache = LRUCache(0)
+        cache.put("a", 1)
+        assert len(cache) == 0
+
+    def test_pop(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        assert cache.pop("a") == 1
+        assert cache.pop("a") is None
+
+
+class TestTTLCache:
+    def test_entries_expire(self, mocker):
+        monotonic = mocker.patch.object(caching.time, "monotonic", return_value=0.0)
+        cache = TTLCache(max_age=10)
+        cache.put("a", 1)
+        monotonic.return_value = 9.0
+        assert cache.get("a") == 1
+        monotonic.return_value = 10.0
+        assert cache.get("a") is None
+        assert len(cache) == 0
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_drops_oldest_when_full(self):
+        cache = TTLCache(max_age=10, maxsize=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.put("c", 3)
+        assert cache.get("a") is None
+        assert cache.get("b") == 2
+        assert cache.pop("c") == 3
+        assert cache.pop("c") is None
+
+    def test_zero_max_age_stores_nothing(self):
+        cache = TTLCache(max_age=0)
+        cache.put("a", 1)
+        assert len(cache) == 0
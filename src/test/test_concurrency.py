@@ -0,0 +1,47 @@
+import threading
+import time
+from http.client import TOO_MANY_REQUESTS
+
+from flask import current_app, g
+
+from odinapi.utils import concurrency
+from odinapi.utils.concurrency import ConcurrencyLimit, map_in_app_context
+
+
+class TestConcurrencyLimit:
+    def test_limit_is_shared_until_released(self):
+        limit = ConcurrencyLimit(2, timeout=0.01)
+        assert limit.acquire()
+        assert limit.acquire()
+        assert not limit.acquire()
+        limit.release()
+        assert limit.acquire()
+
+    def test_waits_for_release(self):
+        limit = ConcurrencyLimit(1, timeout=5)
+        assert limit.acquire()
+        threading.Timer(0.05, limit.release).start()
+        start = time.monotonic()
+        assert limit.acquire()
+        assert time.monotonic() - start < 5
+
+
+def test_map_in_app_context(app_context):
+    g.value = "request"
+
+    def work(item):
+        assert "value" not in g
+        return item * 2, current_app.name, threading.current_thread().name
+
+    results = map_in_app_context(work, [3, 1, 2], max_workers=3)
+    assert [result[0] for result in results] == [6, 2, 4]
+    assert {result[1] for result in results} == {current_app.name}
+    assert all(result[2].startswith("odinapi") for result in results)
+
+
+def test_raw_requests_are_limited(test_client, mocker, data_version):
+    limit = ConcurrencyLimit(1, timeout=0.01)
+    mocker.patch.dict(concurrency._limits, {"raw": limit})
+    assert limit.acquire()
+    resp = test_client.get("/rest_api/v5/freqmode_raw/2015-01-12/2/")
+    assert resp.status_code == TOO_MANY_REQUESTS
@@ -0,0 +1,178 @@
+from datetime import datetime
+from http.client import NOT_FOUND, NOT_MODIFIED, OK
+
+import pytest
+from flask import Blueprint, Flask, Response, abort
+
+from odinapi.utils import conditional
+from odinapi.utils.conditional import (
+    get_stw_range,
+    make_collocations_etag,
+    register_conditional_get,
+)
+from odinapi.utils.data_version import DataVersion
+from odinapi.utils.time_util import datetime2stw
+
+
+@pytest.fixture
+def calls():
+    return []
+
+
+@pytest.fixture
+def client(calls, data_version):
+    blueprint = Blueprint("test", __name__)
+
+    @blueprint.route("/scan/<int:scanno>/")
+    def scan(scanno):
+        calls.append(scanno)
+        if scanno == 0:
+            abort(404)
+        return {"ScanID": scanno}
+
+    @blueprint.route("/day/<date>/")
+    def day(date):
+        return {"Date": date}
+
+    def vds():
+        calls.append("vds")
+        return Response(iter(["[", "]"]), mimetype="application/json")
+
+    @blueprint.route("/external/")
+    def external():
+        calls.append("external")
+        return {"Data": [1, 2]}
+
+    @blueprint.route("/stream/")
+    def stream():
+        return Response(iter(["[", "]"]), mimetype="application/json")
+
+    register_conditional_get(blueprint, ["scan", "day"])
+    vds_blueprint = Blueprint("vds", __name__)
+    vds_blueprint.add_url_rule("/vds/", view_func=vds)
+    register_conditional_get(vds_blueprint, ["vds"], make_collocations_etag)
+    app = Flask(__name__)
+    app.register_blueprint(blueprint)
+    app.register_blueprint(vds_blueprint)
+    return app.test_client()
+
+
+class TestVersionedViews:
+    def test_match_is_answered_before_the_view(self, client, calls):
+        resp = client.get("/scan/1/")
+        assert resp.status_code == OK
+        etag, weak = resp.get_etag()
+        assert etag and not weak
+        resp = client.get("/scan/1/", headers={"If-None-Match": f'"{etag}"'})
+        assert resp.status_code == NOT_MODIFIED
+        assert resp.get_etag()[0] == etag
+        assert "Accept" in resp.vary
+        assert calls == [1]
+
+    def test_etag_depends_on_url_and_accept(self, client):
+        etag = client.get("/scan/1/").get_etag()[0]
+        assert client.get("/scan/2/").get_etag()[0] != etag
+        resp = client.get("/scan/1/", headers={"Accept": "application/x-npz"})
+        assert resp.get_etag()[0] != etag
+        assert "Accept" in resp.vary
+
+    def test_etag_only_changes_with_imports_of_the_scan(
+        self, client, data_version, mocker
+    ):
+        etag1 = client.get("/scan/1/").get_etag()[0]
+        etag2 = client.get("/scan/100000000/").get_etag()[0]
+        mocker.patch.object(
+            conditional,
+            "get_latest_import",
+            side_effect=lambda stw1, stw2: (
+                datetime(2020, 1, 3) if stw1 > 1000 else data_version.imported
+            ),
+        )
+        assert client.get("/scan/1/").get_etag()[0] == etag1
+        assert client.get("/scan/100000000/").get_etag()[0] != etag2
+
+    def test_etag_changes_when_the_scan_is_materialised(
+        self, client, data_version, mocker
+    ):
+        imported = mocker.patch.object(
+            conditional, "get_latest_import", return_value=datetime(2020, 1, 3)
+        )
+        etag = client.get("/day/2015-01-12/").get_etag()[0]
+        mocker.patch.object(
+            conditional,
+            "get_data_version",
+            return_value=DataVersion(datetime(2020, 1, 3), datetime(2020, 1, 3)),
+        )
+        etag_materialised = client.get("/day/2015-01-12/").get_etag()[0]
+        assert etag_materialised != etag
+        mocker.patch.object(
+            conditional,
+            "get_data_version",
+            return_value=DataVersion(datetime(2020, 1, 4), datetime(2020, 1, 4)),
+        )
+        assert client.get("/day/2015-01-12/").get_etag()[0] == etag_materialised
+        stw1, stw2 = imported.call_args.args
+        assert stw1 < datetime2stw(datetime(2015, 1, 12)) < stw2
+
+    def test_etag_changes_with_data_version(self, client, calls, data_version, mocker):
+        etag = client.get("/scan/1/").get_etag()[0]
+        mocker.patch(
+            "odinapi.utils.conditional.get_data_version",
+            return_value=DataVersion(data_version.imported, data_version.imported),
+        )
+        resp = client.get("/scan/1/", headers={"If-None-Match": f'"{etag}"'})
+        assert resp.status_code == OK
+        assert calls == [1, 1]
+
+    def test_errors_get_no_etag(self, client):
+        resp = client.get("/scan/0/")
+        assert resp.status_code == NOT_FOUND
+        assert resp.get_etag() == (None, None)
+
+    def test_no_imports(self, client, mocker):
+        mocker.patch(
+            "odinapi.utils.conditional.get_data_version",
+            return_value=DataVersion(None, None),
+        )
+        resp = client.get("/scan/1/", headers={"If-None-Match": "*"})
+        assert resp.status_code == OK
+        assert resp.get_etag() == (None, None)
+
+
+class TestCollocationsViews:
+    def test_streamed_response_gets_etag(self, client, calls, mocker):
+        resp = client.get("/vds/")
+        etag = resp.get_etag()[0]
+        assert etag
+        resp = client.get("/vds/", headers={"If-None-Match": f'"{etag}"'})
+        assert resp.status_code == NOT_MODIFIED
+        assert calls == ["vds"]
+        mocker.patch.object(conditional, "get_table_version", return_value=2)
+        resp = client.get("/vds/", headers={"If-None-Match": f'"{etag}"'})
+        assert resp.status_code == OK
+
+
+def test_get_stw_range():
+    assert get_stw_range({"scanno": 10000, "freqmode": 1}) == (
+        10000 - 256,
+        10000 + 4096 + 256,
+    )
+    stw1, stw2 = get_stw_range({"date": "2015-01-12"})
+    assert stw1 < datetime2stw(datetime(2015, 1, 12))
+    assert stw2 > datetime2stw(datetime(2015, 1, 13))
+    assert get_stw_range({"date": "2015-01"}) is None
+    assert get_stw_range({"freqmode": 1}) is None
+
+
+class TestOtherViews:
+    def test_content_hash(self, client, calls):
+        etag = client.get("/external/").get_etag()[0]
+        assert etag
+        resp = client.get("/external/", headers={"If-None-Match": f'"{etag}"'})
+        assert resp.status_code == NOT_MODIFIED
+        assert calls == ["external", "external"]
+
+    def test_streamed_response_gets_no_etag(self, client):
+        resp = client.get("/stream/")
+        assert resp.status_code == OK
+        assert resp.get_etag() == (None, None)
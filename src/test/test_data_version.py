@@ -0,0 +1,83 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.exc import ProgrammingError
+
+from odinapi.utils import data_version
+from odinapi.utils.data_version import DataVersion, ImportIndex
+
+
+def imports(mocker, *files):
+    return [mocker.Mock(file=name, created=created) for name, created in files]
+
+
+@pytest.fixture
+def execute(mocker):
+    return mocker.patch.object(data_version.db.session, "execute")
+
+
+class TestImportIndex:
+    def test_latest_overlapping_import(self, execute, mocker):
+        execute.return_value = imports(
+            mocker,
+            ("/level0/ac1/01000000.ac1", datetime(2020, 1, 1)),
+            ("/level0/ac1/01000000.ac1", datetime(2020, 1, 3)),
+            ("/level0/ac1/20000000.ac1", datetime(2020, 1, 4)),
+        )
+        index = ImportIndex()
+        index.update(DataVersion(datetime(2020, 1, 4), None))
+        assert index.get(0x10000000, 0x10000100) == datetime(2020, 1, 3)
+        assert index.get(0x0FF00000, 0x0FF00100) is None
+        assert index.get(0x200000000, 0x200000100) == datetime(2020, 1, 4)
+
+    def test_unknown_files_overlap_everything(self, execute, mocker):
+        execute.return_value = imports(mocker, ("odin.log", datetime(2020, 1, 2)))
+        index = ImportIndex()
+        index.update(DataVersion(datetime(2020, 1, 2), None))
+        assert index.get(0, 1) == datetime(2020, 1, 2)
+
+    def test_only_new_imports_are_read(self, execute, mocker):
+        execute.return_value = imports(
+            mocker, ("/level0/ac1/01000000.ac1", datetime(2020, 1, 1))
+        )
+        index = ImportIndex()
+        index.update(DataVersion(datetime(2020, 1, 1), None))
+        index.update(DataVersion(datetime(2020, 1, 1), None))
+        assert execute.call_count == 1
+        execute.return_value = imports(
+            mocker, ("/level0/ac1/01000001.ac1", datetime(2020, 1, 2))
+        )
+        index.update(DataVersion(datetime(2020, 1, 2), None))
+        assert execute.call_args.kwargs["params"] == {"c": datetime(2020, 1, 1)}
+        assert index.get(0x10000000, 0x10000100) == datetime(2020, 1, 2)
+
+    def test_no_imports(self, execute):
+        index = ImportIndex()
+        index.update(DataVersion(None, None))
+        execute.assert_not_called()
+        assert index.get(0, 1) is None
+
+
+def test_data_version_expires_before_the_statistics(execute, app_context, mocker):
+    mocker.patch.object(data_version, "get_materialised", return_value=None)
+    data_version.current_app.config["DATA_VERSION_MAX_AGE"] = 0
+    execute.return_value.scalar_one.return_value = datetime(2020, 1, 1)
+    assert data_version.get_data_version().imported == datetime(2020, 1, 1)
+    execute.return_value.scalar_one.return_value = datetime(2020, 1, 2)
+    assert data_version.get_data_version().imported == datetime(2020, 1, 2)
+    assert data_version.get_cache().max_age == 300
+
+
+def test_table_version_is_cached(execute, app_context):
+    execute.return_value.scalar_one_or_none.return_value = 3
+    assert data_version.get_table_version("collocations") == 3
+    assert data_version.get_table_version("collocations") == 3
+    assert execute.call_count == 1
+    assert execute.call_args.kwargs["params"] == {"t": "collocations"}
+    execute.return_value.scalar_one_or_none.return_value = None
+    assert data_version.get_table_version("missing") is None
+
+
+def test_table_version_without_trigger(execute, app_context):
+    execute.side_effect = ProgrammingError("select", {}, Exception())
+    assert data_version.get_table_version("collocations") is None
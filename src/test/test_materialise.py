@@ -0,0 +1,181 @@
+from datetime import date, datetime
+
+import numpy as np
+import pytest
+
+from odinapi import materialise
+from odinapi.materialise import get_stw_ranges, make_scan_row
+from odinapi.utils.level0_files import LEVEL0_FILE_STW_SPAN
+
+CREATED = datetime(2020, 1, 2, 3, 4)
+
+SCAN_LOG = {
+    "ScanID": 7014769904,
+    "LatStart": np.float64(10.0),
+    "LatEnd": np.float64(12.0),
+    "LonStart": np.float64(20.0),
+    "LonEnd": np.float64(21.0),
+    "AltStart": np.float64(10000.0),
+    "AltEnd": np.float64(90000.0),
+    "MJDStart": np.float64(57000.99),
+    "MJDEnd": np.float64(57001.01),
+    "SunZD": np.float64(80.0),
+    "FreqMode": np.int64(2),
+    "NumSpec": 40,
+    "DateTime": datetime(2014, 12, 10),
+    "Quality": np.int64(0),
+}
+
+
+def test_get_stw_ranges():
+    ranges = get_stw_ranges(["10000.ac1", "10001.shk", "unknown", "90000.ac2"])
+    assert len(ranges) == 2
+    start, end = ranges[0]
+    assert start < 0x10000 << 4 and end > (0x10001 << 4) + LEVEL0_FILE_STW_SPAN
+    assert ranges[1][0] < 0x90000 << 4 < ranges[1][1]
+
+
+def test_make_scan_row():
+    row = make_scan_row("AC1", SCAN_LOG)
+    assert row["date"] == date(2014, 12, 9)
+    assert row["backend"] == "AC1"
+    assert row["freqmode"] == 2
+    assert row["scanid"] == 7014769904
+    assert type(row["latstart"]) is float
+    assert type(row["quality"]) is int
+
+
+@pytest.fixture
+def steps(mocker):
+    mocker.patch.object(materialise, "ensure_schema")
+    mocker.patch.object(materialise, "get_watermark", return_value=CREATED)
+    mocker.patch.object(materialise.db, "session")
+    return mocker
+
+
+class TestMaterialise:
+    def test_scans_are_updated_in_batches(self, steps):
+        steps.patch.object(
+            materialise,
+            "get_imported_files",
+            return_value=[("10000.ac1", CREATED), ("10000.shk", datetime(2020, 1, 3))],
+        )
+        scans = [("AC1", 2, stw) for stw in range(5)]
+        get_scans = steps.patch.object(materialise, "get_scans", return_value=scans)
+        days = {(date(2020, 1, 1), "AC1", 2)}
+        update_scans = steps.patch.object(
+            materialise, "update_scans", return_value=days
+        )
+        update_measurements = steps.patch.object(materialise, "update_measurements")
+        update_monthly = steps.patch.object(materialise, "update_monthly")
+        set_watermark = steps.patch.object(materialise, "set_watermark")
+        assert materialise.materialise(batch_size=2, workers=1) == 5
+        assert get_scans.call_count == 1
+        assert [call.args[0] for call in update_scans.call_args_list] == [
+            scans[0:2],
+            scans[2:4],
+            scans[4:5],
+        ]
+        update_measurements.assert_called_with(days)
+        update_monthly.assert_called_with(days)
+        set_watermark.assert_called_once_with(datetime(2020, 1, 3))
+
+    def test_nothing_imported(self, steps):
+        steps.patch.object(materialise, "get_imported_files", return_value=[])
+        set_watermark = steps.patch.object(materialise, "set_watermark")
+        assert materialise.materialise() == 0
+        set_watermark.assert_not_called()
+
+
+def test_recent_imports_are_left_for_the_next_run(mocker, app_context):
+    execute = mocker.patch.object(materialise.db.session, "execute")
+    execute.return_value = [mocker.Mock(file="10000.ac1", created=CREATED)]
+    assert materialise.get_imported_files(CREATED, 300) == [("10000.ac1", CREATED)]
+    assert "localtimestamp - make_interval" in str(execute.call_args.args[0])
+    assert execute.call_args.kwargs["params"] == dict(w=CREATED, s=300)
+
+
+def test_main_does_not_preload_caches(mocker):
+    mocker.patch("sys.argv", ["materialise", "--initial-days", "1", "--settle", "60"])
+    create_app = mocker.patch.object(materialise, "create_app")
+    create_app.return_value.config = {}
+    run = mocker.patch.object(materialise, "materialise", return_value=0)
+    materialise.main()
+    assert create_app.call_args.args[0].PRELOAD_CACHES is False
+    run.assert_called_once_with(100, 4, 1, 60)
+
+
+def test_update_scans(mocker, app_context):
+    mocker.patch.object(
+        materialise,
+        "get_scan_log",
+        side_effect=lambda scan: SCAN_LOG if scan[2] else {},
+    )
+    execute = mocker.patch.object(materialise.db.session, "execute")
+    execute.return_value = [mocker.Mock(date=date(2014, 12, 8))]
+    days = materialise.update_scans([("AC1", 2, 0), ("AC1", 2, 7014769904)], 2)
+    assert days == {(date(2014, 12, 8), "AC1", 2), (date(2014, 12, 9), "AC1", 2)}
+    insert = execute.call_args_list[-1]
+    assert str(insert.args[0]).startswith("insert into scans_cache")
+    assert [row["scanid"] for row in insert.args[1]] == [7014769904]
+
+
+def test_update_monthly(mocker, app_context):
+    execute = mocker.patch.object(materialise.db.session, "execute")
+    materialise.update_monthly(
+        {
+            (date(2014, 12, 8), "AC1", 2),
+            (date(2014, 12, 9), "AC2", 1),
+            (date(2015, 1, 1), "AC1", 2),
+        }
+    )
+    assert execute.call_count == 4
+    assert [call.kwargs["params"]["d1"] for call in execute.call_args_list] == [
+        date(2014, 12, 1),
+        date(2014, 12, 1),
+        date(2015, 1, 1),
+        date(2015, 1, 1),
+    ]
+    assert str(execute.call_args.args[0]).startswith("insert into measurements_monthly")
+
+
+def test_ensure_latest_imports(mocker, app_context):
+    execute = mocker.patch.object(materialise.db.session, "execute")
+    execute.return_value.scalar_one.return_value = False
+    materialise.ensure_latest_imports()
+    statements = [str(call.args[0]) for call in execute.call_args_list]
+    assert "pg_trigger" in statements[0]
+    assert statements[1].startswith("create table if not exists level0_files_latest")
+    assert any(
+        statement.startswith("create trigger level0_files_latest_update")
+        for statement in statements
+    )
+    assert statements[-1].startswith("insert into level0_files_latest")
+
+
+def test_latest_imports_are_installed_once(mocker, app_context):
+    execute = mocker.patch.object(materialise.db.session, "execute")
+    execute.return_value.scalar_one.return_value = True
+    materialise.ensure_latest_imports()
+    assert execute.call_count == 1
+
+
+def test_ensure_table_version(mocker, app_context):
+    execute = mocker.patch.object(materialise.db.session, "execute")
+    execute.return_value.scalar_one.return_value = False
+    materialise.ensure_table_version("collocations")
+    statements = [str(call.args[0]) for call in execute.call_args_list]
+    assert "pg_trigger" in statements[0]
+    assert statements[1].startswith("create table if not exists table_versions")
+    assert statements[3].startswith(
+        "create trigger table_versions_update after insert or update or delete"
+        " or truncate on collocations"
+    )
+    assert execute.call_args.kwargs["params"] == {"t": "collocations"}
+
+
+def test_table_version_is_installed_once(mocker, app_context):
+    execute = mocker.patch.object(materialise.db.session, "execute")
+    execute.return_value.scalar_one.return_value = True
+    materialise.ensure_table_version("collocations")
+    assert execute.call_count == 1
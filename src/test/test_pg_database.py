@@ -1,3 +1,6 @@
+from sqlalchemy.dialects import postgresql
+
+from odinapi import pg_database
 from odinapi.pg_database import squeeze_query
 
 
@@ -9,3 +12,19 @@ def test_squeeze_query():
     log_friendly_query = squeeze_query(query)
     assert len(log_friendly_query.splitlines()) == 1, "Query should be one line"
     assert len(log_friendly_query.split(" ")) == 5, "Query is not 5 words long"
+
+
+def test_pipelined_cursors_are_closed(mocker, app_context):
+    mocker.patch.object(pg_database.Pipeline, "is_supported", return_value=True)
+    connection = mocker.patch.object(pg_database.db.session, "connection")
+    connection.return_value.dialect = postgresql.dialect()
+    driver_connection = connection.return_value.connection.driver_connection
+    cursors = [mocker.MagicMock(), mocker.MagicMock()]
+    driver_connection.cursor.side_effect = cursors
+    for ind, cursor in enumerate(cursors):
+        cursor.__enter__.return_value = cursor
+        cursor.fetchall.return_value = [{"n": ind}]
+    rows = pg_database.execute_pipelined(["select 1", "select 2"], {})
+    assert rows == [[{"n": 0}], [{"n": 1}]]
+    for cursor in cursors:
+        cursor.__exit__.assert_called_once()
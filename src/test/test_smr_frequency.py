@@ -3,7 +3,10 @@ import numpy as np
 from odinapi.views.smr_frequency import (
     Smrl1bFreqspec,
     Smrl1bFreqsort,
+    get_bad_module_numbers,
     get_bad_ssb_modules,
+    get_frequency_layout,
+    get_sorted_frequency,
     doppler_corr,
 )
 
@@ -197,3 +200,52 @@ def test_doppler_corr(scan_data_sample, frequency_grid):
             pytest.approx(-scan_data_sample["ssb_fq"][0][0], abs=1e5),
         ]
     )
+
+
+def test_get_bad_module_numbers(scan_data_sample):
+    scan_data_sample["spectra"][3][112 * 5 : 112 * 6] = 0
+    assert get_bad_module_numbers(1, scan_data_sample["spectra"]).tolist() == [
+        1,
+        2,
+        6,
+    ]
+    assert get_bad_module_numbers(
+        1, scan_data_sample["spectra"], debug=True
+    ).tolist() == [6]
+
+
+class TestGetSortedFrequency:
+    @pytest.mark.parametrize("mode", [127, 17, 0])
+    @pytest.mark.parametrize("lofreq", [548.515e9, 540.515e9], ids=["lsb", "usb"])
+    @pytest.mark.parametrize("backend", [1, 2])
+    def test_same_as_freqspec_and_freqsort(
+        self, scan_data_sample, mode, lofreq, backend
+    ):
+        scan_data_sample["mode"][:] = mode
+        scan_data_sample["lofreq"][:] = lofreq
+        scan_data_sample["lofreq"][5] += 1e6
+        scan_data_sample["backend"][:] = backend
+        scan_data_sample["spectra"][3][112 * 5 : 112 * 6] = 0
+        spectra = scan_data_sample["spectra"]
+        bad_modules = get_bad_module_numbers(backend, spectra)
+        for ispec in range(spectra.shape[0]):
+            freqvec = Smrl1bFreqspec().get_frequency(scan_data_sample, ispec)
+            expected = Smrl1bFreqsort().get_sorted_ac_spectrum(
+                freqvec.flatten(),
+                spectra[ispec],
+                get_bad_ssb_modules(backend, spectra, freqvec),
+            )
+            freqvec, layout = get_sorted_frequency(scan_data_sample, ispec, bad_modules)
+            np.testing.assert_array_equal(freqvec, expected[0])
+            np.testing.assert_array_equal(spectra[ispec, layout.index], expected[1])
+            assert list(layout.ssb) == expected[2]
+            np.testing.assert_array_equal(layout.channels_id, expected[3])
+
+    def test_layout_is_shared(self, scan_data_sample):
+        get_frequency_layout.cache_clear()
+        bad_modules = get_bad_module_numbers(1, scan_data_sample["spectra"])
+        _, layout = get_sorted_frequency(scan_data_sample, 0, bad_modules)
+        _, layout2 = get_sorted_frequency(scan_data_sample, 1, bad_modules)
+        assert layout2 is layout
+        assert get_frequency_layout.cache_info().misses == 1
+        assert not layout.index.flags.writeable
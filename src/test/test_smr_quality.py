@@ -1,6 +1,6 @@
 import pytest
 import numpy as np
-from odinapi.views.smr_quality import QualityControl
+from odinapi.views.smr_quality import EARTH1, MOON1, SUN1, QualityControl
 
 
 @pytest.fixture
@@ -136,3 +136,104 @@ class TestQualityControl:
         quality_control.specdata["skybeamhit"][5] = 0x0200
         quality_control.check_moon_in_mainbeam()
         assert quality_control.quality[0::5].tolist() == [0, 0x0200]
+
+
+class LoopQualityControl(QualityControl):
+    """the reference lookups as they were done spectrum by spectrum"""
+
+    def check_obs_sequence(self):
+        qual = 0x0080
+        for ind, stw in enumerate(self.specdata["stw"]):
+            if ind < 2:
+                continue
+            ind1 = np.atleast_1d(self.refdata["stw"] < stw).nonzero()[0]
+            ind2 = np.atleast_1d(self.refdata["stw"] > stw).nonzero()[0]
+            if ind1.shape[0] < 2 or ind2.shape[0] == 0:
+                self.quality[ind] = self.quality[ind] + qual
+                continue
+            if (
+                self.refdata["mech_type"][ind1[-2]] != "SK1"
+                or self.refdata["mech_type"][ind1[-1]] != "SK1"
+                or self.refdata["mech_type"][ind2[0]] != "SK1"
+            ):
+                self.quality[ind] = self.quality[ind] + qual
+                continue
+            for refind in (ind1[-1], ind2[0]):
+                hit = self.refdata["skybeamhit"][refind]
+                if hit & EARTH1 == EARTH1 or hit & MOON1 == MOON1 or hit & SUN1 == SUN1:
+                    self.quality[ind] = self.quality[ind] + qual
+                    break
+
+    def check_ref_inttime(self):
+        qual = 0x0100
+        for ind, stw in enumerate(self.specdata["stw"]):
+            if ind < 2:
+                continue
+            ind1 = np.nonzero((self.refdata["stw"] < stw))[0]
+            ind2 = np.nonzero((self.refdata["stw"] > stw))[0]
+            if ind1.shape[0] == 0 or ind2.shape[0] == 0:
+                self.quality[ind] = self.quality[ind] + qual
+                continue
+            if (
+                np.abs(
+                    self.refdata["inttime"][ind1[-1]] - self.refdata["inttime"][ind2[0]]
+                )
+                > 0.2
+            ):
+                self.quality[ind] = self.quality[ind] + qual
+
+    def get_zerolagvar(self):
+        ones = np.array(np.ones(8) * -1).tolist()
+        for ind, stw in enumerate(self.specdata["stw"]):
+            if ind < 2:
+                self.zerolagvar.append(ones)
+                continue
+            ind1 = np.nonzero((self.refdata["stw"] < stw))[0]
+            ind2 = np.nonzero((self.refdata["stw"] > stw))[0]
+            if ind1.shape[0] == 0 or ind2.shape[0] == 0:
+                self.zerolagvar.append(ones)
+                continue
+            zero1 = np.array(self.refdata["cc"][ind1[-1]])
+            zero2 = np.array(self.refdata["cc"][ind2[0]])
+            gaindiff = np.abs(zero1 - zero2)
+            gain = np.array((zero1 + zero2) / 2.0)
+            frac = np.array(ones)
+            index = np.nonzero((gain > 0))[0]
+            frac[index] = gaindiff[index] / gain[index] * 100.0
+            self.zerolagvar.append(np.around(frac, decimals=4).tolist())
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_reference_lookups_match_loop_implementation(seed):
+    rng = np.random.default_rng(seed)
+    nspec = rng.integers(3, 40)
+    nref = rng.integers(0, 30)
+    refstw = np.sort(rng.choice(np.arange(0, 3000, 8), nref, replace=False))
+    refdata = {
+        "stw": refstw,
+        "inttime": rng.choice([0.85, 1.85, 1.86, 3.85], nref),
+        "sig_type": rng.choice(["REF", "REF", "REF", "SIG"], nref),
+        "mech_type": rng.choice(["SK1", "SK1", "SK1", "SK2", "CAL"], nref),
+        "skybeamhit": rng.choice([0, 0, 0, EARTH1, MOON1, SUN1, 0x0010], nref),
+        "cc": rng.choice([-0.5, 0.0, 0.3, 1.0, 2.5], (nref, 8)),
+    }
+    specdata = {
+        # some spectra share stw with references
+        "stw": np.concatenate(
+            [rng.choice(refstw, min(3, nref)), rng.integers(0, 3000, nspec)]
+        ),
+    }
+    specdata["quality"] = np.zeros(specdata["stw"].shape[0], dtype=int)
+
+    results = []
+    for cls in (QualityControl, LoopQualityControl):
+        control = cls(
+            {key: value.copy() for key, value in specdata.items()},
+            {key: value.copy() for key, value in refdata.items()},
+        )
+        control.check_obs_sequence()
+        control.filter_references()
+        control.check_ref_inttime()
+        control.get_zerolagvar()
+        results.append((control.quality.tolist(), control.zerolagvar))
+    assert results[0] == results[1]
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+from flask_sqlalchemy import SQLAlchemy
+
+from odinapi.api import create_app
+from odinapi.odin_config import TestConfig
+from odinapi.views import calibration_cache
+from odinapi.views import level1b_scandata_exporter_v2 as exporter
+from odinapi.views import read_apriori, scan_index
+from odinapi.views.calibration_cache import MedianFitCache, as_tuple, make_key
+from odinapi.views.level1b_scandata_exporter_v2 import CalibrationStep2
+from odinapi.views.read_apriori import AprioriStore
+from odinapi.views.scan_index import ScanIndex
+
+SSB_FQ = [3900, 4100, 3700, 4300]
+
+
+def fit_row(mocker, hotload_range, value, channels=4):
+    return mocker.Mock(
+        freqmode=2,
+        version=8,
+        intmode=511,
+        ssb_fq=SSB_FQ,
+        altitude_range=[80000, 120000],
+        hotload_range=hotload_range,
+        median_fit=np.full(channels, value, dtype="float64").tobytes(),
+        channels=channels,
+    )
+
+
+@pytest.fixture
+def cache(mocker):
+    cache = MedianFitCache()
+    mocker.patch.object(calibration_cache, "_median_fit_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def execute(mocker):
+    execute = mocker.patch.object(calibration_cache.db.session, "execute")
+    execute.return_value = [
+        fit_row(mocker, [285, 286], 1.0),
+        fit_row(mocker, [285, 286], 5.0),
+        fit_row(mocker, [286, 287], 2.0),
+    ]
+    return execute
+
+
+def test_as_tuple():
+    assert as_tuple("{80000, 120000}") == as_tuple([80000, 120000])
+    assert as_tuple(repr(SSB_FQ).translate(str.maketrans("[]", "{}"))) == (
+        3900.0,
+        4100.0,
+        3700.0,
+        4300.0,
+    )
+    assert as_tuple(None) is None
+
+
+class TestMedianFitCache:
+    def test_table_is_read_once(self, cache, execute):
+        key = make_key(2, 8, 511, SSB_FQ, "{80000, 120000}", "{285,286}")
+        assert cache.get(key).tolist() == [1.0] * 4
+        assert cache.get(make_key(2, 8, 511, SSB_FQ, None, "{285,286}")) is None
+        assert execute.call_count == 1
+
+    def test_table_is_read_again_when_old(self, cache, execute):
+        cache.max_age = 0
+        key = make_key(2, 8, 511, SSB_FQ, "{80000, 120000}", "{286,287}")
+        cache.get(key)
+        cache.get(key)
+        assert execute.call_count == 2
+
+
+class TestCalibrationStep2:
+    def test_fits_are_looked_up_once_per_key(self, cache, execute, mocker, db_context):
+        get_median_fit = mocker.spy(exporter, "get_median_fit")
+        calgr = CalibrationStep2(2, 8)
+        calgr.get_db_data(511, SSB_FQ, 285.7)
+        np.testing.assert_allclose(calgr.spec["spectrum"], [1.0] * 4)
+        calgr.get_db_data(511, list(SSB_FQ), 285.2)
+        assert get_median_fit.call_count == 2
+        calgr.get_db_data(511, SSB_FQ, 286.5)
+        np.testing.assert_allclose(calgr.spec["spectrum"], [2.0] * 4)
+        assert get_median_fit.call_count == 4
+        assert execute.call_count == 1
+
+
+@pytest.mark.parametrize("fails", [False, True], ids=["ok", "median fits fail"])
+def test_preload_caches(mocker, fails):
+    load = mocker.patch.object(
+        MedianFitCache, "load", side_effect=OSError if fails else None
+    )
+    load_index = mocker.patch.object(ScanIndex, "load")
+    preload_apriori = mocker.patch.object(AprioriStore, "preload")
+    mocker.patch.object(read_apriori, "_apriori_store", None)
+    mocker.patch.object(scan_index, "_scan_index", None)
+    engine = mocker.patch.object(SQLAlchemy, "engine", new_callable=mocker.PropertyMock)
+    mocker.patch.object(calibration_cache, "_median_fit_cache", None)
+
+    class PreloadConfig(TestConfig):
+        PRELOAD_CACHES = True
+
+    create_app(PreloadConfig())
+    load.assert_called_once_with()
+    load_index.assert_called_once_with()
+    preload_apriori.assert_called_once_with()
+    engine.return_value.dispose.assert_called_once_with()
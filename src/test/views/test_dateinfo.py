@@ -3,7 +3,10 @@
 from http.client import OK
 from unittest.mock import MagicMock, patch
 
+import pytest
 
+
+@pytest.mark.usefixtures("data_version")
 class TestDateInfo:
     """Test DateInfo view that uses BaseView"""
 
@@ -67,6 +70,7 @@ class TestDateInfo:
         assert resp.status_code == 404
 
 
+@pytest.mark.usefixtures("data_version")
 class TestDateBackendInfo:
     """Test DateBackendInfo view that uses BaseView"""
 
@@ -0,0 +1,138 @@
+import io
+import json
+from http.client import BAD_REQUEST, OK
+from unittest.mock import patch
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from odinapi.views.l1b_formats import scan2arrays_v4, stack_spectra
+
+NSPEC = 4
+CHANNELS = 6
+
+
+def make_spectra():
+    spectra = {
+        item: np.arange(NSPEC, dtype=float) + 0.5
+        for item in [
+            "mjd",
+            "orbit",
+            "ra2000",
+            "dec2000",
+            "longitude",
+            "latitude",
+            "altitude",
+            "sunzd",
+            "vgeo",
+            "hotloada",
+            "tsys",
+            "sbpath",
+            "freqres",
+            "inttime",
+            "efftime",
+            "tspill",
+        ]
+    }
+    spectra.update(
+        {
+            item: np.arange(NSPEC)
+            for item in [
+                "version",
+                "quality",
+                "stw",
+                "frontend",
+                "backend",
+                "soda",
+                "freqmode",
+                "calstw",
+            ]
+        }
+    )
+    spectra.update(
+        {
+            item: np.ones((NSPEC, 3))
+            for item in ["gpspos", "gpsvel", "sunpos", "moonpos"]
+        }
+    )
+    spectra["ssb_fq"] = np.ones((NSPEC, 4))
+    spectra["channels"] = [CHANNELS] * NSPEC
+    spectra["spectrum"] = [
+        np.round(np.linspace(0, 1, CHANNELS) * ind, 3) for ind in range(NSPEC)
+    ]
+    spectra["zerolagvar"] = [[-1.0] * 8] * NSPEC
+    spectra["frequency"] = {
+        "IFreqGrid": np.linspace(-1e9, 1e9, CHANNELS).tolist(),
+        "LOFreq": [5e11, 5.1e11],
+        "SubBandIndex": [np.arange(8), np.arange(8) + 10],
+        "ChannelsID": list(range(1, CHANNELS + 1)),
+        "AppliedDopplerCorr": [1e6, 2e6],
+    }
+    return spectra
+
+
+def test_stack_spectra_pads_with_nan():
+    stacked = stack_spectra([[1.0, 2.0], [3.0]])
+    np.testing.assert_array_equal(stacked, [[1.0, 2.0], [3.0, np.nan]])
+
+
+def test_scan2arrays():
+    rows, scan = scan2arrays_v4(make_spectra())
+    assert rows["Spectrum"].shape == (NSPEC - 2, CHANNELS)
+    assert rows["Spectrum"].flags.c_contiguous
+    assert rows["GPSpos"].shape == (NSPEC - 2, 3)
+    assert rows["LOFreq"].tolist() == [5e11, 5.1e11]
+    assert scan["TrecSpectrum"].shape == (CHANNELS,)
+    assert scan["SubBandIndex"].shape == (2, 8)
+    assert all(values.shape[0] == NSPEC - 2 for values in rows.values())
+
+
+@pytest.fixture
+def scan_data():
+    with patch(
+        "odinapi.views.views.get_scan_data_cached", return_value=make_spectra()
+    ) as get_scan_data:
+        yield get_scan_data
+
+
+@pytest.mark.usefixtures("data_version")
+class TestL1bFormats:
+    URL = "/rest_api/v5/level1/2/7123991206/L1b/"
+
+    def test_json_is_default(self, scan_data, test_client):
+        resp = test_client.get(self.URL)
+        assert resp.status_code == OK
+        assert resp.mimetype == "application/json"
+        assert resp.json["Data"]["Spectrum"] == [
+            spectrum.tolist() for spectrum in make_spectra()["spectrum"][2:]
+        ]
+        assert "Accept" in resp.vary
+
+    def test_npz_by_accept_header(self, scan_data, test_client):
+        resp = test_client.get(self.URL, headers={"Accept": "application/x-npz"})
+        assert resp.status_code == OK
+        assert resp.mimetype == "application/x-npz"
+        data = np.load(io.BytesIO(resp.data))
+        np.testing.assert_array_equal(
+            data["Spectrum"], np.array(make_spectra()["spectrum"][2:])
+        )
+        assert data["ScanID"].tolist() == [2, 3]
+        assert data["IFreqGrid"].shape == (CHANNELS,)
+
+    def test_arrow_by_format_argument(self, scan_data, test_client):
+        resp = test_client.get(self.URL + "?format=arrow")
+        assert resp.status_code == OK
+        assert resp.mimetype == "application/vnd.apache.arrow.stream"
+        table = pa.ipc.open_stream(resp.data).read_all()
+        assert table.num_rows == NSPEC - 2
+        spectrum = np.array(table.column("Spectrum").to_pylist())
+        np.testing.assert_array_equal(
+            spectrum, np.array(make_spectra()["spectrum"][2:])
+        )
+        metadata = table.schema.metadata
+        assert json.loads(metadata[b"ChannelsID"]) == list(range(1, CHANNELS + 1))
+
+    def test_unknown_format_is_bad_request(self, scan_data, test_client):
+        resp = test_client.get(self.URL + "?format=xml")
+        assert resp.status_code == BAD_REQUEST
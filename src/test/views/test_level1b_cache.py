@@ -0,0 +1,158 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from odinapi.utils import data_version
+from odinapi.utils.data_version import DataVersion, ImportIndex
+from odinapi.views import level1b_cache
+from odinapi.views.level1b_cache import (
+    Level1bCache,
+    get_scan_data_cached,
+    iter_scan_data_cached,
+)
+
+SCANID = 0x10000000
+SPECTRA = {"stw": np.array([SCANID, SCANID + 0x100]), "spectrum": [[1.0, 2.0]]}
+
+
+@pytest.fixture
+def cache(tmp_path, mocker):
+    cache = Level1bCache(maxsize=2, cache_dir=str(tmp_path))
+    mocker.patch.object(level1b_cache, "_level1b_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def get_scan_data(mocker):
+    return mocker.patch.object(level1b_cache, "get_scan_data_v2", return_value=SPECTRA)
+
+
+def imported_files(mocker, *files):
+    mocker.patch.object(data_version, "_import_index", ImportIndex())
+    mocker.patch.object(
+        data_version,
+        "get_data_version",
+        return_value=DataVersion(datetime(2020, 1, 2) if files else None, None),
+    )
+    execute = mocker.patch.object(data_version.db.session, "execute")
+    execute.return_value = [
+        mocker.Mock(file=name, created=datetime(2020, 1, 2)) for name in files
+    ]
+    return execute
+
+
+class TestLevel1bCache:
+    def test_disk_round_trip(self, tmp_path):
+        key = Level1bCache.make_key("AC1", 2, 42)
+        cache = Level1bCache(maxsize=1, cache_dir=str(tmp_path))
+        cache.put(
+            {
+                "key": key,
+                "imported": datetime(2020, 1, 1),
+                "spectra": {"stw": [1, 2]},
+            }
+        )
+        other_process = Level1bCache(maxsize=1, cache_dir=str(tmp_path))
+        entry = other_process.get(key)
+        assert entry is not None
+        assert entry["spectra"] == {"stw": [1, 2]}
+        other_process.discard(key)
+        assert Level1bCache(maxsize=1, cache_dir=str(tmp_path)).get(key) is None
+
+    def test_key_includes_processing_version(self):
+        key = Level1bCache.make_key("AC1", "2", "42")
+        assert key[:3] == ("AC1", 2, 42)
+        assert key[3] == level1b_cache.L1B_PROCESSING_VERSION
+
+
+class TestGetScanDataCached:
+    def test_scan_is_computed_once(self, cache, get_scan_data, mocker, db_context):
+        imported_files(mocker)
+        assert get_scan_data_cached("AC1", 2, SCANID) is SPECTRA
+        assert get_scan_data_cached("AC1", 2, SCANID) is SPECTRA
+        assert get_scan_data.call_count == 1
+
+    def test_unrelated_import_keeps_entry(
+        self, cache, get_scan_data, mocker, db_context
+    ):
+        imported_files(mocker)
+        get_scan_data_cached("AC1", 2, SCANID)
+        imported_files(mocker, "/level0/ac1/20000000.ac1")
+        get_scan_data_cached("AC1", 2, SCANID)
+        assert get_scan_data.call_count == 1
+
+    def test_overlapping_import_invalidates_entry(
+        self, cache, get_scan_data, mocker, db_context
+    ):
+        imported_files(mocker)
+        get_scan_data_cached("AC1", 2, SCANID)
+        imported_files(mocker, "/level0/ac1/01000000.ac1")
+        get_scan_data_cached("AC1", 2, SCANID)
+        assert get_scan_data.call_count == 2
+
+    def test_entry_of_an_earlier_import_is_replaced(
+        self, cache, get_scan_data, mocker, db_context
+    ):
+        imported_files(mocker, "/level0/ac1/01000000.ac1")
+        get_scan_data_cached("AC1", 2, SCANID)
+        key = cache.make_key("AC1", 2, SCANID)
+        assert cache.get(key)["imported"] == datetime(2020, 1, 2)
+        cache.memory.put(key, dict(cache.get(key), imported=datetime(2020, 1, 1)))
+        get_scan_data_cached("AC1", 2, SCANID)
+        assert get_scan_data.call_count == 2
+        assert cache.get(key)["imported"] == datetime(2020, 1, 2)
+
+    def test_imports_are_read_once(self, cache, get_scan_data, mocker, db_context):
+        imported_files(mocker)
+        get_scan_data_cached("AC1", 2, SCANID)
+        execute = imported_files(mocker, "/level0/ac1/20000000.ac1")
+        get_scan_data_cached("AC1", 2, SCANID)
+        get_scan_data_cached("AC1", 2, SCANID)
+        assert execute.call_count == 1
+        assert get_scan_data.call_count == 1
+
+    def test_missing_scan_is_not_cached(self, cache, get_scan_data, mocker, db_context):
+        imported_files(mocker)
+        get_scan_data.return_value = {}
+        assert get_scan_data_cached("AC1", 2, SCANID) == {}
+        assert len(cache.memory) == 0
+
+    def test_debug_bypasses_cache(self, cache, get_scan_data, db_context):
+        get_scan_data_cached("AC1", 2, SCANID, debug=True)
+        get_scan_data_cached("AC1", 2, SCANID, debug=True)
+        assert get_scan_data.call_count == 2
+        assert len(cache.memory) == 0
+
+
+class TestIterScanDataCached:
+    @pytest.fixture
+    def get_scans_data(self, mocker):
+        return mocker.patch.object(
+            level1b_cache,
+            "get_scans_data_v2",
+            side_effect=lambda backend, freqmode, scanids, calibrations: {
+                scanid: SPECTRA if scanid != 44 else {} for scanid in scanids
+            },
+        )
+
+    def test_cached_scans_are_not_read(
+        self, cache, get_scan_data, get_scans_data, mocker, db_context
+    ):
+        imported_files(mocker)
+        get_scan_data_cached("AC1", 2, 42)
+        scans = list(iter_scan_data_cached("AC1", 2, [44, 43, 42], chunk_size=10))
+        assert scans == [(42, SPECTRA), (43, SPECTRA), (44, {})]
+        get_scans_data.assert_called_once_with("AC1", 2, [43, 44], {})
+
+    def test_calibrations_are_shared_between_chunks(
+        self, cache, get_scans_data, mocker, db_context
+    ):
+        imported_files(mocker)
+        list(iter_scan_data_cached("AC1", 2, [1, 2, 3], chunk_size=2))
+        assert [call.args[2] for call in get_scans_data.call_args_list] == [
+            [1, 2],
+            [3],
+        ]
+        first, second = get_scans_data.call_args_list
+        assert first.args[3] is second.args[3]
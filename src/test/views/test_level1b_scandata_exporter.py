@@ -0,0 +1,534 @@
+import numpy as np
+import pytest
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import psycopg
+
+from odinapi.views import level1b_scandata_exporter_v2 as exporter
+from odinapi.views.level1b_scandata_exporter_v2 import (
+    CALIBRATION_QUERIES,
+    CALIBRATION_RANGE_QUERIES,
+    REFERENCE_QUERY,
+    SCAN_REFERENCE_QUERY,
+    TARGET_QUERY,
+    TARGET_RANGE_QUERY,
+    ScandataExporter,
+    backend_char2int,
+    choose_nonzero,
+    chunk_scanids,
+    frontend_char2int,
+    get_db_data_range,
+    specdict,
+)
+
+CALSTW = 1000
+TARGETS = [
+    {"stw": 1010, "calstw": CALSTW, "tsys": 200.0},
+    {"stw": 1020, "calstw": CALSTW, "tsys": 210.0},
+]
+CALIBRATIONS = [
+    {"stw": CALSTW, "spectype": "CAL", "tspill": 9.0},
+    {"stw": CALSTW, "spectype": "SSB", "tspill": 9.0},
+]
+REFERENCES = [{"stw": 990, "sig_type": "REF"}]
+
+
+def rows_for(query, params):
+    if query == TARGET_QUERY:
+        return TARGETS
+    if query == CALIBRATION_QUERIES[-1]:
+        return CALIBRATIONS
+    if query in CALIBRATION_QUERIES:
+        return []
+    if query in (REFERENCE_QUERY, SCAN_REFERENCE_QUERY):
+        return REFERENCES
+    raise AssertionError(query)
+
+
+def compile_query(query):
+    return text(query).compile(dialect=psycopg.dialect())
+
+
+class TestGetDbData:
+    def test_pipelined_matches_sequential(self, mocker):
+        mocker.patch.object(exporter, "execute_rows", side_effect=rows_for)
+        mocker.patch.object(
+            exporter,
+            "execute_pipelined",
+            side_effect=lambda queries, params: [
+                rows_for(query, params) for query in queries
+            ],
+        )
+        scan = ScandataExporter("AC1")
+        assert scan.get_db_data_sequential(2, CALSTW) == 1
+        pipelined = ScandataExporter("AC1")
+        assert pipelined.get_db_data_pipelined(2, CALSTW) == 1
+        assert pipelined.specdata == scan.specdata
+        assert pipelined.scaninfo == scan.scaninfo
+        assert pipelined.refdata == scan.refdata
+        assert pipelined.specdata == [CALIBRATIONS[0], CALIBRATIONS[1], *TARGETS]
+        assert pipelined.scaninfo == [CALSTW] * 4
+
+    def test_pipelined_sends_all_queries_at_once(self, mocker):
+        execute = mocker.patch.object(
+            exporter, "execute_pipelined", return_value=[[], [], [], [], []]
+        )
+        assert ScandataExporter("AC2").get_db_data_pipelined(2, CALSTW) == 0
+        execute.assert_called_once_with(
+            [TARGET_QUERY, *CALIBRATION_QUERIES, SCAN_REFERENCE_QUERY],
+            dict(b="AC2", c=CALSTW, f=2, so=0),
+        )
+
+    def test_not_pipelined(self, mocker, app_context):
+        execute = mocker.patch.object(exporter, "execute_rows", side_effect=rows_for)
+        mocker.patch.object(exporter, "process_scan_data", return_value={"x": 1})
+        exporter.current_app.config["L1B_PIPELINED_FETCH"] = False
+        assert exporter.get_scan_data_v2("AC1", 2, CALSTW) == {"x": 1}
+        assert execute.call_args_list[-1].args == (
+            SCAN_REFERENCE_QUERY,
+            dict(b="AC1", c=CALSTW, f=2, so=-1),
+        )
+
+    @pytest.mark.parametrize(
+        "query,expected",
+        [
+            (TARGET_QUERY, {"b", "c", "f"}),
+            (CALIBRATION_QUERIES[0], {"b", "c", "f"}),
+            (REFERENCE_QUERY, {"s1", "s2", "so"}),
+            (SCAN_REFERENCE_QUERY, {"b", "c", "f", "so"}),
+        ],
+        ids=["target", "calibration", "reference", "scan_reference"],
+    )
+    def test_query_parameters(self, query, expected):
+        assert set(compile_query(query).params) == expected
+
+    def test_pipelined_parameters(self):
+        """each pipelined query only gets the parameters it refers to"""
+        compiled = compile_query(TARGET_QUERY)
+        params = compiled.construct_params(dict(b="AC1", c=CALSTW, f=2, so=-1))
+        assert params == dict(b="AC1", c=CALSTW, f=2)
+        assert "%(c)s" in compiled.string
+
+
+class TestGetDbDataRange:
+    def test_scans_are_split(self, mocker):
+        calstw2 = 5000
+        targets2 = [{"stw": 5010, "calstw": calstw2, "tsys": 220.0}]
+        calibrations2 = [{"stw": calstw2, "spectype": "CAL", "tspill": 8.0}]
+        references = [
+            {"stw": 700, "sig_type": "REF"},
+            *REFERENCES,
+            {"stw": 4900, "sig_type": "REF"},
+        ]
+
+        def range_rows(query, params):
+            if query == TARGET_RANGE_QUERY:
+                assert (params["c1"], params["c2"]) == (CALSTW, calstw2)
+                return TARGETS + targets2
+            if query == CALIBRATION_RANGE_QUERIES[0]:
+                return calibrations2
+            if query == CALIBRATION_RANGE_QUERIES[1]:
+                return CALIBRATIONS
+            if query == REFERENCE_QUERY:
+                assert (params["s1"], params["s2"]) == (1010 - 256, 5010 + 256)
+                return references
+            raise AssertionError(query)
+
+        execute = mocker.patch.object(exporter, "execute_rows", side_effect=range_rows)
+        scans = get_db_data_range("AC1", 2, [calstw2, CALSTW, 3000])
+        assert sorted(scans) == [CALSTW, calstw2]
+        assert execute.call_count == 4
+        assert scans[CALSTW].specdata == [*CALIBRATIONS, *TARGETS]
+        assert scans[CALSTW].refdata == REFERENCES
+        assert scans[calstw2].specdata == [*calibrations2, *targets2]
+        assert scans[calstw2].refdata == [{"stw": 4900, "sig_type": "REF"}]
+
+    def test_chunk_scanids(self):
+        assert list(chunk_scanids([1, 2, 3, 100], 2, max_stw=10)) == [
+            [1, 2],
+            [3],
+            [100],
+        ]
+
+    def test_processing_errors_are_raised(self, mocker):
+        mocker.patch.object(exporter, "get_db_data_range", return_value={1: object()})
+        mocker.patch.object(exporter, "process_scan_data", side_effect=ValueError)
+        with pytest.raises(ValueError):
+            exporter.get_scans_data_v2("AC1", 2, [1])
+
+
+def make_row(stw, spectype=None, channels=896, ac0_frontend="495", mjd=58000.5):
+    row = {
+        "stw": stw,
+        "orbit": 1000.0,
+        "lst": 12.0,
+        "intmode": 511,
+        "mode": 1,
+        "channels": channels,
+        "skyfreq": 501e9,
+        "lofreq": 497e9,
+        "restfreq": 501e9,
+        "maxsuppression": 0.0,
+        "sbpath": 3900.0,
+        "latitude": 10.0,
+        "longitude": 20.0,
+        "altitude": 30000.0 + stw,
+        "skybeamhit": 0,
+        "ra2000": 1.0,
+        "dec2000": 2.0,
+        "vsource": 0.0,
+        "sunzd": 80.0,
+        "vgeo": 1.0,
+        "vlsr": 0.0,
+        "inttime": 0.875,
+        "lo": 497e9,
+        "freqmode": 2,
+        "soda": 8,
+        "ac0_frontend": ac0_frontend,
+        "mjd": mjd,
+        "hotloada": 0.0,
+        "hotloadb": 285.0,
+        "imageloada": 290.0,
+        "imageloadb": 0.0,
+        "qtarget": [0.1, 0.2, 0.3, 0.4],
+        "qachieved": [0.1, 0.2, 0.3, 0.4],
+        "qerror": [0.0, 0.0, 0.0],
+        "gpspos": [1.0, 2.0, 3.0],
+        "gpsvel": [4.0, 5.0, 6.0],
+        "sunpos": [7.0, 8.0, 9.0],
+        "moonpos": [1.0, 1.0, 1.0],
+        "ssb_fq": [3900, 4100, 3700, 4300],
+        "backend": "AC1",
+        "frontend": "495",
+        "spectra": np.arange(channels, dtype="float64").tobytes() + stw.to_bytes(8),
+        "sourcemode": "STRAT",
+    }
+    if spectype is None:
+        row.update(tsys=300.0 + stw, efftime=0.5, calstw=CALSTW)
+    else:
+        row.update(tspill=float(stw), spectype=spectype)
+    return row
+
+
+def decode_specdata_loop(scan):
+    """the original row by row decoding, converted to arrays"""
+    spectra = specdict()
+    for ind, res in enumerate(scan.specdata):
+        spec = specdict()
+        spec["calstw"] = scan.calstw
+        for item in exporter.SPECTRUM_COLUMNS:
+            spec[item] = res[item]
+        spec["mjd"] = scan.get_mjd(res)
+        spec["hotloada"] = choose_nonzero(res["hotloada"], res["hotloadb"])
+        spec["imageloada"] = choose_nonzero(res["imageloada"], res["imageloadb"])
+        for item in exporter.POSITION_COLUMNS:
+            spec[item] = np.array(res[item]).astype(float).tolist()
+        spec["ssb_fq"] = np.array(res["ssb_fq"]).astype(float) * 1e6
+        spec["backend"] = backend_char2int(res["backend"])
+        spec["frontend"] = frontend_char2int(res["frontend"])
+        data = np.ndarray(
+            shape=(res["channels"],), dtype="float64", buffer=res["spectra"]
+        )
+        try:
+            if res["ac0_frontend"] == "SPL" and res["spectype"] == "SSB":
+                data = data[0:448]
+        except KeyError:
+            pass
+        spec["spectrum"] = data
+        try:
+            spec["tsys"] = res["tsys"]
+            spec["efftime"] = res["efftime"]
+        except KeyError:
+            spec["tsys"] = 0.0
+            spec["efftime"] = 0.0
+        try:
+            spec["tspill"] = res["tspill"]
+            tspill_index = ind
+            if res["spectype"] == "CAL":
+                spec["type"] = 3
+            elif res["spectype"] == "SSB":
+                spec["type"] = 9
+        except KeyError:
+            spec["type"] = 8
+            spec["tspill"] = scan.specdata[tspill_index]["tspill"]
+        spec["sourcemode"] = exporter.decode_sourcemode(
+            res["sourcemode"], res["freqmode"]
+        )
+        spec["version"] = 8
+        spec["quality"] = 0
+        spec["discipline"] = 1
+        spec["topic"] = 1
+        spec["spectrum_index"] = ind
+        spec["obsmode"] = 2
+        spec["freqres"] = 1000000.0
+        spec["frequency"] = 0
+        for item in spec:
+            spectra[item].append(spec[item])
+    return {item: np.array(values) for item, values in spectra.items()}
+
+
+class TestDecodeSpecdata:
+    @pytest.mark.parametrize(
+        "specdata",
+        [
+            [
+                make_row(CALSTW, "CAL", mjd=None),
+                make_row(CALSTW, "SSB"),
+                make_row(1010),
+                make_row(1020),
+                make_row(1100, "CAL"),
+                make_row(1110),
+            ],
+            [
+                make_row(CALSTW, "CAL", channels=448, ac0_frontend="SPL"),
+                make_row(CALSTW, "SSB", ac0_frontend="SPL"),
+                make_row(1010, channels=448, ac0_frontend="SPL"),
+            ],
+        ],
+        ids=["normal", "split"],
+    )
+    def test_columnar_matches_row_by_row(self, specdata):
+        scan = ScandataExporter("AC1")
+        scan.calstw = CALSTW
+        scan.specdata = specdata
+        expected = decode_specdata_loop(scan)
+        scan.decode_specdata()
+        assert list(scan.spectra) == list(expected)
+        for item, values in expected.items():
+            assert scan.spectra[item].dtype == values.dtype, item
+            assert scan.spectra[item].shape == values.shape, item
+            np.testing.assert_array_equal(scan.spectra[item], values, err_msg=item)
+
+
+class TestDecodeRefdata:
+    def test_batch_matches_row_by_row(self):
+        rng = np.random.default_rng(1)
+        corrcoef = rng.uniform(-0.2, 1.2, (5, 768))
+        corrcoef[0, 0] = np.nan
+        scan = ScandataExporter("AC1")
+        scan.refdata = [
+            {
+                "backend": "AC1",
+                "frontend": "495",
+                "stw": 1000 + 16 * ind,
+                "sig_type": "REF",
+                "mech_type": "SK1",
+                "skybeamhit": 0,
+                "inttime": 1.85,
+                "cc": corrcoef[ind].tobytes(),
+            }
+            for ind in range(corrcoef.shape[0])
+        ]
+        expected = [
+            [exporter.zerolagfunc(cci, 1.0) for cci in row[0::96]] for row in corrcoef
+        ]
+        scan.decode_refdata()
+        assert list(scan.refdata) == [
+            "backend",
+            "frontend",
+            "stw",
+            "sig_type",
+            "mech_type",
+            "skybeamhit",
+            "inttime",
+            "cc",
+        ]
+        assert scan.refdata["cc"].shape == (5, 8)
+        np.testing.assert_array_equal(scan.refdata["cc"], np.array(expected))
+        assert scan.refdata["stw"].tolist() == [1000, 1016, 1032, 1048, 1064]
+
+
+def unsplit_splitmode_loop(spectra):
+    """the original spectrum by spectrum unsplitting of splitmode data"""
+    unsplit = {item: [] for item in spectra}
+    for ind, _ in enumerate(spectra["stw"]):
+        tempdata = {item: spectra[item][ind] for item in spectra}
+        spectrum = np.zeros(896)
+        if spectra["intmode"][0] == 2047:
+            spectrum[224:448] = spectra["spectrum"][ind][0:224]
+            spectrum[672:896] = spectra["spectrum"][ind][224:448]
+        else:
+            spectrum[0:224] = spectra["spectrum"][ind][0:224]
+            spectrum[448:672] = spectra["spectrum"][ind][224:448]
+        tempdata["spectrum"] = spectrum
+        tempdata["intmode"] = 511
+        for item in tempdata:
+            unsplit[item].append(tempdata[item])
+    return {item: np.array(values) for item, values in unsplit.items()}
+
+
+def unsplit_normalmode_loop(spectra):
+    """the original pair by pair unsplitting of intmode != 511 data"""
+    unsplit = {item: [] for item in spectra}
+    for stw_i in np.sort(np.unique(spectra["stw"])):
+        for spectype in [3, 9, 8]:
+            specind = np.nonzero(
+                (spectra["stw"] == stw_i) & (spectra["type"] == spectype)
+            )[0]
+            if specind.shape[0] != 2:
+                continue
+            tempdata = {item: spectra[item][specind[0]] for item in spectra}
+            freqvec = exporter.freqfunc(
+                tempdata["lofreq"], tempdata["skyfreq"], tempdata["ssb_fq"]
+            )
+            freqi = [np.mean(freqvec[ind * 224 : (ind + 1) * 224]) for ind in range(4)]
+            parts = [
+                list(np.split(spectra["spectrum"][specind[0]][0:448], 2)),
+                list(np.split(spectra["spectrum"][specind[1]][0:448], 2)),
+            ]
+            spectrum = []
+            for indi in np.argsort(np.array(freqi)):
+                if tempdata["skyfreq"] < tempdata["lofreq"]:
+                    part = parts[0] if indi >= 2 else parts[1]
+                else:
+                    part = parts[0] if indi < 2 else parts[1]
+                spectrum = np.append(spectrum, part.pop(0))
+            tempdata["spectrum"] = spectrum
+            tempdata["intmode"] = 511
+            for item in tempdata:
+                unsplit[item].append(tempdata[item])
+    return {item: np.array(values) for item, values in unsplit.items()}
+
+
+def make_unsplit_spectra(stw, spectype, lofreq, skyfreq, intmode=1023):
+    rng = np.random.default_rng(len(stw))
+    nspec = len(stw)
+    return {
+        "stw": np.array(stw),
+        "type": np.array(spectype),
+        "intmode": np.full(nspec, intmode),
+        "lofreq": np.full(nspec, lofreq),
+        "skyfreq": np.full(nspec, skyfreq),
+        "ssb_fq": np.tile([3.9e9, 4.1e9, 3.7e9, 4.3e9], (nspec, 1)),
+        "tsys": rng.uniform(100, 300, nspec),
+        "gpspos": rng.uniform(size=(nspec, 3)),
+        "spectrum": rng.uniform(size=(nspec, 448)),
+    }
+
+
+def assert_spectra_equal(spectra, expected):
+    assert list(spectra) == list(expected)
+    for item, values in expected.items():
+        assert spectra[item].dtype == values.dtype, item
+        np.testing.assert_array_equal(spectra[item], values, err_msg=item)
+
+
+class TestUnsplit:
+    @pytest.mark.parametrize("intmode", [2047, 1023])
+    def test_splitmode_matches_loop(self, intmode):
+        spectra = make_unsplit_spectra(
+            [10, 10, 20, 30], [3, 9, 8, 8], 497e9, 501e9, intmode
+        )
+        expected = unsplit_splitmode_loop(spectra)
+        scan = ScandataExporter("AC1")
+        scan.spectra = spectra
+        assert_spectra_equal(exporter.unsplit_splitmode(scan).spectra, expected)
+
+    @pytest.mark.parametrize(
+        "lofreq,skyfreq", [(497e9, 501e9), (501e9, 497e9)], ids=["upper", "lower"]
+    )
+    def test_normalmode_matches_loop(self, lofreq, skyfreq):
+        spectra = make_unsplit_spectra(
+            [30, 10, 10, 10, 10, 30, 20, 20, 20, 40, 40],
+            [8, 9, 3, 3, 9, 8, 8, 8, 8, 1, 1],
+            lofreq,
+            skyfreq,
+        )
+        expected = unsplit_normalmode_loop(spectra)
+        scan = ScandataExporter("AC1")
+        scan.spectra = spectra
+        unsplit = exporter.unsplit_normalmode(scan).spectra
+        assert unsplit["stw"].tolist() == [10, 10, 30]
+        assert unsplit["type"].tolist() == [3, 9, 8]
+        assert_spectra_equal(unsplit, expected)
+
+    def test_freqfunc_array(self):
+        ssb_fq = np.array([[3.9e9, 4.1e9, 3.7e9, 4.3e9], [3.6e9, 4.0e9, 3.8e9, 4.2e9]])
+        freqvec = exporter.freqfunc_array([497e9, 501e9], [501e9, 497e9], ssb_fq)
+        np.testing.assert_array_equal(
+            freqvec[0], exporter.freqfunc(497e9, 501e9, ssb_fq[0])
+        )
+        np.testing.assert_array_equal(
+            freqvec[1], exporter.freqfunc(501e9, 497e9, ssb_fq[1])
+        )
+
+
+def make_references(stws):
+    return [
+        {
+            "backend": "AC1",
+            "frontend": "495",
+            "stw": stw,
+            "sig_type": "REF",
+            "mech_type": "SK1",
+            "skybeamhit": 0,
+            "inttime": 1.85,
+            "cc": np.full(768, 0.5).tobytes(),
+        }
+        for stw in stws
+    ]
+
+
+class TestGetScanLogdata:
+    def make_scan(self, intmode, channels):
+        calibrations = [make_row(CALSTW, "CAL", channels=channels, mjd=None)]
+        calibrations.append(make_row(CALSTW, "SSB", channels=channels))
+        targets = [make_row(stw, channels=channels) for stw in range(1010, 1070, 10)]
+        rows = []
+        for row in calibrations + targets:
+            if intmode != 511:
+                rows.append(dict(row, intmode=intmode))
+            rows.append(row)
+        for row in rows:
+            row["inttime"] = 0.854
+            row["latitude"] += row["stw"] / 100
+        calibrations = [row for row in rows if "spectype" in row]
+        targets = [row for row in rows if "spectype" not in row]
+        return [targets, calibrations, [], [], make_references([900, 1200])]
+
+    @pytest.mark.parametrize(
+        "intmode,channels", [(511, 896), (1023, 448)], ids=["511", "unsplit"]
+    )
+    def test_same_as_full_processing(self, mocker, app_context, intmode, channels):
+        results = self.make_scan(intmode, channels)
+        execute = mocker.patch.object(
+            exporter, "execute_pipelined", return_value=results
+        )
+        mocker.patch.object(exporter, "get_median_fit", return_value=None)
+        expected = exporter.get_scan_data_v2("AC1", 2, CALSTW)
+        spectra = exporter.get_scan_logdata_v2("AC1", 2, CALSTW)
+        assert execute.call_args.args[0][0] == exporter.LOG_TARGET_QUERY
+        assert spectra["stw"].tolist() == expected["stw"].tolist()
+        for item in ["latitude", "longitude", "altitude", "mjd", "sunzd"]:
+            np.testing.assert_array_equal(spectra[item], expected[item], err_msg=item)
+        assert spectra["freqmode"][0] == expected["freqmode"][0]
+        assert spectra["quality"][0] == expected["quality"][0]
+        assert spectra["quality"][0] != 0
+
+    def test_not_pipelined(self, mocker, app_context):
+        results = self.make_scan(511, 896)
+        mocker.patch.object(exporter, "execute_pipelined", return_value=results)
+        expected = exporter.get_scan_logdata_v2("AC1", 2, CALSTW)
+        exporter.current_app.config["L1B_PIPELINED_FETCH"] = False
+        execute = mocker.patch.object(
+            exporter, "execute_rows", side_effect=[results[0], results[1], [{}]]
+        )
+        spectra = exporter.get_scan_logdata_v2("AC1", 2, CALSTW)
+        assert [call.args[0] for call in execute.call_args_list] == [
+            exporter.LOG_TARGET_QUERY,
+            exporter.LOG_CALIBRATION_QUERIES[0],
+            exporter.SCAN_HAS_REFERENCE_QUERY,
+        ]
+        assert spectra["stw"].tolist() == expected["stw"].tolist()
+        assert spectra["quality"].tolist() == expected["quality"].tolist()
+
+    def test_no_references(self, mocker, app_context):
+        results = self.make_scan(511, 896)
+        results[-1] = []
+        mocker.patch.object(exporter, "execute_pipelined", return_value=results)
+        assert exporter.get_scan_logdata_v2("AC1", 2, CALSTW) == {}
+
+    def test_suspicious_efftime_needs_spectra(self, mocker, app_context):
+        results = self.make_scan(511, 896)
+        results[0][0]["efftime"] = 10.0
+        mocker.patch.object(exporter, "execute_pipelined", return_value=results)
+        assert exporter.get_scan_logdata_v2("AC1", 2, CALSTW) is None
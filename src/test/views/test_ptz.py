@@ -1,7 +1,19 @@
+from pathlib import Path
+
 import pyarrow as pa
+import pyarrow.parquet as pq
 import pytest
+from fsspec.implementations.local import LocalFileSystem
 
-from odinapi.views.read_ptz import get_ptz, prefix_names
+from odinapi.utils.caching import TTLCache
+from odinapi.views.get_odinapi_info import get_ptz_store_status
+from odinapi.views.read_ptz import (
+    PTZStore,
+    get_ptz,
+    may_contain,
+    prefix_names,
+    split_scans,
+)
 
 
 class TestPTZ:
@@ -27,12 +39,6 @@ class TestPTZ:
         assert this_prefix == "342"
         assert prev_prefix == "341"
 
-    def test_ptz_cannot_find_data(self, mocker):
-        dataset_mock = mocker.patch("odinapi.views.read_ptz.ds.dataset")
-        dataset_mock.side_effect = FileNotFoundError
-        ptz = get_ptz("AC1", 0, 0, 0, 0)
-        assert ptz is None
-
     @pytest.fixture
     def ptz(self):
         t = pa.array([1e-3, 100 + 1e-3, 2 + 1e-4])
@@ -41,12 +47,29 @@ class TestPTZ:
         names = ["t", "z", "p"]
         return pa.Table.from_arrays([t, z, p], names=names)
 
-    def test_ptz(self, ptz, mocker):
-        table = mocker.Mock()
-        table.to_table.return_value = ptz
-        dataset = mocker.patch("odinapi.views.read_ptz.ds.dataset")
-        dataset.return_value = table
-        ptz = get_ptz("AC1", 0, 1, 2, 3)
+    @pytest.fixture
+    def store(self, tmp_path, mocker):
+        store = PTZStore(LocalFileSystem(), bucket=str(tmp_path))
+        mocker.patch("odinapi.views.read_ptz._ptz_store", store)
+        return store
+
+    def write_file(self, store, name, table, **kwargs):
+        path = Path(store.bucket, "ac1", name[:3], f"{name}.ac1.parquet")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        pq.write_table(table, path, **kwargs)
+        return str(path)
+
+    def scan_table(self, ptz, scanid):
+        return ptz.append_column("ScanID", pa.array([scanid] * ptz.num_rows))
+
+    def test_ptz_cannot_find_data(self, store):
+        ptz = get_ptz("AC1", 0, 0, 0, 0)
+        assert ptz is None
+
+    def test_ptz(self, ptz, store):
+        scanid = 0x342009EC << 4
+        self.write_file(store, "342009ec", self.scan_table(ptz, scanid))
+        ptz = get_ptz("AC1", scanid, 1, 2, 3)
         if ptz:
             assert ptz["Temperature"] == [1e-3, 100 + 1e-3, 2], "3 fractional digits"
             assert ptz["Altitude"] == [1000, 2000, 3000], "scaling from km to m"
@@ -61,15 +84,125 @@ class TestPTZ:
         else:
             assert False
 
-    @pytest.fixture
-    def empty_ptz(self):
-        obj = [{"t": [], "p": [], "z": []}]
-        return pa.Table.from_pylist(obj).filter([False])
-
-    def test_no_match(self, empty_ptz, mocker):
-        table = mocker.Mock()
-        table.to_table.return_value = empty_ptz
-        dataset = mocker.patch("odinapi.views.read_ptz.ds.dataset")
-        dataset.return_value = table
-        ptz = get_ptz("AC1", 0, 1, 2, 3)
+    def test_no_match(self, ptz, store):
+        scanid = 0x342009EC << 4
+        self.write_file(store, "342009ec", self.scan_table(ptz, scanid))
+        ptz = get_ptz("AC1", scanid + 1, 1, 2, 3)
         assert ptz is None
+
+    def test_scan_in_previous_prefix(self, ptz, store):
+        scanid = 0x34200000 << 4
+        self.write_file(store, "341fcd5c", self.scan_table(ptz, scanid))
+        self.write_file(store, "34206025", self.scan_table(ptz, scanid + 1))
+        ptz = get_ptz("AC1", scanid, 1, 2, 3)
+        assert ptz and ptz["Altitude"] == [1000, 2000, 3000]
+
+    def test_only_the_file_of_the_scan_is_read(self, ptz, store, mocker):
+        scanid = 0x342009EC << 4
+        self.write_file(store, "341fcd5c", self.scan_table(ptz, scanid - 10))
+        file = self.write_file(store, "342009ec", self.scan_table(ptz, scanid))
+        self.write_file(store, "34206025", self.scan_table(ptz, 0x34206025 << 4))
+        get_fragment = mocker.spy(store, "get_fragment")
+        assert get_ptz("AC1", scanid, 1, 2, 3)
+        get_fragment.assert_called_once_with(file)
+
+    def test_row_groups_are_filtered_on_statistics(self, ptz, store):
+        scanid = 0x342009EC << 4
+        table = pa.concat_tables(
+            [self.scan_table(ptz, scanid), self.scan_table(ptz, scanid + 1)]
+        )
+        file = self.write_file(store, "342009ec", table, row_group_size=3)
+        fragment = store.get_fragment(file)
+        assert [may_contain(rg, scanid + 1) for rg in fragment.row_groups] == [
+            False,
+            True,
+        ]
+        ptz = get_ptz("AC1", scanid + 1, 1, 2, 3)
+        assert ptz and len(ptz["Altitude"]) == 3
+
+    def test_replaced_file_metadata_is_read_again(self, ptz, store):
+        scanid = 0x342009EC << 4
+        file = self.write_file(store, "342009ec", self.scan_table(ptz, scanid))
+        assert store.get_fragment(file) is store.get_fragment(file)
+        table = pa.concat_tables([self.scan_table(ptz, scanid)] * 2)
+        self.write_file(store, "342009ec", table, row_group_size=3)
+        assert len(store.get_fragment(file).row_groups) == 1
+        store.refresh_interval = 0
+        assert len(store.get_fragment(file).row_groups) == 2
+
+    def test_scan_version_changes_with_the_file(self, ptz, store):
+        scanid = 0x342009EC << 4
+        assert store.scan_version("AC1", scanid) == []
+        file = self.write_file(store, "342009ec", self.scan_table(ptz, scanid))
+        store.refresh_interval = 0
+        [(version_file, version)] = store.scan_version("AC1", scanid)
+        assert version_file == file
+        table = pa.concat_tables([self.scan_table(ptz, scanid)] * 2)
+        self.write_file(store, "342009ec", table)
+        assert store.scan_version("AC1", scanid) != [(file, version)]
+
+    def test_listings_are_cached(self, ptz, store):
+        scanid = 0x342009EC << 4
+        assert get_ptz("AC1", scanid, 1, 2, 3) is None
+        self.write_file(store, "342009ec", self.scan_table(ptz, scanid))
+        store.missing.clear()
+        assert get_ptz("AC1", scanid, 1, 2, 3) is None
+        store.missing.clear()
+        store.refresh_interval = 0
+        assert get_ptz("AC1", scanid, 1, 2, 3)
+
+    def test_scans_are_read_once_per_file(self, ptz, store, mocker):
+        scanid = 0x342009EC << 4
+        table = pa.concat_tables([self.scan_table(ptz, scanid + n) for n in range(3)])
+        self.write_file(store, "342009ec", table)
+        get_fragment = mocker.spy(store, "get_fragment")
+        tables = split_scans(store.read_scans("AC1", [scanid, scanid + 2, scanid + 5]))
+        assert list(tables) == [scanid, scanid + 2]
+        assert tables[scanid + 2].num_rows == 3
+        assert get_fragment.call_count == 1
+
+    def test_no_scans_found(self, store):
+        assert split_scans(store.read_scans("AC1", [1, 2])) == {}
+
+    def test_found_scans_are_cached(self, ptz, store, mocker):
+        scanid = 0x342009EC << 4
+        self.write_file(store, "342009ec", self.scan_table(ptz, scanid))
+        fetch_scan = mocker.spy(store, "fetch_scan")
+        assert get_ptz("AC1", scanid, 1, 2, 3) == get_ptz("AC1", scanid, 1, 2, 3)
+        assert fetch_scan.call_count == 1
+        assert store.stats()["scans"]["hits"] == 1
+        assert store.read_scans("AC1", [scanid]).num_rows == 3
+        assert fetch_scan.call_count == 1
+
+    def test_missing_scans_are_cached(self, store, mocker):
+        find_file = mocker.spy(store, "find_file")
+        assert get_ptz("AC1", 1, 1, 2, 3) is None
+        assert get_ptz("AC1", 1, 1, 2, 3) is None
+        assert store.read_scans("AC1", [1]).num_rows == 0
+        assert find_file.call_count == 1
+        assert store.stats()["missing"] == {
+            "size": 1,
+            "maxsize": 4096,
+            "hits": 2,
+            "misses": 1,
+        }
+
+    def test_missing_scans_expire(self, store):
+        store.missing = TTLCache(max_age=0)
+        assert get_ptz("AC1", 1, 1, 2, 3) is None
+        assert len(store.missing) == 0
+
+    def test_bulk_read_scans_are_cached(self, ptz, store, mocker):
+        scanid = 0x342009EC << 4
+        self.write_file(store, "342009ec", self.scan_table(ptz, scanid))
+        store.read_scans("AC1", [scanid, scanid + 1])
+        find_file = mocker.spy(store, "find_file")
+        assert get_ptz("AC1", scanid, 1, 2, 3)
+        assert get_ptz("AC1", scanid + 1, 1, 2, 3) is None
+        find_file.assert_not_called()
+
+    def test_store_status(self, store, app_context):
+        status = get_ptz_store_status()
+        assert status["settings"]["PTZ_CACHE_SIZE"] == 4096
+        assert "PTZ_INDEX_PATH" in status["settings"]
+        assert set(status["caches"]) == {"scans", "missing", "files"}
@@ -0,0 +1,196 @@
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from fsspec.implementations.local import LocalFileSystem
+
+from odinapi.views import read_ptz
+from odinapi.views.ptz_index import PTZIndex, build_index
+from odinapi.views.read_ptz import PTZStore, get_ptz
+
+
+def make_table(scanids):
+    n = len(scanids)
+    return pa.table(
+        {
+            "ScanID": pa.array(scanids, type=pa.int64()),
+            "t": [200.0] * n,
+            "z": list(range(n)),
+            "p": [1.0] * n,
+        }
+    )
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    return tmp_path / "bucket"
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    return tmp_path / "index"
+
+
+def write_file(bucket, backend, name, table, **kwargs):
+    path = Path(bucket, backend, name[:3], f"{name}.{backend}.parquet")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(table, path, **kwargs)
+    return str(path)
+
+
+class TestBuildIndex:
+    def test_scans_are_indexed(self, bucket, index_path):
+        file1 = write_file(
+            bucket, "ac1", "342009ec", make_table([1, 1, 3, 3, 5]), row_group_size=3
+        )
+        file2 = write_file(bucket, "ac2", "342009ec", make_table([1, 4]))
+        assert build_index(LocalFileSystem(), str(bucket), index_path) == 2
+        index = PTZIndex(index_path)
+        assert index.get("AC1", 1) == [(file1, 0, 0, 2)]
+        assert index.get("AC1", 3) == [(file1, 0, 2, 3), (file1, 1, 0, 1)]
+        assert index.get("AC2", 1) == [(file2, 0, 0, 1)]
+        assert index.get("AC2", 2) == []
+
+    def test_only_new_files_are_read(self, bucket, index_path):
+        fs = LocalFileSystem()
+        file1 = write_file(bucket, "ac1", "342009ec", make_table([1, 2]))
+        file2 = write_file(bucket, "ac2", "342009ec", make_table([2, 3]))
+        build_index(fs, str(bucket), index_path)
+        file3 = write_file(bucket, "ac1", "34206025", make_table([5]))
+        assert build_index(fs, str(bucket), index_path) == 1
+        index = PTZIndex(index_path)
+        assert index.get("AC1", 2) == [(file1, 0, 1, 2)]
+        assert index.get("AC2", 2) == [(file2, 0, 0, 1)]
+        assert index.get("AC2", 3) == [(file2, 0, 1, 2)]
+        assert index.get("AC1", 5) == [(file3, 0, 0, 1)]
+
+    def test_previous_scans_file_is_kept(self, bucket, index_path):
+        fs = LocalFileSystem()
+        write_file(bucket, "ac1", "342009ec", make_table([1]))
+        build_index(fs, str(bucket), index_path)
+        first = list(index_path.glob("scans-*.npy"))
+        build_index(fs, str(bucket), index_path)
+        assert len(list(index_path.glob("scans-*.npy"))) == 2
+        build_index(fs, str(bucket), index_path)
+        scans_files = list(index_path.glob("scans-*.npy"))
+        assert len(scans_files) == 2
+        assert first[0] not in scans_files
+
+    def test_removed_files_are_dropped(self, bucket, index_path):
+        fs = LocalFileSystem()
+        file1 = write_file(bucket, "ac1", "342009ec", make_table([1]))
+        build_index(fs, str(bucket), index_path)
+        Path(file1).unlink()
+        build_index(fs, str(bucket), index_path)
+        assert PTZIndex(index_path).get("AC1", 1) == []
+
+
+class TestPTZIndex:
+    def test_missing_index(self, index_path):
+        assert PTZIndex(index_path).get("AC1", 1) == []
+
+    def test_unreadable_index_is_kept(self, bucket, index_path):
+        fs = LocalFileSystem()
+        write_file(bucket, "ac1", "342009ec", make_table([1]))
+        build_index(fs, str(bucket), index_path)
+        index = PTZIndex(index_path, max_age=0)
+        assert len(index.get("AC1", 1)) == 1
+        build_index(fs, str(bucket), index_path)
+        for scans_file in index_path.glob("scans-*.npy"):
+            scans_file.unlink()
+        assert len(index.get("AC1", 1)) == 1
+        assert index._mtime != (index_path / "index.json").stat().st_mtime
+
+    def test_index_is_reloaded(self, bucket, index_path):
+        fs = LocalFileSystem()
+        build_index(fs, str(bucket), index_path)
+        index = PTZIndex(index_path, max_age=0)
+        assert index.get("AC1", 1) == []
+        write_file(bucket, "ac1", "342009ec", make_table([1]))
+        build_index(fs, str(bucket), index_path)
+        assert len(index.get("AC1", 1)) == 1
+
+
+class TestIndexedPTZ:
+    @pytest.fixture
+    def store(self, bucket, index_path, mocker):
+        store = PTZStore(
+            LocalFileSystem(), bucket=str(bucket), index=PTZIndex(index_path)
+        )
+        mocker.patch("odinapi.views.read_ptz._ptz_store", store)
+        return store
+
+    def test_ptz_is_read_from_the_indexed_row_group(
+        self, bucket, index_path, store, mocker
+    ):
+        scanid = 0x342009EC << 4
+        write_file(
+            bucket,
+            "ac1",
+            "342009ec",
+            make_table([scanid] * 3 + [scanid + 1] * 2),
+            row_group_size=3,
+        )
+        build_index(LocalFileSystem(), str(bucket), index_path)
+        find_file = mocker.spy(store, "find_file")
+        ptz = get_ptz("AC1", scanid + 1, 1, 2, 3)
+        assert ptz and ptz["Altitude"] == [3000, 4000]
+        find_file.assert_not_called()
+
+    def test_index_miss_falls_back_to_the_files(self, bucket, index_path, store):
+        build_index(LocalFileSystem(), str(bucket), index_path)
+        scanid = 0x342009EC << 4
+        write_file(bucket, "ac1", "342009ec", make_table([scanid]))
+        ptz = get_ptz("AC1", scanid, 1, 2, 3)
+        assert ptz and ptz["Altitude"] == [0]
+
+    def test_store_without_index(self, mocker, app_context):
+        mocker.patch.object(read_ptz, "_ptz_store", None)
+        assert read_ptz.get_ptz_store().index is None
+
+    def test_stale_index_falls_back_to_the_files(self, bucket, index_path, store):
+        scanid = 0x342009EC << 4
+        write_file(bucket, "ac1", "342009ec", make_table([scanid]))
+        build_index(LocalFileSystem(), str(bucket), index_path)
+        write_file(
+            bucket,
+            "ac1",
+            "342009ec",
+            make_table([scanid - 1] * 3 + [scanid]),
+            row_group_size=3,
+        )
+        ptz = get_ptz("AC1", scanid, 1, 2, 3)
+        assert ptz and ptz["Altitude"] == [3000]
+        assert len(store.missing) == 0
+
+    def test_unreadable_index_entry_falls_back_to_the_files(
+        self, bucket, index_path, store
+    ):
+        scanid = 0x342009EC << 4
+        file = write_file(bucket, "ac1", "342009ec", make_table([scanid]))
+        build_index(LocalFileSystem(), str(bucket), index_path)
+        Path(file).unlink()
+        write_file(bucket, "ac1", "34200900", make_table([scanid, scanid + 1]))
+        ptz = get_ptz("AC1", scanid, 1, 2, 3)
+        assert ptz and ptz["Altitude"] == [0]
+        tables = read_ptz.split_scans(store.read_scans("AC1", [scanid + 1]))
+        assert list(tables) == [scanid + 1]
+
+    def test_stale_index_in_bulk_reads(self, bucket, index_path, store):
+        scanid = 0x342009EC << 4
+        write_file(bucket, "ac1", "342009ec", make_table([scanid, scanid + 1]))
+        build_index(LocalFileSystem(), str(bucket), index_path)
+        write_file(
+            bucket,
+            "ac1",
+            "342009ec",
+            make_table([scanid - 1] * 3 + [scanid, scanid + 1]),
+            row_group_size=3,
+        )
+        tables = read_ptz.split_scans(
+            store.read_scans("AC1", [scanid, scanid + 1, scanid + 2])
+        )
+        assert sorted(tables) == [scanid, scanid + 1]
+        assert store.missing.get(("AC1", scanid + 2))
+        assert not store.missing.get(("AC1", scanid))
@@ -1,3 +1,4 @@
+import io
 import os
 
 import numpy as np
@@ -128,6 +129,54 @@ def test_get_vmr_interpolated_for_doy(doy, expect, app_context):
     assert vmr.item() == expect
 
 
+class TestAprioriStore:
+    @pytest.fixture
+    def s3_fileobject(self, mocker):
+        def read(uri):
+            path = os.path.join(DATADIR, uri.rsplit("/", 1)[1])
+            if not os.path.exists(path):
+                return None
+            with open(path, "rb") as f:
+                return io.BytesIO(f.read())
+
+        return mocker.patch.object(read_apriori, "s3_fileobject", side_effect=read)
+
+    def test_file_is_read_once(self, s3_fileobject, co_mipas):
+        store = read_apriori.AprioriStore()
+        datadict, uri = store.get("CO", "mipas")
+        assert uri == "s3://odin-apriori/apriori_CO_mipas.mat"
+        expected = read_apriori.get_datadict(co_mipas, "MIPAS")
+        for key, value in expected.items():
+            np.testing.assert_array_equal(datadict[key], value)
+        assert store.get("CO", "mipas")[0] is datadict
+        s3_fileobject.assert_called_once_with(uri)
+
+    def test_missing_file(self, s3_fileobject):
+        with pytest.raises(read_apriori.AprioriException):
+            read_apriori.AprioriStore().get("XX")
+
+    def test_cache_dir_is_used_after_restart(self, s3_fileobject, tmp_path):
+        datadict, _ = read_apriori.AprioriStore(str(tmp_path)).get("CO2")
+        assert (tmp_path / "apriori_CO2.npz").exists()
+        cached, uri = read_apriori.AprioriStore(str(tmp_path)).get("CO2")
+        assert uri == "s3://odin-apriori/apriori_CO2.mat"
+        assert s3_fileobject.call_count == 1
+        assert cached.keys() == datadict.keys()
+        for key, value in datadict.items():
+            np.testing.assert_array_equal(cached[key], value)
+
+    def test_version_is_the_same_after_restart(self, s3_fileobject, tmp_path):
+        version = read_apriori.AprioriStore(str(tmp_path)).version("CO2")
+        assert read_apriori.AprioriStore(str(tmp_path)).version("CO2") == version
+        assert read_apriori.AprioriStore().version("CO", "mipas") != version
+
+    def test_preload_skips_missing_species(self, s3_fileobject):
+        store = read_apriori.AprioriStore()
+        store.preload(["CO2", "XX"])
+        store.get("CO2")
+        assert s3_fileobject.call_count == 2
+
+
 @pytest.mark.aws
 def test_returns_expected_data_keys(app_context):
     species = "CO2"
@@ -0,0 +1,137 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from odinapi.views import scan_index, views_cached
+from odinapi.views.scan_index import ScanIndex, make_keys
+
+SCANS = [
+    (2, 7014769904, date(2014, 12, 9)),
+    (1, 7014769904, date(2014, 12, 8)),
+    (13, 7002887494, date(2014, 11, 1)),
+]
+
+
+def result(mocker, scans):
+    rows = [(freqmode, scanid, day.toordinal()) for freqmode, scanid, day in scans]
+    result = mocker.Mock()
+    result.partitions.return_value = [rows[:2], rows[2:]] if rows else []
+    return result
+
+
+@pytest.fixture
+def execute(mocker):
+    execute = mocker.patch.object(scan_index.db.session, "execute")
+    execute.return_value = result(mocker, SCANS)
+    return execute
+
+
+def loaded(index: ScanIndex) -> ScanIndex:
+    """Wait for the background load started by the first get"""
+    assert index._loader is not None
+    index._loader.join()
+    return index
+
+
+class TestScanIndex:
+    def test_keys_are_sorted(self, execute, db_context):
+        index = ScanIndex()
+        index.load()
+        assert np.all(np.diff(index.keys) > 0)
+        assert index.keys.dtype == np.int64
+        assert index.days.dtype == np.int32
+        assert execute.call_args.kwargs["execution_options"]["yield_per"] > 1
+
+    def test_get(self, execute, db_context):
+        index = ScanIndex()
+        assert index.get(2, 7014769904) is None
+        loaded(index)
+        for freqmode, scanid, day in SCANS:
+            assert index.get(freqmode, scanid) == day
+        assert index.get(2, 7002887494) is None
+        assert index.get(3, 1) is None
+        assert execute.call_count == 1
+
+    def test_empty(self, execute, db_context, mocker):
+        execute.return_value = result(mocker, [])
+        index = ScanIndex()
+        assert index.get(2, 7014769904) is None
+        assert len(loaded(index).keys) == 0
+        assert index.loaded is not None
+
+    def test_recent_days_are_refreshed(self, execute, db_context, mocker):
+        index = ScanIndex(max_age=0, refresh_days=7)
+        index.load()
+        execute.return_value = result(
+            mocker,
+            [
+                (2, 7014769904, date(2014, 12, 10)),
+                (2, 7015000000, date(2014, 12, 11)),
+            ],
+        )
+        assert index.get(2, 7015000000) == date(2014, 12, 11)
+        assert execute.call_args.kwargs["params"]["d"] == date(2014, 12, 2)
+        assert index.get(2, 7014769904) == date(2014, 12, 10)
+        # dropped from the refreshed days
+        assert index.get(1, 7014769904) is None
+        assert index.get(13, 7002887494) == date(2014, 11, 1)
+        assert len(index.keys) == 3
+
+    def test_readers_do_not_wait_for_a_refresh(self, execute, db_context):
+        index = ScanIndex(max_age=0)
+        index.load()
+        execute.reset_mock()
+        with index._lock:
+            assert index.get(2, 7014769904) == date(2014, 12, 9)
+        assert execute.call_count == 0
+
+    def test_not_found_while_loading(self, execute, db_context):
+        index = ScanIndex()
+        with index._lock:
+            assert index.get(2, 7014769904) is None
+        assert execute.call_count == 0
+        assert index.get(2, 7014769904) is None
+        assert loaded(index).get(2, 7014769904) == date(2014, 12, 9)
+
+    def test_failed_load_is_tried_again(self, execute, db_context, mocker):
+        execute.side_effect = RuntimeError("no database")
+        index = ScanIndex()
+        assert index.get(2, 7014769904) is None
+        assert loaded(index).loaded is None
+        execute.side_effect = None
+        index.get(2, 7014769904)
+        assert loaded(index).get(2, 7014769904) == date(2014, 12, 9)
+
+
+def test_make_keys():
+    assert make_keys(2, 7014769904) != make_keys(1, 7014769904)
+    assert make_keys([1, 2], [10, 10]).tolist() == [(10 << 8) | 1, (10 << 8) | 2]
+
+
+class TestGetScanRowsCached:
+    def test_scan_is_looked_up_by_date(self, mocker, db_context):
+        mocker.patch.object(
+            views_cached, "get_scan_date", return_value=date(2014, 12, 9)
+        )
+        execute = mocker.patch.object(views_cached.db.session, "execute")
+        execute.return_value.all.return_value = ["row"]
+        assert views_cached.get_scan_rows_cached(2, "AC1", 7014769904) == ["row"]
+        assert execute.call_count == 1
+        assert execute.call_args.kwargs["params"]["d"] == date(2014, 12, 9)
+
+    def test_scan_not_found_by_date(self, mocker, db_context):
+        mocker.patch.object(
+            views_cached, "get_scan_date", return_value=date(2014, 12, 9)
+        )
+        execute = mocker.patch.object(views_cached.db.session, "execute")
+        execute.return_value.all.side_effect = [[], ["row"]]
+        assert views_cached.get_scan_rows_cached(2, "AC1", 7014769904) == ["row"]
+        assert "d" not in execute.call_args.kwargs["params"]
+
+    def test_scan_not_in_index(self, mocker, db_context):
+        mocker.patch.object(views_cached, "get_scan_date", return_value=None)
+        execute = mocker.patch.object(views_cached.db.session, "execute")
+        execute.return_value.all.return_value = []
+        assert views_cached.get_scan_rows_cached(2, "AC1", 7014769904) == []
+        assert execute.call_count == 1
@@ -0,0 +1,136 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from http.client import NOT_MODIFIED, OK
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy.exc import ProgrammingError
+
+from odinapi.utils import data_version
+from odinapi.views import statistics
+
+
+def count_row(freqmode, period, count):
+    return MagicMock(freqmode=freqmode, period=period, sum=count)
+
+
+@pytest.fixture
+def execute(mocker):
+    return mocker.patch.object(statistics.db.session, "execute")
+
+
+@pytest.fixture
+def data_version_cache(mocker):
+    mocker.patch.object(data_version, "_cache", None)
+    mocker.patch.object(data_version, "_version_cache", None)
+
+
+class TestFreqmodeStatistics:
+    URL = "/rest_api/v5/statistics/freqmode/"
+
+    @pytest.fixture
+    def execute(self, execute, data_version_cache):
+        imported = MagicMock()
+        imported.scalar_one.return_value = datetime(2020, 1, 2, 3, 4, 5)
+        imported.scalar_one_or_none.return_value = datetime(2020, 1, 2, 3, 4, 5)
+        execute.side_effect = lambda query, **kwargs: (
+            imported
+            if "level0_files_imported" in str(query)
+            or "materialise_state" in str(query)
+            else [MagicMock(_asdict=lambda: {"freqmode": 1, "sum": 10})]
+        )
+        return execute
+
+    def test_totals_are_cached(self, execute, test_client):
+        resp = test_client.get(self.URL)
+        assert resp.status_code == OK
+        assert resp.json == {"Data": [{"freqmode": 1, "sum": 10}]}
+        assert resp.last_modified == datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+        assert resp.get_etag()[0]
+        assert "measurements_monthly" in str(execute.call_args.args[0])
+        resp = test_client.get(self.URL)
+        assert resp.status_code == OK
+        assert execute.call_count == 3
+        test_client.get(self.URL + "?year=2015")
+        assert execute.call_count == 4
+        assert execute.call_args.kwargs["params"] == {"y1": 2015, "y2": 2015}
+
+    def test_monthly_rollup_is_missing(self, execute, test_client):
+        side_effect = execute.side_effect
+
+        def monthly_is_missing(query, **kwargs):
+            if "measurements_monthly" in str(query):
+                raise ProgrammingError(str(query), kwargs, Exception())
+            return side_effect(query, **kwargs)
+
+        execute.side_effect = monthly_is_missing
+        resp = test_client.get(self.URL + "?year=2015")
+        assert resp.status_code == OK
+        assert resp.json == {"Data": [{"freqmode": 1, "sum": 10}]}
+        assert "measurements_cache" in str(execute.call_args.args[0])
+        assert execute.call_args.kwargs["params"] == {"y1": 2015, "y2": 2015}
+
+    def test_etag_differs_between_years(self, execute, test_client):
+        etag = test_client.get(self.URL).get_etag()[0]
+        assert test_client.get(self.URL + "?year=2015").get_etag()[0] != etag
+
+    def test_revalidation(self, execute, test_client):
+        etag = test_client.get(self.URL).get_etag()[0]
+        resp = test_client.get(self.URL, headers={"If-None-Match": f'"{etag}"'})
+        assert resp.status_code == NOT_MODIFIED
+        resp = test_client.get(
+            self.URL, headers={"If-Modified-Since": "Thu, 02 Jan 2020 03:04:05 GMT"}
+        )
+        assert resp.status_code == NOT_MODIFIED
+
+    def test_no_imports(self, execute, test_client):
+        execute.side_effect = None
+        execute.return_value.scalar_one.return_value = None
+        execute.return_value.scalar_one_or_none.return_value = None
+        execute.return_value.__iter__.return_value = []
+        resp = test_client.get(self.URL)
+        assert resp.status_code == OK
+        assert resp.json == {"Data": []}
+        assert resp.get_etag() == (None, None)
+
+
+class TestTimelineFreqmodeStatistics:
+    URL = "/rest_api/v5/statistics/freqmode/timeline/"
+
+    def test_years_are_counted_in_one_query(self, execute, test_client):
+        execute.return_value = [
+            count_row(1, datetime(2002, 1, 1), Decimal(10)),
+            count_row(1, datetime(2004, 1, 1), Decimal(20)),
+            count_row(2, datetime(2001, 1, 1), Decimal(5)),
+        ]
+        resp = test_client.get(self.URL)
+        assert resp.status_code == OK
+        years = list(range(2001, datetime.now().year + 1))
+        assert resp.json["Years"] == years
+        expect_1 = [[year, 0] for year in years]
+        expect_1[1][1] = 10
+        expect_1[3][1] = 20
+        expect_2 = [[year, 0] for year in years]
+        expect_2[0][1] = 5
+        assert resp.json["Data"] == {"1": expect_1, "2": expect_2}
+        assert execute.call_count == 1
+
+    def test_months_are_counted_in_one_query(self, execute, test_client):
+        execute.return_value = [
+            count_row(13, datetime(2010, 12, 1), 3),
+            count_row(13, datetime(2010, 2, 1), 4),
+        ]
+        resp = test_client.get(self.URL + "?year=2010")
+        assert resp.status_code == OK
+        assert resp.json["Year"] == 2010
+        expect = [[month, 0] for month in range(1, 13)]
+        expect[1][1] = 4
+        expect[11][1] = 3
+        assert resp.json["Data"] == {"13": expect}
+        assert execute.call_count == 1
+
+    def test_no_scans(self, execute, test_client):
+        execute.return_value = []
+        resp = test_client.get(self.URL + "?year=2000")
+        assert resp.status_code == OK
+        assert resp.json["Data"] == {}
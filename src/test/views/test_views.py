@@ -1,9 +1,15 @@
-from http.client import OK
+import json
+from datetime import date, datetime
+from http.client import BAD_REQUEST, NOT_MODIFIED, OK
 
 import numpy as np
-from unittest.mock import patch
+import pyarrow as pa
+import pytest
+from sqlalchemy.exc import ProgrammingError
+from unittest.mock import MagicMock, patch
 
 
+@pytest.mark.usefixtures("data_version")
 class TestAPR:
     APRIORI = {
         "vmr": np.array([1, 2, 3], dtype=float),
@@ -12,6 +18,12 @@ class TestAPR:
         "species": "CO2",
     }
 
+    @pytest.fixture(autouse=True)
+    def store(self):
+        with patch("odinapi.views.views.get_apriori_store") as get_apriori_store:
+            get_apriori_store.return_value.version.return_value = "1"
+            yield get_apriori_store.return_value
+
     @patch("odinapi.views.views.get_geoloc_info")
     @patch("odinapi.views.views.get_apriori")
     @patch("odinapi.views.views.get_scan_log_data")
@@ -39,7 +51,49 @@ class TestAPR:
         assert resp.status_code == OK, resp.json
         get_apriori.assert_called_with("CO2", 15, 16, source="mipas")
 
+    @patch("odinapi.views.views.get_geoloc_info")
+    @patch("odinapi.views.views.get_apriori")
+    @patch("odinapi.views.views.get_scan_log_data")
+    def test_etag_changes_with_the_apriori_data(
+        self, get_scan_log_data, get_apriori, get_geoloc_info, store, test_client
+    ):
+        get_apriori.return_value = self.APRIORI
+        get_geoloc_info.return_value = ("x", 15, 16, "y")
+        url = "/rest_api/v5/level1/11/72/apriori/CO2/?aprsource=mipas"
+        etag = test_client.get(url).get_etag()[0]
+        resp = test_client.get(url, headers={"If-None-Match": f'"{etag}"'})
+        assert resp.status_code == NOT_MODIFIED
+        store.version.assert_called_with("CO2", "mipas")
+        assert get_apriori.call_count == 1
+        store.version.return_value = "2"
+        resp = test_client.get(url, headers={"If-None-Match": f'"{etag}"'})
+        assert resp.status_code == OK
+
+
+@pytest.mark.usefixtures("data_version")
+class TestPTZ:
+    @patch("odinapi.views.views.get_ptz")
+    @patch("odinapi.views.views.get_geoloc_info")
+    @patch("odinapi.views.views.get_scan_log_data")
+    def test_etag_changes_with_the_ptz_files(
+        self, get_scan_log_data, get_geoloc_info, get_ptz, test_client
+    ):
+        get_ptz.return_value = {"Altitude": [1000]}
+        get_geoloc_info.return_value = (58000, 15, 16, 17)
+        url = "/rest_api/v5/level1/2/42/ptz/"
+        with patch("odinapi.views.views.get_ptz_store") as get_ptz_store:
+            store = get_ptz_store.return_value
+            store.scan_version.return_value = [("ac1/2a/2a.ac1.parquet", "1")]
+            etag = test_client.get(url).get_etag()[0]
+            resp = test_client.get(url, headers={"If-None-Match": f'"{etag}"'})
+            assert resp.status_code == NOT_MODIFIED
+            store.scan_version.assert_called_with("AC1", 42)
+            store.scan_version.return_value = [("ac1/2a/2a.ac1.parquet", "2")]
+            resp = test_client.get(url, headers={"If-None-Match": f'"{etag}"'})
+            assert resp.status_code == OK
+
 
+@pytest.mark.usefixtures("data_version")
 class TestFileInfo:
     @patch("odinapi.views.data_info.db.session.execute")
     def test_get_file_info(self, mock_execute, test_client):
@@ -56,3 +110,182 @@ class TestFileInfo:
             "fba": None,
             "shk": None,
         }
+
+    @patch("odinapi.views.data_info.db.session.execute")
+    def test_file_types_are_read_in_one_query(self, mock_execute, test_client):
+        mock_execute.return_value = [
+            MagicMock(file_type="ac1", created=datetime(2020, 1, 2, 3, 4, 5)),
+            MagicMock(file_type="shk", created=datetime(2020, 1, 1)),
+        ]
+        resp = test_client.get("/rest_api/v4/file_info/")
+        assert resp.status_code == OK
+        assert resp.json["ac1"] == "2020-01-02T03:04:05"
+        assert resp.json["shk"] == "2020-01-01T00:00:00"
+        assert resp.json["ac2"] is None
+        assert mock_execute.call_count == 1
+
+    @patch("odinapi.views.data_info.db.session.execute")
+    def test_latest_imports_are_missing(self, mock_execute, test_client):
+        def execute(query, params):
+            if "level0_files_latest" in str(query):
+                raise ProgrammingError(str(query), params, Exception())
+            return [MagicMock(file_type="ac1", created=datetime(2020, 1, 1))]
+
+        mock_execute.side_effect = execute
+        resp = test_client.get("/rest_api/v4/file_info/")
+        assert resp.status_code == OK
+        assert resp.json["ac1"] == "2020-01-01T00:00:00"
+        assert "level0_files_imported" in str(mock_execute.call_args.args[0])
+
+
+@pytest.mark.usefixtures("data_version")
+class TestL1bList:
+    SPECTRA = {"mjd": [58000.5]}
+
+    @patch("odinapi.views.views.scan2dictlist_v4", return_value={"STW": [1]})
+    @patch("odinapi.views.views.iter_scan_data_cached")
+    def test_scans_are_streamed(self, iter_scan_data, scan2dictlist, test_client):
+        iter_scan_data.return_value = iter([(41, self.SPECTRA), (42, {})])
+        resp = test_client.get("/rest_api/v5/level1/2/L1b/?scanid=42&scanid=41")
+        assert resp.status_code == OK
+        assert resp.mimetype == "application/x-ndjson"
+        assert [json.loads(line) for line in resp.text.splitlines()] == [
+            {"ScanID": 41, "Type": "L1b", "Data": {"STW": [1]}},
+            {"ScanID": 42, "Type": "L1b", "Data": None},
+        ]
+        iter_scan_data.assert_called_once_with("AC1", 2, [42, 41])
+
+    @patch("odinapi.views.views.scan2dictlist_v4", return_value={})
+    @patch("odinapi.views.views.iter_scan_data_cached")
+    @patch("odinapi.views.views.ScanInfoExporter")
+    def test_period_filters_on_scan_start(
+        self, exporter, iter_scan_data, scan2dictlist, test_client
+    ):
+        exporter.return_value.get_scanids.return_value = [1, 2, 3]
+        iter_scan_data.return_value = iter(
+            [(1, {"mjd": [57999.9]}), (2, self.SPECTRA), (3, {})]
+        )
+        resp = test_client.get(
+            "/rest_api/v5/level1/2/L1b/"
+            "?start_time=2017-09-04T00:00:00&end_time=2017-09-05T00:00:00"
+        )
+        assert resp.status_code == OK
+        assert [json.loads(line)["ScanID"] for line in resp.text.splitlines()] == [2]
+
+    def test_scanids_and_period_is_bad_request(self, test_client):
+        resp = test_client.get(
+            "/rest_api/v5/level1/2/L1b/?scanid=1&start_time=2017-09-04"
+        )
+        assert resp.status_code == BAD_REQUEST
+
+    def test_too_many_scans_is_bad_request(self, db_app, test_client, monkeypatch):
+        monkeypatch.setitem(db_app.config, "L1B_BULK_MAX_SCANS", 1)
+        resp = test_client.get("/rest_api/v5/level1/2/L1b/?scanid=1&scanid=2")
+        assert resp.status_code == BAD_REQUEST
+
+
+class TestPTZList:
+    ROWS = [
+        MagicMock(
+            scanid=scanid,
+            mjdstart=58000.0,
+            mjdend=58000.1,
+            latstart=10.0,
+            latend=10.0,
+            lonstart=20.0,
+            lonend=20.0,
+        )
+        for scanid in (41, 42)
+    ]
+
+    @pytest.fixture
+    def store(self):
+        with patch("odinapi.views.views.get_ptz_store") as get_ptz_store:
+            get_ptz_store.return_value.read_scans.return_value = pa.table(
+                {"ScanID": [42, 42], "z": [2, 1], "p": [1.0, 2.0], "t": [200.0, 210.0]}
+            )
+            yield get_ptz_store.return_value
+
+    @patch("odinapi.views.views.db.session.execute")
+    def test_scans_of_a_day(self, mock_execute, store, test_client):
+        mock_execute.return_value.all.return_value = self.ROWS
+        resp = test_client.get("/rest_api/v5/level1/2/ptz/?date=2017-09-04")
+        assert resp.status_code == OK
+        assert resp.json["Type"] == "ptz"
+        assert resp.json["Count"] == 2
+        assert resp.json["Data"][0] == {"ScanID": 41, "Data": None}
+        assert resp.json["Data"][1]["ScanID"] == 42
+        assert resp.json["Data"][1]["Data"]["Altitude"] == [1000, 2000]
+        store.read_scans.assert_called_once_with("AC1", [41, 42])
+        assert mock_execute.call_args[1]["params"]["d"] == date(2017, 9, 4)
+
+    @patch("odinapi.views.views.db.session.execute")
+    def test_scans_without_log_get_no_data(self, mock_execute, store, test_client):
+        mock_execute.return_value.all.return_value = self.ROWS[1:]
+        resp = test_client.get("/rest_api/v5/level1/2/ptz/?scanid=43&scanid=42")
+        assert resp.status_code == OK
+        assert [scan["ScanID"] for scan in resp.json["Data"]] == [43, 42]
+        assert resp.json["Data"][0]["Data"] is None
+
+    @patch("odinapi.views.views.db.session.execute")
+    def test_arrow(self, mock_execute, store, test_client):
+        mock_execute.return_value.all.return_value = self.ROWS
+        resp = test_client.get(
+            "/rest_api/v5/level1/2/ptz/?date=2017-09-04&format=arrow"
+        )
+        assert resp.status_code == OK
+        assert resp.mimetype == "application/vnd.apache.arrow.stream"
+        table = pa.ipc.open_stream(resp.data).read_all()
+        assert table["ScanID"].to_pylist() == [41, 42]
+        assert table["Altitude"].to_pylist() == [None, [1000, 2000]]
+
+    @pytest.mark.parametrize(
+        "query",
+        [
+            "",
+            "?scanid=1&date=2017-09-04",
+            "?date=20170904",
+            "?scanid=x",
+            "?date=2017-09-04&format=npz",
+        ],
+    )
+    def test_bad_request(self, query, test_client):
+        resp = test_client.get(f"/rest_api/v5/level1/2/ptz/{query}")
+        assert resp.status_code == BAD_REQUEST
+
+    def test_too_many_scans_is_bad_request(self, db_app, test_client, monkeypatch):
+        monkeypatch.setitem(db_app.config, "PTZ_BULK_MAX_SCANS", 1)
+        resp = test_client.get("/rest_api/v5/level1/2/ptz/?scanid=1&scanid=2")
+        assert resp.status_code == BAD_REQUEST
+
+
+@pytest.mark.usefixtures("data_version")
+class TestVdsScanInfo:
+    @patch("odinapi.views.views.db.session.execute")
+    def test_scans_are_streamed(self, mock_execute, test_client):
+        keys = [
+            "scanid",
+            "freqmode",
+            "backend",
+            "altend",
+            "altstart",
+            "latend",
+            "latstart",
+            "lonend",
+            "lonstart",
+            "mjdend",
+            "mjdstart",
+            "numspec",
+            "sunzd",
+        ]
+        row = dict.fromkeys(keys, 1)
+        row["date"] = date(2015, 1, 11)
+        mock_execute.return_value = [
+            MagicMock(_asdict=MagicMock(return_value=row)) for _ in range(2)
+        ]
+        resp = test_client.get("/rest_api/v4/vds/AC1/1/allscans")
+        assert resp.status_code == OK
+        assert resp.is_streamed
+        assert list(resp.json) == ["VDS"]
+        assert len(resp.json["VDS"]) == 2
+        assert resp.json["VDS"][0]["Info"]["Date"] == "2015-01-11"
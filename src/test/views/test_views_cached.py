@@ -0,0 +1,153 @@
+import json
+from datetime import date, datetime
+from http.client import BAD_REQUEST, NOT_FOUND, OK
+from unittest.mock import MagicMock
+
+import pytest
+
+from odinapi.utils.defs import SPECIES
+from odinapi.views import views_cached
+
+
+def scan_row(scanid):
+    return {
+        "date": datetime(2015, 1, 11).date(),
+        "freqmode": 1,
+        "backend": "AC2",
+        "scanid": scanid,
+        "altend": 1.0,
+        "altstart": 2.0,
+        "latend": 3.0,
+        "latstart": 4.0,
+        "lonend": 5.0,
+        "lonstart": 6.0,
+        "mjdend": 57033.1,
+        "mjdstart": 57033.0,
+        "numspec": 10,
+        "sunzd": 90.0,
+        "datetime": datetime(2015, 1, 11, 12),
+        "quality": 0,
+    }
+
+
+def scan_result(scanids):
+    result = MagicMock()
+    result.mappings.return_value = [scan_row(scanid) for scanid in scanids]
+    result.all.return_value = [MagicMock(scanid=scanid) for scanid in scanids]
+    return result
+
+
+@pytest.fixture
+def execute(mocker):
+    return mocker.patch.object(views_cached.db.session, "execute")
+
+
+@pytest.mark.usefixtures("data_version")
+class TestL1LogCachedList:
+    URL = "/rest_api/v5/level1/1/scans/"
+
+    def test_scans_are_read_with_one_query(self, execute, test_client):
+        execute.return_value = scan_result([1, 2, 3])
+        resp = test_client.get(
+            self.URL + "?start_time=2015-01-11&end_time=2015-01-20&apriori=O3"
+        )
+        assert resp.status_code == OK
+        assert resp.is_streamed
+        assert resp.json["Type"] == "Log"
+        assert resp.json["Count"] == 3
+        assert [scan["ScanID"] for scan in resp.json["Data"]] == [1, 2, 3]
+        assert set(resp.json["Data"][0]["URLS"]) == {
+            "URL-log",
+            "URL-spectra",
+            "URL-ptz",
+            "URL-apriori-O3",
+        }
+        assert "Link" not in resp.headers
+        assert execute.call_count == 1
+        params = execute.call_args.kwargs["params"]
+        assert params["t1"] == datetime(2015, 1, 11)
+        assert params["t2"] == datetime(2015, 1, 20)
+        assert params["d1"] == date(2015, 1, 10)
+        assert params["d2"] == date(2015, 1, 20)
+        assert params["b"] == "AC2"
+        assert "date between :d1 and :d2" in str(execute.call_args.args[0])
+
+    def test_empty_period(self, execute, test_client):
+        execute.return_value = scan_result([])
+        resp = test_client.get(self.URL + "?start_time=2015-01-11&end_time=2015-01-12")
+        assert resp.status_code == OK
+        assert resp.json == {"Type": "Log", "Data": [], "Count": 0}
+
+    def test_limit_gives_link_to_next_page(self, execute, test_client):
+        execute.side_effect = [scan_result([2, 3]), scan_result([1, 2])]
+        resp = test_client.get(
+            self.URL + "?start_time=2015-01-11&end_time=2015-01-20&limit=2"
+        )
+        assert resp.status_code == OK
+        assert resp.json["Count"] == 2
+        link = resp.headers["Link"]
+        assert link.endswith('; rel="next"')
+        assert "after=2" in link
+        assert "limit=2" in link
+        assert execute.call_args.kwargs["params"]["l"] == 2
+
+    def test_last_page_has_no_link(self, execute, test_client):
+        execute.side_effect = [scan_result([3]), scan_result([3])]
+        resp = test_client.get(
+            self.URL + "?start_time=2015-01-11&end_time=2015-01-20&limit=2&after=2"
+        )
+        assert resp.status_code == OK
+        assert "Link" not in resp.headers
+        assert execute.call_args.kwargs["params"]["a"] == 2
+
+    @pytest.mark.parametrize(
+        "query",
+        (
+            "",
+            "?start_time=2015-01-11",
+            "?start_time=2015-01-13&end_time=2015-01-11",
+            "?start_time=2015-01-11&end_time=2015-01-13&limit=0",
+            "?start_time=2015-01-11&end_time=2015-01-13&after=x",
+        ),
+    )
+    def test_bad_request(self, execute, test_client, query):
+        assert test_client.get(self.URL + query).status_code == BAD_REQUEST
+        execute.assert_not_called()
+
+    def test_unknown_freqmode(self, execute, test_client):
+        resp = test_client.get(
+            "/rest_api/v5/level1/42/scans/?start_time=2015-01-11&end_time=2015-01-13"
+        )
+        assert resp.status_code == NOT_FOUND
+
+    def test_ndjson_by_accept_header(self, execute, test_client):
+        execute.return_value = scan_result([1, 2])
+        resp = test_client.get(
+            self.URL + "?start_time=2015-01-11&end_time=2015-01-20",
+            headers={"Accept": "application/x-ndjson"},
+        )
+        assert resp.status_code == OK
+        assert resp.mimetype == "application/x-ndjson"
+        lines = resp.data.decode().splitlines()
+        assert [json.loads(line)["ScanID"] for line in lines] == [1, 2]
+
+
+@pytest.mark.usefixtures("data_version")
+class TestFreqmodeInfoCachedNoBackend:
+    URL = "/rest_api/v5/freqmode_info/2015-01-11/1/"
+
+    def test_scans_are_streamed(self, execute, test_client):
+        execute.return_value = scan_result([1, 2])
+        resp = test_client.get(self.URL)
+        assert resp.status_code == OK
+        assert resp.is_streamed
+        assert resp.json["Count"] == 2
+        assert resp.json["Data"][1]["ScanID"] == 2
+        assert resp.json["Data"][1]["DateTime"] == "2015-01-11T12:00:00"
+        assert len(resp.json["Data"][0]["URLS"]) == 3 + len(SPECIES)
+        assert execute.call_args.kwargs["execution_options"]["yield_per"] > 1
+
+    def test_unknown_freqmode(self, execute, test_client):
+        resp = test_client.get("/rest_api/v5/freqmode_info/2015-01-11/42/")
+        assert resp.status_code == NOT_FOUND
+        execute.assert_not_called()